@@ -0,0 +1,147 @@
+"""Arquivamento dos meses fechados da tabela transacao em arquivos Parquet
+
+Cada mês vira um arquivo em <diretorio>/ano=AAAA/mes=MM/transacao.parquet, partição no formato
+do Hive que o pyarrow, o pandas e outras ferramentas leem como um único conjunto de dados.
+Com a remoção, as transações do mês são apagadas da tabela transacao e as consultas passam
+a lê-las do arquivo (models.MesArquivado), mantendo a tabela e os seus índices pequenos
+"""
+import logging
+import os
+from datetime import date
+import sqlalchemy
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import select, func
+from models import Transacao, MesArquivado
+
+logger = logging.getLogger(__name__)
+
+ESQUEMA_ARQUIVO = pa.schema([
+    ("nsu", pa.int64()), ("data_transacao", pa.timestamp("us")), ("pdv", pa.int32()),
+    ("codigo_operador", pa.int32()), ("tipo_transacao", pa.string()), ("estado_transacao", pa.string()),
+    ])
+# Linhas lidas do banco por vez e por grupo de linhas do Parquet
+TAMANHO_LOTE = 100_000
+
+
+def caminho_particao(diretorio:str, ano:int, mes:int) -> str:
+    """
+    Args:
+        diretorio (str): raiz do arquivo
+        ano (int): formato YYYY
+        mes (int): formato MM
+
+    Returns:
+        str: caminho absoluto do arquivo Parquet do mês
+    """
+    return os.path.abspath(os.path.join(diretorio, f"ano={ano:04d}", f"mes={mes:02d}", "transacao.parquet"))
+
+
+def meses_fechados(session:sqlalchemy.orm.session.Session, ate:date) -> list:
+    """Meses com transações na tabela transacao, do mais antigo até o mês de "ate", incluso,
+    sem passar do mês anterior ao atual
+
+    Args:
+        session (sqlalchemy.orm.session.Session): Session do SQLAlchemy
+        ate (date): qualquer dia do último mês a arquivar
+
+    Returns:
+        list: tuplas (ano, mes) em ordem cronológica
+    """
+    hoje = date.today()
+    ultimo = min((ate.year, ate.month), (hoje.year, hoje.month - 1) if hoje.month > 1 else (hoje.year - 1, 12))
+    limite = Transacao._limites_mes(ultimo[1], ultimo[0])[1]
+    primeira = session.execute(
+        select(func.min(Transacao.data_transacao)).where(Transacao.data_transacao < limite)
+        ).scalar()
+    if primeira is None:
+        return []
+    meses = []
+    ano, mes = primeira.year, primeira.month
+    while (ano, mes) <= ultimo:
+        meses.append((ano, mes))
+        ano, mes = (ano + 1, 1) if mes == 12 else (ano, mes + 1)
+    return meses
+
+
+def arquivar_mes(session:sqlalchemy.orm.session.Session, ano:int, mes:int, diretorio:str, remover:bool=False) -> int:
+    """Grava as transações do mês no Parquet da partição, ordenadas por data_transacao,
+    e registra o mês em MesArquivado. O arquivo é escrito num temporário e renomeado,
+    assim uma partição nunca fica pela metade
+
+    Args:
+        session (sqlalchemy.orm.session.Session): Session do SQLAlchemy
+        ano (int): formato YYYY
+        mes (int): formato MM
+        diretorio (str): raiz do arquivo
+        remover (bool, optional): apaga as transações do mês da tabela transacao, na mesma transação
+            do banco que registra o mês. Padrão False, apenas exporta.
+
+    Raises:
+        ValueError: o mês já foi removido ou o total apagado difere do arquivado, nada é apagado
+
+    Returns:
+        int: transações arquivadas, 0 quando o mês está vazio e nenhum arquivo é gravado
+    """
+    registro = session.get(MesArquivado, (ano, mes))
+    if registro is not None and registro.removido:
+        raise ValueError(f"Mês {mes:02d}/{ano} já foi arquivado e removido em {registro.caminho}")
+    inicio, fim = Transacao._limites_mes(mes, ano)
+    periodo = (Transacao.data_transacao >= inicio, Transacao.data_transacao < fim)
+    # pelo ORM, para que tipo e estado voltem como texto e as datas como datetime em qualquer banco
+    consulta = select(*(getattr(Transacao, campo.name) for campo in ESQUEMA_ARQUIVO)).where(*periodo).order_by(
+        Transacao.data_transacao
+        ).execution_options(yield_per=TAMANHO_LOTE)
+
+    caminho = caminho_particao(diretorio, ano, mes)
+    temporario = f"{caminho}.tmp"
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    linhas = 0
+    with pq.ParquetWriter(temporario, ESQUEMA_ARQUIVO) as escritor:
+        for lote in session.execute(consulta).partitions():
+            colunas = zip(*lote)
+            escritor.write_batch(pa.RecordBatch.from_arrays(
+                [pa.array(valores, type=campo.type) for valores, campo in zip(colunas, ESQUEMA_ARQUIVO)],
+                schema=ESQUEMA_ARQUIVO
+                ), row_group_size=TAMANHO_LOTE)
+            linhas += len(lote)
+    if linhas == 0:
+        os.remove(temporario)
+        session.rollback()
+        logger.info("Mês %02d/%s sem transações, nada arquivado", mes, ano)
+        return 0
+    os.replace(temporario, caminho)
+
+    MesArquivado.registrar(session, ano, mes, caminho, linhas, remover)
+    if remover:
+        apagadas = session.execute(sqlalchemy.delete(Transacao.__table__).where(*periodo)).rowcount
+        if apagadas != linhas:
+            # transações gravadas no mês depois da leitura ficariam fora do arquivo
+            session.rollback()
+            raise ValueError(f"Mês {mes:02d}/{ano}: {linhas} transações arquivadas e {apagadas} a apagar, nada removido")
+    session.commit()
+    logger.info("Mês %02d/%s: %s transações arquivadas em %s%s", mes, ano, linhas, caminho, ", removidas do banco" if remover else "")
+    return linhas
+
+
+def arquivar(session:sqlalchemy.orm.session.Session, diretorio:str, ate:date, remover:bool=False) -> dict:
+    """Arquiva cada mês fechado até o mês de "ate", pulando os já removidos
+
+    Args:
+        session (sqlalchemy.orm.session.Session): Session do SQLAlchemy
+        diretorio (str): raiz do arquivo
+        ate (date): qualquer dia do último mês a arquivar, limitado ao mês anterior ao atual
+        remover (bool, optional): apaga da tabela transacao as transações arquivadas. Padrão False.
+
+    Returns:
+        dict: transações arquivadas por "MM/AAAA"
+    """
+    removidos = MesArquivado.meses_removidos(session)
+    resultado = {}
+    for ano, mes in meses_fechados(session, ate):
+        if ano * 100 + mes in removidos:
+            continue
+        linhas = arquivar_mes(session, ano, mes, diretorio, remover)
+        if linhas:
+            resultado[f"{mes:02d}/{ano}"] = linhas
+    return resultado
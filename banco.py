@@ -0,0 +1,30 @@
+"""Criação do engine do SQLAlchemy compartilhada pelo dashboard, comandos e scripts
+"""
+import os
+import sqlalchemy
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+
+
+def criar_engine(url:str=None) -> sqlalchemy.engine.Engine:
+    """Cria o engine com pool de conexões configurável por variáveis de ambiente
+    DATABASE_POOL_SIZE (padrão 5), DATABASE_MAX_OVERFLOW (padrão 10) e
+    DATABASE_POOL_RECYCLE em segundos (padrão 1800, abaixo do wait_timeout usual do MariaDB).
+    Conexões são testadas antes do uso, assim as derrubadas pelo servidor por ociosidade são refeitas
+
+    Args:
+        url (str, optional): URL do banco, padrão é a variável de ambiente DATABASE_URL
+
+    Returns:
+        sqlalchemy.engine.Engine: engine pronto para criar sessões
+    """
+    url = make_url(url or os.getenv("DATABASE_URL"))
+    opcoes = {
+        "pool_pre_ping": True,
+        "pool_recycle": int(os.getenv("DATABASE_POOL_RECYCLE", "1800")),
+    }
+    # SQLite usa pools próprios, sem tamanho configurável
+    if url.get_backend_name() != "sqlite":
+        opcoes["pool_size"] = int(os.getenv("DATABASE_POOL_SIZE", "5"))
+        opcoes["max_overflow"] = int(os.getenv("DATABASE_MAX_OVERFLOW", "10"))
+    return create_engine(url, **opcoes)
@@ -0,0 +1,129 @@
+"""Tempo até a primeira página do dashboard depois de reiniciar o serviço e de cada nova execução
+
+Cada reinício é um processo Python novo, como o systemd ao reiniciar o dashboard_pix.service,
+que executa dashboard.py pelo AppTest do Streamlit num banco já criado por main.py init-banco:
+    dashboard.importacao_streamlit  import do streamlit, feito pelo servidor antes da primeira conexão
+    dashboard.primeira_execucao     primeira execução do script: importa a página, cria o engine, consulta e desenha
+    dashboard.reexecucao            execuções seguintes na mesma sessão, como ao mudar um filtro
+
+O relatório JSON tem o formato do benchmarks.executar, comparável com --comparar
+
+Uso, a partir da raiz do repositório:
+    python -m benchmarks.bench_inicio_dashboard --reinicios 5 --reexecucoes 20 --saida inicio.json
+    python -m benchmarks.executar --comparar base.json inicio.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# o processo filho mede o próprio início, por isso nada além da biblioteca padrão é importado aqui
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(RAIZ, "dashboard.py")
+
+
+def popular(url:str, linhas:int):
+    """Cria as tabelas e grava 200 operadores e transações dos últimos 30 dias, hoje incluso,
+    assim a página aberta com a data atual tem ranking, comparação e mapas para desenhar
+    """
+    import pandas as pd
+    from sqlalchemy.orm import sessionmaker
+    from banco import criar_engine
+    from models import Base, Operador, Transacao
+    engine = criar_engine(url)
+    Base.metadata.create_all(engine)
+    fim = datetime.now().replace(hour=22, minute=0, second=0, microsecond=0)
+    passo = (30 * 24 * 3600) / max(linhas, 1)
+    transacoes = pd.DataFrame({
+        "Nsu": range(linhas),
+        "Operador": [random.randint(1, 200) for _ in range(linhas)],
+        "Pdv": [f"P{i % 30:03d}" for i in range(linhas)],
+        "Transacao": "Compra Pix",
+        "Estado Transacao": "Efetuada PDV",
+        "Datetime": [fim - timedelta(seconds=int(i * passo)) for i in range(linhas)],
+        })
+    with sessionmaker(engine)() as session:
+        Operador.gravar_banco(pd.DataFrame({
+            "Código": range(1, 201), "Nome": [f"Operador {i}" for i in range(1, 201)], "Logname": [f"op{i}" for i in range(1, 201)],
+            }), session)
+        Transacao.gravar_banco(transacoes, session)
+    engine.dispose()
+
+
+def medir_processo(reexecucoes:int) -> dict:
+    """Executado no processo filho, recém iniciado: tempos em segundos de um reinício
+    """
+    inicio = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+    importacao = time.perf_counter() - inicio
+
+    app = AppTest.from_file(SCRIPT, default_timeout=300)
+    inicio = time.perf_counter()
+    app.run()
+    primeira = time.perf_counter() - inicio
+    if app.exception:
+        raise RuntimeError(f"Dashboard com erro: {app.exception[0].value}")
+    tempos = []
+    for _ in range(reexecucoes):
+        inicio = time.perf_counter()
+        app.run()
+        tempos.append(time.perf_counter() - inicio)
+    return {"importacao_streamlit": importacao, "primeira_execucao": primeira, "reexecucao": tempos}
+
+
+def executar(url:str, reinicios:int, reexecucoes:int, linhas:int) -> dict:
+    """Inicia um processo por reinício e monta o relatório
+    """
+    from benchmarks.executar import estatisticas, versao_codigo
+    ambiente = dict(os.environ, DATABASE_URL=url)
+    medicoes = []
+    for _ in range(reinicios):
+        saida = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_inicio_dashboard", "--filho", "--reexecucoes", str(reexecucoes)],
+            cwd=RAIZ, env=ambiente, capture_output=True, text=True, check=True
+            ).stdout
+        medicoes.append(json.loads(saida.strip().splitlines()[-1]))
+    return {
+        "versao": versao_codigo(),
+        "gerado_em": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "tamanho": f"dashboard {linhas}",
+        "casos": {
+            "dashboard.importacao_streamlit": estatisticas([m["importacao_streamlit"] for m in medicoes]),
+            "dashboard.primeira_execucao": estatisticas([m["primeira_execucao"] for m in medicoes]),
+            "dashboard.reexecucao": estatisticas([tempo for m in medicoes for tempo in m["reexecucao"]]),
+        },
+    }
+
+
+if __name__ == "__main__":
+    argumentos = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argumentos.add_argument("--reinicios", type=int, default=5, help="processos iniciados, cada um mede a primeira execução")
+    argumentos.add_argument("--reexecucoes", type=int, default=20, help="execuções seguintes medidas em cada processo")
+    argumentos.add_argument("--popular", type=int, default=50_000, help="transações sintéticas gravadas no banco temporário")
+    argumentos.add_argument("--saida", default=None, help="grava o relatório JSON neste arquivo")
+    argumentos.add_argument("--filho", action="store_true", help=argparse.SUPPRESS)
+    args = argumentos.parse_args()
+
+    if args.filho:
+        print(json.dumps(medir_processo(args.reexecucoes)))
+        sys.exit(0)
+
+    url = os.getenv("BENCH_DATABASE_URL")
+    if url is None:
+        url = f"sqlite:///{tempfile.mkdtemp()}/inicio.db"
+        popular(url, args.popular)
+    relatorio = executar(url, args.reinicios, args.reexecucoes, args.popular)
+    texto = json.dumps(relatorio, ensure_ascii=False, indent=2)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as arquivo:
+            arquivo.write(texto)
+    for caso, dados in relatorio["casos"].items():
+        print(f"{caso:<32} mediana {dados['mediana_s'] * 1000:10.2f} ms")
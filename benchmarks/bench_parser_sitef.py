@@ -0,0 +1,61 @@
+"""Compara o parser vetorizado do relatório SITEF com o caminho antigo linha a linha
+
+O caminho antigo fica só aqui, como referência de tempo: lê o CSV separado por ponto e vírgula
+inteiro, monta a coluna "Datetime" com um apply por linha e só então filtra as compras pix efetuadas
+
+Uso, a partir da raiz do repositório:
+    python -m benchmarks.bench_parser_sitef --linhas 1000000
+"""
+import argparse
+import io
+import time
+from datetime import datetime
+import pandas as pd
+from parsers import ParserRelatorioSITEF
+from benchmarks.gerador_sitef import gerar_csv_sitef
+
+FORMATO_DATETIME = "%d/%m/%Y %H:%M:%S"
+
+
+def ler_legado(conteudo:str) -> pd.DataFrame:
+    """Caminho antigo do ParserRelatorioSITEF, sem validação das linhas
+
+    Args:
+        conteudo (str): CSV do SITEF separado por ponto e vírgula
+
+    Returns:
+        pd.DataFrame: compras pix efetuadas com a coluna "Datetime"
+    """
+    df = pd.read_csv(io.StringIO(conteudo), sep=";")
+    df = df[ParserRelatorioSITEF.COLUNAS]
+    df['Datetime'] = df.apply(lambda x: f"{x['Data']} {x['Hora']}", axis=1)
+    df['Datetime'] = df.apply(lambda x: datetime.strptime(f"{x['Datetime']}", FORMATO_DATETIME), axis=1)
+    df = df[(df["Estado Transacao"] == "Efetuada PDV") & (df["Transacao"] == "Compra Pix")]
+    df["Operador"] = df["Operador"].astype(int)
+    return df
+
+
+def medir(ler, conteudo:str) -> tuple:
+    inicio = time.perf_counter()
+    df = ler(conteudo)
+    return time.perf_counter() - inicio, df
+
+
+if __name__ == "__main__":
+    argumentos = argparse.ArgumentParser(description=__doc__)
+    argumentos.add_argument("--linhas", type=int, default=1_000_000)
+    args = argumentos.parse_args()
+
+    buffer = io.StringIO()
+    gerar_csv_sitef(args.linhas, buffer)
+    conteudo = buffer.getvalue()
+    tempo_vetorizado, vetorizado = medir(lambda texto: ParserRelatorioSITEF(io.StringIO(texto)).df, conteudo)
+    tempo_legado, legado = medir(ler_legado, conteudo)
+    # os dois caminhos devem chegar às mesmas transações
+    for coluna in ("Datetime", "Operador", "Pdv"):
+        if list(vetorizado[coluna]) != list(legado[coluna]):
+            raise SystemExit(f"Coluna {coluna} difere entre o parser vetorizado e o legado")
+    print(f"Linhas: {args.linhas}")
+    print(f"Legado (apply por linha): {tempo_legado:.2f}s")
+    print(f"Vetorizado: {tempo_vetorizado:.2f}s")
+    print(f"Ganho: {tempo_legado / tempo_vetorizado:.1f}x")
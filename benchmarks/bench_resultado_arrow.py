@@ -0,0 +1,66 @@
+"""Compara a montagem de resultados pelo caminho colunar (pyarrow) com o caminho antigo por linha
+
+Caminho antigo: objetos do ORM com to_dict() ou lista de Row, DataFrame montado depois e astype nas colunas.
+Usa um SQLite em memória com 100 mil operadores.
+
+Uso, a partir da raiz do repositório:
+    python -m benchmarks.bench_resultado_arrow --linhas 100000
+"""
+import argparse
+import time
+import pandas as pd
+import sqlalchemy
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+from models import Base, Operador, Transacao, consulta_para_arrow
+
+
+def operadores_por_objeto(session) -> pd.DataFrame:
+    r = session.execute(select(Operador)).scalars().all()
+    return pd.DataFrame([x.to_dict() for x in r], columns=Operador.__table__.columns.keys())
+
+
+def ranking_por_linha(session, consulta) -> pd.DataFrame:
+    r = session.execute(consulta).all()
+    df = pd.DataFrame(r, columns=["codigo_operador", "nome_operador", "contagem_pix"])
+    df["codigo_operador"] = df["codigo_operador"].astype(int)
+    df["contagem_pix"] = df["contagem_pix"].astype(int)
+    return df
+
+
+def cronometrar(funcao, *args, repeticoes:int=5) -> float:
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao(*args)
+        tempos.append(time.perf_counter() - inicio)
+    return min(tempos)
+
+
+if __name__ == "__main__":
+    argumentos = argparse.ArgumentParser(description=__doc__)
+    argumentos.add_argument("--linhas", type=int, default=100_000)
+    args = argumentos.parse_args()
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(engine)
+    with Session() as session:
+        session.execute(sqlalchemy.insert(Operador.__table__), [
+            {"codigo_operador": i, "nome": f"Operador {i}", "login": f"op{i}"} for i in range(1, args.linhas + 1)
+            ])
+        session.commit()
+        tabela_operador = Operador.__table__
+        # mesmo formato do ranking (código, nome, contagem) com uma linha por operador
+        consulta = select(tabela_operador.c.codigo_operador, tabela_operador.c.nome, tabela_operador.c.id)
+
+        casos = (
+            ("operadores: objetos + to_dict", lambda: (session.expunge_all(), operadores_por_objeto(session))),
+            ("operadores: colunar", lambda: Operador.todos_para_df(session)),
+            ("ranking: Row + DataFrame + astype", lambda: ranking_por_linha(session, consulta)),
+            ("ranking: colunar (pyarrow)", lambda: consulta_para_arrow(session, consulta, Transacao.ESQUEMA_RANKING)),
+            ("ranking: colunar + to_pandas", lambda: consulta_para_arrow(session, consulta, Transacao.ESQUEMA_RANKING).to_pandas()),
+        )
+        print(f"Linhas no resultado: {args.linhas}")
+        for nome, funcao in casos:
+            print(f"{nome:<40} {cronometrar(funcao) * 1000:8.1f} ms")
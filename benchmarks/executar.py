@@ -0,0 +1,197 @@
+"""Suíte de benchmarks com relatório em JSON para comparar versões
+
+Casos, todos sobre um relatório SITEF sintético (benchmarks/gerador_sitef.py) e um SQLite em arquivo temporário:
+    parser.leitura           ParserRelatorioSITEF no arquivo inteiro, linhas do CSV por segundo
+    ingestao.gravacao        ingerir_transacoes num banco vazio, transações gravadas por segundo
+    consulta.ranking_dia     ranking de um dia inteiro, lido do resumo diário
+    consulta.ranking_parcial ranking de parte de um dia, lido da tabela transacao
+    consulta.mensal          tabela mensal do primeiro mês do relatório
+
+Uso, a partir da raiz do repositório:
+    python -m benchmarks.executar --tamanho 100k --saida resultado.json
+    python -m benchmarks.executar --comparar base.json resultado.json --limiar 0.1
+
+A comparação sai com código 1 quando algum caso ficou mais lento que o limiar, útil em integração contínua
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from models import Base, Operador, Transacao
+from parsers import ParserRelatorioSITEF
+from ingestao import ingerir_transacoes
+from benchmarks.gerador_sitef import TAMANHOS, INICIO, arquivo_sitef, operadores_df
+
+DIRETORIO_DADOS = os.path.join(os.path.dirname(__file__), "dados")
+
+
+def estatisticas(tempos:list, linhas:int=None) -> dict:
+    """Resumo das repetições no formato do pytest-benchmark, em segundos
+    """
+    resultado = {
+        "repeticoes": len(tempos),
+        "min_s": min(tempos),
+        "max_s": max(tempos),
+        "media_s": statistics.fmean(tempos),
+        "mediana_s": statistics.median(tempos),
+        "desvio_s": statistics.stdev(tempos) if len(tempos) > 1 else 0.0,
+    }
+    if linhas is not None:
+        resultado["linhas"] = linhas
+        resultado["linhas_por_segundo"] = round(linhas / resultado["mediana_s"])
+    return resultado
+
+
+def cronometrar(funcao, repeticoes:int, aquecimento:int=1) -> list:
+    for _ in range(aquecimento):
+        funcao()
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return tempos
+
+
+def banco_vazio(diretorio:str):
+    """SQLite em arquivo com as tabelas criadas e os operadores do relatório sintético
+    """
+    caminho = os.path.join(diretorio, "bench.db")
+    if os.path.exists(caminho):
+        os.remove(caminho)
+    engine = create_engine(f"sqlite:///{caminho}")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(engine, autoflush=False)
+    with Session() as session:
+        Operador.gravar_banco(operadores_df(), session)
+    return engine, Session
+
+
+def executar(tamanho:str, repeticoes:int, diretorio_dados:str) -> dict:
+    """Executa todos os casos e monta o relatório
+
+    Args:
+        tamanho (str): uma das chaves de TAMANHOS
+        repeticoes (int): repetições de cada caso de consulta e do parser
+        diretorio_dados (str): onde os relatórios sintéticos ficam guardados
+
+    Returns:
+        dict: relatório com ambiente e estatísticas por caso
+    """
+    csv = arquivo_sitef(tamanho, diretorio_dados)
+    linhas_csv = TAMANHOS[tamanho]
+    casos = {}
+
+    casos["parser.leitura"] = estatisticas(
+        cronometrar(lambda: ParserRelatorioSITEF(csv), max(1, repeticoes // 4)), linhas_csv
+        )
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        # a ingestão altera o banco, cada repetição começa de um banco vazio
+        tempos = []
+        for _ in range(max(1, repeticoes // 4)):
+            engine, Session = banco_vazio(diretorio)
+            with Session() as session, open(csv, "rb") as arquivo:
+                inicio = time.perf_counter()
+                gravadas = ingerir_transacoes(arquivo, session)["inseridas"]
+                tempos.append(time.perf_counter() - inicio)
+            engine.dispose()
+        casos["ingestao.gravacao"] = estatisticas(tempos, gravadas)
+
+        engine = create_engine(f"sqlite:///{os.path.join(diretorio, 'bench.db')}")
+        with sessionmaker(engine)() as session:
+            dia = INICIO.replace(hour=0)
+            consultas = {
+                "consulta.ranking_dia": lambda: Transacao.ranking_range_data(
+                    session, dia, dia.replace(hour=23, minute=59, second=59)
+                    ),
+                "consulta.ranking_parcial": lambda: Transacao.ranking_range_data(
+                    session, dia.replace(hour=8), dia.replace(hour=17, minute=59, second=59)
+                    ),
+                "consulta.mensal": lambda: Transacao.tabela_mensal_quantidade_transacoes(session, INICIO.month, INICIO.year),
+            }
+            for nome, consulta in consultas.items():
+                casos[nome] = estatisticas(cronometrar(consulta, repeticoes))
+        engine.dispose()
+
+    return {
+        "versao": versao_codigo(),
+        "gerado_em": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "tamanho": tamanho,
+        "casos": casos,
+    }
+
+
+def versao_codigo() -> str:
+    """Commit atual do repositório, ou None fora de um checkout do git
+    """
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], capture_output=True, text=True, check=True
+            ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def comparar(base:dict, novo:dict, limiar:float) -> bool:
+    """Imprime a razão entre as medianas de cada caso presente nos dois relatórios
+
+    Args:
+        base (dict): relatório de referência
+        novo (dict): relatório a avaliar
+        limiar (float): fração de aumento da mediana tolerada, 0.1 para 10%
+
+    Returns:
+        bool: True se algum caso ficou mais lento que o limiar
+    """
+    if base.get("tamanho") != novo.get("tamanho"):
+        print(f"Atenção: tamanhos diferentes, {base.get('tamanho')} e {novo.get('tamanho')}")
+    print(f"{'caso':<28} {'base (ms)':>12} {'novo (ms)':>12} {'razão':>8}")
+    regressao = False
+    for caso in sorted(set(base["casos"]) & set(novo["casos"])):
+        anterior = base["casos"][caso]["mediana_s"]
+        atual = novo["casos"][caso]["mediana_s"]
+        razao = atual / anterior
+        marca = ""
+        if razao > 1 + limiar:
+            marca = "  REGRESSÃO"
+            regressao = True
+        print(f"{caso:<28} {anterior * 1000:12.2f} {atual * 1000:12.2f} {razao:8.2f}{marca}")
+    return regressao
+
+
+if __name__ == "__main__":
+    argumentos = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argumentos.add_argument("--tamanho", choices=TAMANHOS, default="100k")
+    argumentos.add_argument("--repeticoes", type=int, default=20, help="repetições das consultas, parser e ingestão usam 1/4")
+    argumentos.add_argument("--dados", default=DIRETORIO_DADOS, help="diretório dos relatórios sintéticos")
+    argumentos.add_argument("--saida", default=None, help="grava o relatório JSON neste arquivo")
+    argumentos.add_argument("--comparar", nargs=2, metavar=("BASE", "NOVO"), help="compara dois relatórios JSON")
+    argumentos.add_argument("--limiar", type=float, default=0.1, help="aumento tolerado da mediana na comparação")
+    args = argumentos.parse_args()
+
+    if args.comparar:
+        relatorios = []
+        for caminho in args.comparar:
+            with open(caminho, encoding="utf-8") as arquivo:
+                relatorios.append(json.load(arquivo))
+        sys.exit(1 if comparar(*relatorios, args.limiar) else 0)
+
+    relatorio = executar(args.tamanho, args.repeticoes, args.dados)
+    texto = json.dumps(relatorio, ensure_ascii=False, indent=2)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as arquivo:
+            arquivo.write(texto)
+    for caso, dados in relatorio["casos"].items():
+        vazao = f", {dados['linhas_por_segundo']} linhas/s" if "linhas_por_segundo" in dados else ""
+        print(f"{caso:<28} mediana {dados['mediana_s'] * 1000:10.2f} ms{vazao}")
@@ -0,0 +1,102 @@
+"""Gerador de relatórios SITEF sintéticos para os benchmarks
+
+O relatório tem o mesmo cabeçalho e separador do exportado pelo SITEF, com pix efetuados, pix negados,
+cancelados e desfeitos e outras formas de pagamento. As transações ficam entre 07:00 e 22:00, em ordem,
+cerca de 20 mil por dia a partir de 01/01/2023, e o NSU é sequencial. A mesma semente gera o mesmo arquivo.
+
+Uso, a partir da raiz do repositório:
+    python -m benchmarks.gerador_sitef --tamanho 1m --saida sitef_1m.csv
+"""
+import argparse
+import os
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+
+CABECALHO = ["Data", "Hora", "Pdv", "Transacao", "Operador", "Estado Transacao", "Nsu", "Valor"]
+TAMANHOS = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000, "10m": 10_000_000}
+INICIO = datetime(2023, 1, 1)
+TRANSACOES_POR_DIA = 20_000
+OPERADORES = 200
+PDVS = 30
+# proporções aproximadas de um supermercado, 60% das vendas no pix e 90% das transações efetuadas
+TIPOS = (("Compra Pix", 0.6), ("Dinheiro", 0.15), ("Cartao Debito", 0.15), ("Cartao Credito", 0.1))
+ESTADOS = (("Efetuada PDV", 0.9), ("Negada", 0.06), ("Cancelada", 0.03), ("Desfeita", 0.01))
+TAMANHO_BLOCO = 1_000_000
+
+
+def _sortear(rng:np.random.Generator, opcoes:tuple, quantidade:int) -> np.ndarray:
+    valores, pesos = zip(*opcoes)
+    return rng.choice(np.array(valores, dtype=object), size=quantidade, p=pesos)
+
+
+def gerar_csv_sitef(linhas:int, destino, semente:int=42):
+    """Escreve o relatório sintético em blocos, sem montar o arquivo inteiro na memória
+
+    Args:
+        linhas (int): quantidade de linhas do relatório
+        destino: caminho ou buffer de texto
+        semente (int, optional): semente do gerador aleatório. Padrão 42.
+    """
+    rng = np.random.default_rng(semente)
+    dias = max(1, linhas // TRANSACOES_POR_DIA)
+    datas = np.array([f"{INICIO + timedelta(days=dia):%d/%m/%Y}" for dia in range(dias)], dtype=object)
+    horas = np.array([f"{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}" for s in range(86400)], dtype=object)
+    pdvs = np.array([f"P{pdv:03d}" for pdv in range(PDVS + 1)], dtype=object)
+    expediente = 15 * 3600
+
+    for inicio in range(0, linhas, TAMANHO_BLOCO):
+        indices = np.arange(inicio, min(inicio + TAMANHO_BLOCO, linhas), dtype=np.int64)
+        quantidade = len(indices)
+        # posição de cada linha no dia, crescente, entre 07:00 e 22:00
+        dia, resto = np.divmod(indices * dias, linhas)
+        segundos = 7 * 3600 + resto * expediente // linhas
+        centavos = rng.integers(100, 50_000, size=quantidade)
+        pd.DataFrame({
+            "Data": datas[dia],
+            "Hora": horas[segundos],
+            "Pdv": pdvs[rng.integers(1, PDVS + 1, size=quantidade)],
+            "Transacao": _sortear(rng, TIPOS, quantidade),
+            "Operador": rng.integers(1, OPERADORES + 1, size=quantidade),
+            "Estado Transacao": _sortear(rng, ESTADOS, quantidade),
+            "Nsu": indices + 1,
+            "Valor": pd.Series(centavos // 100).astype(str) + "," + pd.Series(centavos % 100).astype(str).str.zfill(2),
+            }, columns=CABECALHO).to_csv(destino, sep=";", index=False, header=inicio == 0, mode="w" if inicio == 0 else "a")
+
+
+def arquivo_sitef(tamanho:str, diretorio:str) -> str:
+    """Caminho do relatório do tamanho pedido, gerado na primeira vez e reaproveitado depois
+
+    Args:
+        tamanho (str): uma das chaves de TAMANHOS
+        diretorio (str): onde os relatórios gerados ficam guardados
+
+    Returns:
+        str: caminho do CSV
+    """
+    os.makedirs(diretorio, exist_ok=True)
+    caminho = os.path.join(diretorio, f"sitef_{tamanho}.csv")
+    if not os.path.exists(caminho):
+        temporario = f"{caminho}.tmp"
+        gerar_csv_sitef(TAMANHOS[tamanho], temporario)
+        os.replace(temporario, caminho)
+    return caminho
+
+
+def operadores_df() -> pd.DataFrame:
+    """Planilha de operadores que cobre todos os códigos do relatório sintético
+    """
+    return pd.DataFrame({
+        "Código": range(1, OPERADORES + 1),
+        "Nome": [f"Operador {codigo}" for codigo in range(1, OPERADORES + 1)],
+        "Logname": [f"op{codigo}" for codigo in range(1, OPERADORES + 1)],
+        })
+
+
+if __name__ == "__main__":
+    argumentos = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argumentos.add_argument("--tamanho", choices=TAMANHOS, default="100k")
+    argumentos.add_argument("--saida", required=True, help="caminho do CSV gerado")
+    argumentos.add_argument("--semente", type=int, default=42)
+    args = argumentos.parse_args()
+    gerar_csv_sitef(TAMANHOS[args.tamanho], args.saida, args.semente)
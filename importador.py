@@ -0,0 +1,240 @@
+"""Importação automática dos relatórios deixados num diretório de entrada
+
+Arquivos de operadores são gravados primeiro, no processo principal, e os relatórios SITEF
+são lidos em paralelo por um pool de processos. Cada relatório é gravado numa transação própria do banco,
+uma de cada vez, porque arquivos sobrepostos disputariam os mesmos NSUs e as mesmas linhas do resumo diário.
+Arquivos gravados vão para o diretório de arquivados, os que falharam para o de erros com a mensagem ao lado
+"""
+import logging
+import os
+import shutil
+import threading
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import List, Optional
+from sqlalchemy.orm import sessionmaker
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler
+from banco import criar_engine
+from ingestao import ingerir_operadores, ingerir_transacoes, hash_conteudo, descrever_erro
+from models import ArquivoIngerido
+from parsers import ParserRelatorioSITEF, ParserPlanilhaOperadores
+from metricas import registro
+
+logger = logging.getLogger(__name__)
+
+# sessão e trava de gravação de cada processo do pool, definidas em _iniciar_processo
+_Session = None
+_trava_gravacao = None
+
+
+def identificar_tipo(caminho:str) -> Optional[str]:
+    """Identifica o arquivo pelo cabeçalho, em qualquer dos formatos aceitos pelos parsers
+
+    Args:
+        caminho (str): caminho do arquivo
+
+    Returns:
+        Optional[str]: "transacoes" para o relatório SITEF, "operadores" para a planilha de operadores,
+            None se não for reconhecido
+    """
+    for tipo, parser in (("transacoes", ParserRelatorioSITEF), ("operadores", ParserPlanilhaOperadores)):
+        try:
+            parser.detectar_formato(caminho)
+        except (parser.exc.ArquivoInvalido, ValueError, OSError):
+            continue
+        return tipo
+    return None
+
+
+def _iniciar_processo(url:str, trava):
+    """Cada processo do pool abre o próprio engine, conexões não são compartilhadas entre processos
+    """
+    global _Session, _trava_gravacao
+    _Session = sessionmaker(criar_engine(url), autoflush=False)
+    _trava_gravacao = trava
+
+
+def _importar_relatorio(caminho:str) -> dict:
+    """Lê e grava um relatório SITEF dentro de um processo do pool
+
+    Returns:
+        dict: resultado de ingerir_transacoes, ou "erro" com a mensagem da falha,
+            mais as métricas do processo em "metricas"
+    """
+    registro.limpar()
+    resultado = _gravar_relatorio(caminho)
+    resultado["metricas"] = registro.exportar()
+    return resultado
+
+
+def _gravar_relatorio(caminho:str) -> dict:
+    nome = os.path.basename(caminho)
+    with _Session() as session:
+        try:
+            with open(caminho, "rb") as arquivo:
+                hash_arquivo = hash_conteudo(arquivo)
+                if ArquivoIngerido.existe(session, hash_arquivo):
+                    return {"arquivo_repetido": True}
+                # lido bloco a bloco durante a gravação, numa única transação do banco:
+                # um bloco inválido desfaz os anteriores e a memória usada é a de um bloco
+                with _trava_gravacao:
+                    return ingerir_transacoes(
+                        arquivo, session, nome_arquivo=nome, hash_arquivo=hash_arquivo, transacao_unica=True
+                        )
+        except Exception as e:
+            session.rollback()
+            logger.exception("Falha ao importar %s", nome)
+            return {"erro": descrever_erro(e)}
+
+
+class _AoAlterar(FileSystemEventHandler):
+    """Avisa o laço do Importador quando um arquivo é criado, alterado ou movido para a entrada
+    """
+    def __init__(self, alterado:threading.Event) -> None:
+        super().__init__()
+        self.alterado = alterado
+
+    def on_any_event(self, event):
+        if not event.is_directory:
+            self.alterado.set()
+
+
+class Importador():
+    """Importa os arquivos do diretório de entrada e os move para arquivados ou erros
+
+    Attrs:
+        entrada (str): diretório observado
+        arquivados (str): destino dos arquivos gravados ou repetidos
+        erros (str): destino dos arquivos com falha, acompanhados de <nome>.erro.txt
+    """
+    def __init__(self, url:str, entrada:str, arquivados:str=None, erros:str=None, processos:int=None,
+                 arquivo_metricas:str=None) -> None:
+        """
+        Args:
+            url (str): URL do banco
+            entrada (str): diretório observado
+            arquivados (str, optional): padrão <entrada>/arquivados
+            erros (str, optional): padrão <entrada>/erros
+            processos (int, optional): tamanho do pool de leitura. Padrão min(4, núcleos)
+            arquivo_metricas (str, optional): JSON com os tempos por etapa, regravado após cada importação
+        """
+        self.arquivo_metricas = arquivo_metricas
+        self.entrada = entrada
+        self.arquivados = arquivados or os.path.join(entrada, "arquivados")
+        self.erros = erros or os.path.join(entrada, "erros")
+        for diretorio in (self.entrada, self.arquivados, self.erros):
+            os.makedirs(diretorio, exist_ok=True)
+        self.Session = sessionmaker(criar_engine(url), autoflush=False)
+        self.executor = ProcessPoolExecutor(
+            max_workers=processos or min(4, os.cpu_count() or 1),
+            initializer=_iniciar_processo, initargs=(url, multiprocessing.Lock())
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.executor.shutdown()
+
+    def pendentes(self, espera:float=0) -> List[str]:
+        """Arquivos do diretório de entrada sem alteração há pelo menos espera segundos,
+        assim arquivos ainda sendo copiados ficam para a próxima varredura
+        """
+        agora = time.time()
+        caminhos = []
+        for nome in sorted(os.listdir(self.entrada)):
+            caminho = os.path.join(self.entrada, nome)
+            if nome.startswith(".") or not os.path.isfile(caminho):
+                continue
+            if agora - os.path.getmtime(caminho) >= espera:
+                caminhos.append(caminho)
+        return caminhos
+
+    def importar(self, caminhos:List[str]) -> dict:
+        """Grava os arquivos, operadores antes dos relatórios, e move cada um para o destino
+
+        Args:
+            caminhos (List[str]): arquivos a importar
+
+        Returns:
+            dict: resultado por nome de arquivo
+        """
+        resultados = {}
+        relatorios = []
+        for caminho in caminhos:
+            try:
+                tipo = identificar_tipo(caminho)
+            except (OSError, UnicodeDecodeError) as e:
+                tipo = None
+                logger.warning("Não foi possível ler %s: %s", caminho, e)
+            if tipo == "transacoes":
+                relatorios.append(caminho)
+            elif tipo == "operadores":
+                resultados[caminho] = self._importar_operadores(caminho)
+            else:
+                resultados[caminho] = {"erro": "Cabeçalho não reconhecido como relatório SITEF nem planilha de operadores"}
+
+        for caminho, resultado in zip(relatorios, self.executor.map(_importar_relatorio, relatorios)):
+            registro.incorporar(resultado.pop("metricas"))
+            resultados[caminho] = resultado
+
+        for caminho, resultado in resultados.items():
+            self._mover(caminho, resultado)
+        if self.arquivo_metricas and resultados:
+            registro.gravar_json(self.arquivo_metricas)
+        return {os.path.basename(caminho): resultado for caminho, resultado in resultados.items()}
+
+    def _importar_operadores(self, caminho:str) -> dict:
+        with self.Session() as session:
+            try:
+                with open(caminho, "rb") as arquivo:
+                    return {"operadores": ingerir_operadores(arquivo, session)}
+            except Exception as e:
+                session.rollback()
+                logger.exception("Falha ao importar %s", caminho)
+                return {"erro": descrever_erro(e)}
+
+    def _mover(self, caminho:str, resultado:dict):
+        """Move o arquivo para arquivados ou erros, sem sobrescrever um arquivo de mesmo nome
+        """
+        nome = os.path.basename(caminho)
+        destino = self.erros if "erro" in resultado else self.arquivados
+        if os.path.exists(os.path.join(destino, nome)):
+            nome = f"{datetime.now():%Y%m%d%H%M%S}-{nome}"
+        shutil.move(caminho, os.path.join(destino, nome))
+        if "erro" in resultado:
+            with open(os.path.join(destino, f"{nome}.erro.txt"), "w", encoding="utf-8") as mensagem:
+                mensagem.write(resultado["erro"])
+            logger.error("%s movido para %s: %s", nome, destino, resultado["erro"])
+        else:
+            logger.info("%s arquivado: %s", nome, resultado)
+
+    def observar(self, espera:float=2.0, uma_vez:bool=False):
+        """Importa o que já está no diretório e passa a observar arquivos novos
+
+        Args:
+            espera (float, optional): segundos sem alteração antes de importar um arquivo
+                e intervalo entre as verificações. Padrão 2.0.
+            uma_vez (bool, optional): importa o que já está no diretório e retorna. Padrão False.
+        """
+        self.importar(self.pendentes())
+        if uma_vez:
+            return
+        alterado = threading.Event()
+        observador = Observer()
+        observador.schedule(_AoAlterar(alterado), self.entrada, recursive=False)
+        observador.start()
+        try:
+            while True:
+                # acorda com o aviso do watchdog ou a cada espera segundos, para os arquivos adiados
+                alterado.wait(espera)
+                alterado.clear()
+                caminhos = self.pendentes(espera)
+                if caminhos:
+                    self.importar(caminhos)
+        finally:
+            observador.stop()
+            observador.join()
@@ -0,0 +1,356 @@
+"""Gravação dos relatórios no banco, compartilhada pelo dashboard, pelo worker e pelos comandos
+"""
+import hashlib
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import pandas as pd
+from models import Operador, Transacao, VersaoDados, JobIngestao, MarcaIngestao, ArquivoIngerido
+from parsers import ParserPlanilhaOperadores, ParserRelatorioSITEF
+from metricas import registro, medir
+
+logger = logging.getLogger(__name__)
+
+
+def ingerir_operadores(arquivo, session) -> int:
+    """Grava a planilha de operadores e avança a versão dos dados
+
+    Args:
+        arquivo: arquivo ou buffer com o CSV de operadores
+        session (sqlalchemy.orm.session.Session): Session do SQLAlchemy
+
+    Returns:
+        int: operadores inseridos ou atualizados
+    """
+    o = ParserPlanilhaOperadores(arquivo)
+    resumo = Operador.gravar_banco(o.df, session)
+    VersaoDados.incrementar(session)
+    return resumo["inseridos"] + resumo["atualizados"]
+
+
+def hash_conteudo(arquivo) -> str:
+    """sha256 do conteúdo, lido em blocos, no mesmo formato de JobIngestao.hash_arquivo
+    O arquivo volta para o início ao final
+
+    Args:
+        arquivo: arquivo ou buffer, binário ou texto
+
+    Returns:
+        str: hash em hexadecimal
+    """
+    h = hashlib.sha256()
+    while True:
+        bloco = arquivo.read(1 << 20)
+        if not bloco:
+            break
+        h.update(bloco if isinstance(bloco, bytes) else bloco.encode())
+    arquivo.seek(0)
+    return h.hexdigest()
+
+
+def ingerir_transacoes(arquivo, session, ao_progredir=None, nome_arquivo:str=None, hash_arquivo:str=None,
+                       usar_marca:bool=True, transacao_unica:bool=False, blocos=None) -> dict:
+    """Grava o relatório SITEF bloco a bloco e avança a versão dos dados
+    Um arquivo idêntico a outro já ingerido é descartado sem leitura, e com usar_marca as transações
+    anteriores à marca d'água de cada PDV são descartadas sem consultar o banco.
+    As marcas só avançam depois do arquivo inteiro, assim a ordem das linhas dentro do relatório não importa
+
+    Args:
+        arquivo: arquivo ou buffer com o CSV do SITEF
+        session (sqlalchemy.orm.session.Session): Session do SQLAlchemy
+        ao_progredir (callable, optional): chamada após cada bloco com o total de transações gravadas
+        nome_arquivo (str, optional): nome original, guardado no registro do arquivo
+        hash_arquivo (str, optional): sha256 do conteúdo, calculado aqui quando ausente
+        usar_marca (bool, optional): descarta transações já cobertas pela marca d'água.
+            False para cargas retroativas de relatórios mais antigos que os já ingeridos. Padrão True.
+        transacao_unica (bool, optional): grava o arquivo inteiro numa só transação do banco,
+            uma falha no meio não deixa blocos gravados. Padrão False, uma transação por bloco.
+        blocos (iterable, optional): DataFrames já lidos pelo ParserRelatorioSITEF, dispensa a leitura do arquivo
+
+    Returns:
+        dict: "inseridas", "ignoradas_marca", "ignoradas_conflito" e "arquivo_repetido"
+    """
+    resultado = {"inseridas": 0, "ignoradas_marca": 0, "ignoradas_conflito": 0, "arquivo_repetido": False}
+    hash_arquivo = hash_arquivo or hash_conteudo(arquivo)
+    if ArquivoIngerido.existe(session, hash_arquivo):
+        logger.info("Arquivo %s já ingerido, descartado", nome_arquivo or hash_arquivo)
+        resultado["arquivo_repetido"] = True
+        return resultado
+
+    marcas = MarcaIngestao.carregar(session) if usar_marca else None
+    maximas = {}
+    for bloco in ParserRelatorioSITEF.em_blocos(arquivo) if blocos is None else blocos:
+        if bloco.empty:
+            continue
+        for pdv, maxima in bloco.groupby(Transacao.pdv_numerico(bloco["Pdv"]).values)["Datetime"].max().items():
+            maximas[pdv] = max(maxima, maximas.get(pdv, maxima))
+        resumo = Transacao.gravar_banco(bloco, session, marcas, confirmar=not transacao_unica)
+        for chave, quantidade in resumo.items():
+            resultado[chave] += quantidade
+        if ao_progredir is not None:
+            ao_progredir(resultado["inseridas"])
+    MarcaIngestao.avancar(session, maximas)
+    ArquivoIngerido.registrar(session, hash_arquivo, nome_arquivo, resultado["inseridas"])
+    session.commit()
+    VersaoDados.incrementar(session)
+    logger.info("Relatório %s ingerido: %s", nome_arquivo or hash_arquivo, resultado)
+    return resultado
+
+
+def validar_relatorio(arquivo):
+    """Lê o relatório inteiro bloco a bloco só para validar, sem guardar os blocos
+    Feita antes da gravação bloco a bloco, uma linha inválida recusa o relatório sem deixar parte dele
+    no banco, e a memória usada continua a de um bloco. O arquivo volta para o início ao final
+
+    Args:
+        arquivo: arquivo binário ou buffer com o relatório SITEF
+
+    Raises:
+        ParserRelatorioSITEF.exc.ArquivoInvalido: faltam colunas ou há linhas inválidas
+    """
+    with medir("parse.validacao"):
+        for _ in ParserRelatorioSITEF.em_blocos(arquivo):
+            pass
+    arquivo.seek(0)
+
+
+def _ler_relatorio(caminho:str) -> pd.DataFrame:
+    """Leitura de um relatório num processo do pool, o DataFrame volta serializado para o processo principal
+    """
+    return ParserRelatorioSITEF(caminho).df
+
+
+def _gravar_particao(Session, df:pd.DataFrame, marcas:dict) -> dict:
+    """Grava uma partição de PDVs com sessão e conexão próprias
+    """
+    with Session() as session:
+        return Transacao.gravar_banco(df, session, marcas)
+
+
+def ingerir_varios(caminhos:list, Session, processos:int=None, conexoes:int=None, usar_marca:bool=True) -> dict:
+    """Grava vários relatórios SITEF de uma vez, como os enviados por loja ou grupo de PDVs no fim do mês
+    Os arquivos são lidos em paralelo num pool de processos, juntados e deduplicados pelo NSU na memória,
+    e gravados em partições por PDV, cada uma numa conexão própria. Partições não compartilham NSU
+    nem linhas do resumo diário, a chave do resumo inclui o PDV, então as conexões não disputam as mesmas linhas.
+    No SQLite, que aceita um único escritor, as partições são gravadas uma após a outra.
+    Arquivos inválidos ou com operadores não cadastrados são recusados um a um, os demais são gravados.
+    Uma falha na gravação pode deixar partições já confirmadas; nesse caso arquivos e marcas não são registrados
+    e repetir a ingestão é seguro, as transações gravadas são descartadas pelo NSU
+
+    Args:
+        caminhos (list): caminhos dos CSVs do SITEF
+        Session (sqlalchemy.orm.sessionmaker): fábrica de sessões, uma por partição
+        processos (int, optional): processos de leitura. Padrão min(núcleos, arquivos)
+        conexoes (int, optional): partições gravadas ao mesmo tempo. Padrão 4, sempre 1 no SQLite
+        usar_marca (bool, optional): descarta transações já cobertas pela marca d'água. Padrão True.
+
+    Returns:
+        dict: "inseridas", "ignoradas_marca", "ignoradas_conflito" somados e, em "arquivos",
+            por caminho, as transações pix lidas ("linhas"), se o arquivo já havia sido ingerido ("repetido")
+            e, nos recusados, a mensagem do motivo ("erro")
+    """
+    resultado = {"inseridas": 0, "ignoradas_marca": 0, "ignoradas_conflito": 0, "arquivos": {}}
+    hashes = {}
+    with Session() as session:
+        for caminho in caminhos:
+            with open(caminho, "rb") as arquivo:
+                hash_arquivo = hash_conteudo(arquivo)
+            if ArquivoIngerido.existe(session, hash_arquivo) or hash_arquivo in hashes.values():
+                resultado["arquivos"][caminho] = {"linhas": 0, "repetido": True}
+            else:
+                hashes[caminho] = hash_arquivo
+        marcas = MarcaIngestao.carregar(session) if usar_marca else None
+    if not hashes:
+        return resultado
+
+    lidos = {}
+    recusados = {}
+    with medir("ingestao.leitura_paralela", linhas=None) as medicao:
+        with ProcessPoolExecutor(max_workers=processos or min(os.cpu_count() or 1, len(hashes))) as executor:
+            futuros = {caminho: executor.submit(_ler_relatorio, caminho) for caminho in hashes}
+            for caminho, futuro in futuros.items():
+                try:
+                    lidos[caminho] = futuro.result()
+                except Exception as e:
+                    recusados[caminho] = descrever_erro(e)
+        medicao["linhas"] = sum(len(df) for df in lidos.values())
+    with Session() as session:
+        for caminho in list(lidos):
+            try:
+                Transacao.verificar_operadores(session, lidos[caminho]["Operador"].unique())
+            except Transacao.exc.OperadorAusente as e:
+                recusados[caminho] = descrever_erro(e)
+                del lidos[caminho]
+    for caminho, mensagem in recusados.items():
+        logger.warning("Relatório %s recusado no lote: %s", caminho, mensagem)
+        resultado["arquivos"][caminho] = {"linhas": 0, "repetido": False, "erro": mensagem}
+        del hashes[caminho]
+    if not lidos:
+        return resultado
+    for caminho, df in lidos.items():
+        resultado["arquivos"][caminho] = {"linhas": len(df), "repetido": False}
+    df = pd.concat(lidos.values(), ignore_index=True)
+    total = len(df)
+    df = df.drop_duplicates("Nsu")
+    resultado["ignoradas_conflito"] += total - len(df)
+    if df.empty:
+        return resultado
+
+    pdvs = Transacao.pdv_numerico(df["Pdv"]).values
+    if Session.kw["bind"].dialect.name == "sqlite":
+        conexoes = 1
+    conexoes = conexoes or 4
+    particoes = [particao for _, particao in df.groupby(pdvs % conexoes)]
+    with medir("ingestao.gravacao_paralela", linhas=len(df)):
+        argumentos = ([Session] * len(particoes), particoes, [marcas] * len(particoes))
+        if conexoes == 1:
+            # na mesma thread, um SQLite em memória só existe na conexão dela
+            resumos = list(map(_gravar_particao, *argumentos))
+        else:
+            with ThreadPoolExecutor(max_workers=conexoes) as executor:
+                resumos = list(executor.map(_gravar_particao, *argumentos))
+    for resumo in resumos:
+        for chave, quantidade in resumo.items():
+            resultado[chave] += quantidade
+
+    with Session() as session:
+        MarcaIngestao.avancar(session, df.groupby(pdvs)["Datetime"].max().to_dict())
+        for caminho, hash_arquivo in hashes.items():
+            ArquivoIngerido.registrar(session, hash_arquivo, os.path.basename(caminho), resultado["arquivos"][caminho]["linhas"])
+        session.commit()
+        VersaoDados.incrementar(session)
+    logger.info("%s relatórios ingeridos em %s partições: %s", len(hashes), len(particoes),
+                {chave: valor for chave, valor in resultado.items() if chave != "arquivos"})
+    return resultado
+
+
+def descrever_erro(e:Exception) -> str:
+    """Mensagem de erro para o job ou para o arquivo .erro.txt do importador. Do arquivo inválido fica só
+    a mensagem, que já cita as primeiras linhas, sem a lista completa
+    """
+    if isinstance(e, ParserRelatorioSITEF.exc.ArquivoInvalido):
+        return str(e.args[0])
+    return " ".join(str(argumento) for argumento in e.args) or repr(e)
+
+
+def descrever_resultado(resultado:dict) -> str:
+    """Resumo da ingestão de transações para a mensagem do job
+    """
+    if resultado["arquivo_repetido"]:
+        return "Arquivo idêntico a outro já ingerido"
+    return (
+        f"{resultado['inseridas']} inseridas, {resultado['ignoradas_marca']} ignoradas pela marca d'água, "
+        f"{resultado['ignoradas_conflito']} ignoradas por NSU já gravado"
+        )
+
+
+def descartar_arquivo(job:JobIngestao):
+    """Apaga do spool o arquivo de um job concluído, o conteúdo já está no banco
+    Arquivos de jobs com erro ficam no spool para conferência até serem reenviados
+    """
+    try:
+        os.remove(job.caminho)
+    except FileNotFoundError:
+        logger.warning("Arquivo do job %s já não estava no spool: %s", job.id, job.caminho)
+
+
+def processar_job(job:JobIngestao, session):
+    """Grava o arquivo do job e registra o resultado, erros ficam na mensagem do job
+
+    Args:
+        job (JobIngestao): job já reservado pelo worker
+        session (sqlalchemy.orm.session.Session): Session do SQLAlchemy
+    """
+    inicio = time.perf_counter()
+    try:
+        with open(job.caminho, "rb") as arquivo:
+            if job.tipo == "operadores":
+                linhas = ingerir_operadores(arquivo, session)
+                mensagem = None
+            else:
+                validar_relatorio(arquivo)
+                resultado = ingerir_transacoes(
+                    arquivo, session,
+                    ao_progredir=lambda gravadas: job.registrar(session, JobIngestao.PROCESSANDO, linhas=gravadas),
+                    nome_arquivo=job.nome_arquivo, hash_arquivo=job.hash_arquivo
+                    )
+                linhas = resultado["inseridas"]
+                mensagem = descrever_resultado(resultado)
+    except Exception as e:
+        session.rollback()
+        logger.exception("Falha no job %s", job.id)
+        job.registrar(session, JobIngestao.ERRO, mensagem=descrever_erro(e))
+    else:
+        job.registrar(session, JobIngestao.CONCLUIDO, linhas=linhas, mensagem=mensagem)
+        descartar_arquivo(job)
+        logger.info("Job %s concluído: %s linhas em %.1fs", job.id, linhas, time.perf_counter() - inicio)
+
+
+def processar_lote(jobs:list, session, Session, processos:int=None):
+    """Grava juntos os relatórios SITEF de vários jobs com ingerir_varios e registra o resultado em cada job
+    Um arquivo recusado marca só o seu job com erro; uma falha na gravação marca todos os jobs do lote
+
+    Args:
+        jobs (list): jobs de transações já reservados pelo worker
+        session (sqlalchemy.orm.session.Session): Session dos jobs
+        Session (sqlalchemy.orm.sessionmaker): fábrica de sessões usada na gravação
+        processos (int, optional): processos de leitura
+    """
+    inicio = time.perf_counter()
+    try:
+        resultado = ingerir_varios([job.caminho for job in jobs], Session, processos)
+    except Exception as e:
+        session.rollback()
+        logger.exception("Falha no lote de jobs %s", [job.id for job in jobs])
+        mensagem = descrever_erro(e)
+        for job in jobs:
+            job.registrar(session, JobIngestao.ERRO, mensagem=f"Lote de {len(jobs)} arquivos: {mensagem}")
+        return
+    totais = descrever_resultado(dict(resultado, arquivo_repetido=False))
+    for job in jobs:
+        arquivo = resultado["arquivos"][job.caminho]
+        if "erro" in arquivo:
+            job.registrar(session, JobIngestao.ERRO, mensagem=arquivo["erro"])
+            continue
+        if arquivo["repetido"]:
+            mensagem = "Arquivo idêntico a outro já ingerido"
+        else:
+            mensagem = f"Lote de {len(jobs)} arquivos: {totais}"
+        job.registrar(session, JobIngestao.CONCLUIDO, linhas=arquivo["linhas"], mensagem=mensagem)
+        descartar_arquivo(job)
+    logger.info("Lote de %s jobs concluído em %.1fs", len(jobs), time.perf_counter() - inicio)
+
+
+def executar_worker(Session, intervalo:float=2.0, uma_vez:bool=False, arquivo_metricas:str=None, lote:int=16):
+    """Consome a fila de jobs de ingestão
+    Relatórios SITEF pendentes ao mesmo tempo são gravados juntos, até lote arquivos, com ingerir_varios
+
+    Args:
+        Session (sqlalchemy.orm.sessionmaker): fábrica de sessões do banco
+        intervalo (float, optional): segundos de espera quando a fila está vazia. Padrão 2.0.
+        uma_vez (bool, optional): processa os jobs pendentes e retorna. Padrão False.
+        arquivo_metricas (str, optional): JSON com os tempos por etapa, regravado após cada job
+        lote (int, optional): máximo de relatórios SITEF gravados juntos, 1 grava um a um. Padrão 16.
+    """
+    with Session() as session:
+        retomados = JobIngestao.retomar_interrompidos(session)
+        if retomados:
+            logger.info("%s jobs interrompidos voltaram para a fila", retomados)
+    while True:
+        with Session() as session:
+            job = JobIngestao.reservar_proximo(session)
+            if job is not None:
+                outros = JobIngestao.reservar_lote(session, job.tipo, lote - 1) if job.tipo == "transacoes" else []
+                if outros:
+                    logger.info("Processando lote de jobs %s", [job.id] + [outro.id for outro in outros])
+                    processar_lote([job] + outros, session, Session)
+                else:
+                    logger.info("Processando job %s: %s", job.id, job.nome_arquivo)
+                    processar_job(job, session)
+                if arquivo_metricas:
+                    registro.gravar_json(arquivo_metricas)
+                continue
+        if uma_vez:
+            return
+        time.sleep(intervalo)
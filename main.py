@@ -1,37 +1,141 @@
-from models import Operador, Transacao, Base
-from parsers import ParserPlanilhaOperadores, ParserRelatorioSITEF
-from sqlalchemy import create_engine
+"""Comandos de linha de comando para manutenção do banco do dashboard
+
+Uso:
+    python main.py init-banco
+    python main.py mensal --mes 10 --ano 2023
+    python main.py reconstruir-resumo --inicio 01/10/2023 --fim 31/10/2023
+    python main.py worker
+    python main.py migrar-esquema-compacto
+    python main.py importar --entrada /srv/sitef
+    python main.py arquivar --ate 06/2023 --remover
+"""
+import argparse
+import os
+from models import Transacao, ResumoDiario, ResumoHorario, Base
+from sqlalchemy import inspect
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import select, extract
+from banco import criar_engine
+from ingestao import executar_worker
+from migracoes import migrar_transacao_compacta
+from importador import Importador
+from arquivamento import arquivar
 from datetime import datetime
 
+
+def data_br(valor:str):
+    """Converte datas digitadas no formato DD/MM/AAAA
+    """
+    return datetime.strptime(valor, "%d/%m/%Y").date()
+
+
+def mes_br(valor:str):
+    """Converte meses digitados no formato MM/AAAA para o primeiro dia do mês
+    """
+    return datetime.strptime(valor, "%m/%Y").date()
+
+
+def comando_init_banco(session, args):
+    # cria só as tabelas ausentes, tabelas existentes não são alteradas
+    engine = session.get_bind()
+    existentes = set(inspect(engine).get_table_names())
+    Base.metadata.create_all(engine)
+    print("Tabelas do banco criadas")
+    if ResumoHorario.__tablename__ not in existentes and Transacao.__tablename__ in existentes:
+        # resumo criado num banco que já tem transações, preenchido com o histórico
+        linhas = ResumoHorario.reconstruir(session)
+        print(f"Resumo horário preenchido, {linhas} linhas")
+
+
+def comando_mensal(session, args):
+    try:
+        print(Transacao.tabela_mensal_quantidade_transacoes(session, args.mes, args.ano))
+    except Transacao.exc.ConsultaInvalida:
+        print(f"Período do mês {args.mes}/{args.ano} sem transações para exibir")
+
+
+def comando_reconstruir_resumo(session, args):
+    linhas = ResumoDiario.reconstruir(session, args.inicio, args.fim)
+    print(f"Resumos diário e horário reconstruídos, {linhas} linhas do diário no período")
+
+
+def comando_worker(session, args):
+    executar_worker(sessionmaker(session.get_bind(), autoflush=False), args.intervalo, args.uma_vez, args.metricas, args.lote)
+
+
+def formatar_bytes(valor) -> str:
+    return "indisponível" if valor is None else f"{valor / 1024 / 1024:.1f} MiB"
+
+
+def comando_migrar_esquema_compacto(session, args):
+    resultado = migrar_transacao_compacta(session.get_bind(), args.lote, args.manter_legado)
+    print(f"{resultado['linhas']} transações migradas")
+    for etapa in ("antes", "depois"):
+        tamanho = resultado[etapa]
+        print(f"{etapa}: dados {formatar_bytes(tamanho['dados'])}, índices {formatar_bytes(tamanho['indices'])}")
+
+
+def comando_importar(session, args):
+    url = session.get_bind().url.render_as_string(hide_password=False)
+    with Importador(url, args.entrada, args.arquivados, args.erros, args.processos, args.metricas) as importador:
+        importador.observar(args.espera, args.uma_vez)
+
+
+def comando_arquivar(session, args):
+    arquivados = arquivar(session, args.diretorio, args.ate, args.remover)
+    for mes, linhas in arquivados.items():
+        print(f"{mes}: {linhas} transações arquivadas")
+    if not arquivados:
+        print("Nenhum mês fechado a arquivar")
+
+
 if __name__ == "__main__":
-    engine = create_engine('sqlite:///pix.db')
+    argumentos = argparse.ArgumentParser(description="Manutenção do banco do dashboard de pix")
+    comandos = argumentos.add_subparsers(dest="comando", required=True)
+
+    init_banco = comandos.add_parser("init-banco", help="cria as tabelas ausentes, rode na instalação e após atualizar")
+    init_banco.set_defaults(funcao=comando_init_banco)
+
+    mensal = comandos.add_parser("mensal", help="exibe a quantidade diária de transações do mês")
+    mensal.add_argument("--mes", type=int, default=datetime.now().month)
+    mensal.add_argument("--ano", type=int, default=datetime.now().year)
+    mensal.set_defaults(funcao=comando_mensal)
+
+    reconstruir = comandos.add_parser("reconstruir-resumo", help="recalcula os resumos diário e horário a partir das transações")
+    reconstruir.add_argument("--inicio", type=data_br, default=None, help="DD/MM/AAAA, padrão desde o início")
+    reconstruir.add_argument("--fim", type=data_br, default=None, help="DD/MM/AAAA, padrão até a última transação")
+    reconstruir.set_defaults(funcao=comando_reconstruir_resumo)
+
+    worker = comandos.add_parser("worker", help="grava no banco os arquivos enviados pelo dashboard")
+    worker.add_argument("--intervalo", type=float, default=2.0, help="segundos entre consultas à fila vazia")
+    worker.add_argument("--uma-vez", action="store_true", help="processa os pendentes e encerra")
+    worker.add_argument("--metricas", default=os.getenv("METRICAS_ARQUIVO"), help="JSON com os tempos por etapa, padrão METRICAS_ARQUIVO")
+    worker.add_argument("--lote", type=int, default=16, help="relatórios SITEF pendentes gravados juntos, 1 grava um a um")
+    worker.set_defaults(funcao=comando_worker)
+
+    migrar = comandos.add_parser("migrar-esquema-compacto", help="converte a tabela transacao para NSU numérico, PDV inteiro e estados codificados")
+    migrar.add_argument("--lote", type=int, default=50_000, help="linhas copiadas por lote")
+    migrar.add_argument("--manter-legado", action="store_true", help="mantém a tabela antiga como transacao_legado")
+    migrar.set_defaults(funcao=comando_migrar_esquema_compacto)
+
+    importar = comandos.add_parser("importar", help="importa os relatórios e planilhas deixados no diretório de entrada")
+    importar.add_argument("--entrada", default="importar", help="diretório observado")
+    importar.add_argument("--arquivados", default=None, help="destino dos arquivos gravados, padrão <entrada>/arquivados")
+    importar.add_argument("--erros", default=None, help="destino dos arquivos com falha, padrão <entrada>/erros")
+    importar.add_argument("--processos", type=int, default=None, help="processos de leitura, padrão min(4, núcleos)")
+    importar.add_argument("--espera", type=float, default=2.0, help="segundos sem alteração antes de importar um arquivo")
+    importar.add_argument("--uma-vez", action="store_true", help="importa o que está no diretório e encerra")
+    importar.add_argument("--metricas", default=os.getenv("METRICAS_ARQUIVO"), help="JSON com os tempos por etapa, padrão METRICAS_ARQUIVO")
+    importar.set_defaults(funcao=comando_importar)
+
+    arquivo = comandos.add_parser("arquivar", help="exporta os meses fechados da tabela transacao para Parquet")
+    arquivo.add_argument("--diretorio", default=os.getenv("ARQUIVO_PARQUET", "arquivo"), help="raiz das partições, padrão ARQUIVO_PARQUET ou ./arquivo")
+    arquivo.add_argument("--ate", type=mes_br, default=datetime.now().date(), help="MM/AAAA do último mês, padrão o mês anterior ao atual")
+    arquivo.add_argument("--remover", action="store_true", help="apaga da tabela transacao as transações arquivadas")
+    arquivo.set_defaults(funcao=comando_arquivar)
+
+    args = argumentos.parse_args()
+    engine = criar_engine(os.getenv("DATABASE_URL", "sqlite:///pix.db"))
     Session = sessionmaker(engine)
     session = Session()
-    Base.metadata.create_all(engine)
-    
-    #hoje = datetime.now()
-    data_inicio_str = "21/10/2023 00:00:00"
-    data_inicio = datetime.strptime(data_inicio_str, "%d/%m/%Y %H:%M:%S")
-    data_fim_str = "21/10/2023 23:59:59"
-    data_fim = datetime.strptime(data_fim_str, "%d/%m/%Y %H:%M:%S")
-    
-    #df = Transacao.ranking_range_data(session,data_inicio,data_fim)
-    df = Transacao.tabela_mensal_quantidade_transacoes(session, 10, 2023)
-    print(df)
-    
-    
-    #df = Operador.todos_para_df(session)
-    #print(df)
-    #r = Operador.todos(session)
-    #for x in r:
-    #    print(x.codigo_operador)
-    #q = session.query(Transacao).filter(extract('month', Transacao.data_transacao)==10).all()
-    #q = select(Transacao).where(Transacao.data_transacao.like("2023-10%"))
-    #q = select(Transacao).where(extract("month", Transacao.data_transacao) == "10").where(extract("day", Transacao.data_transacao) == "21")
-    #result = session.execute(q)
-    #result.scalars()
-    #for t in result.scalars().all():
-    #    print(t)
+    args.funcao(session, args)
     session.close()
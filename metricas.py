@@ -0,0 +1,154 @@
+"""Tempos por etapa da ingestão e por consulta, acumulados no próprio processo
+
+As etapas são nomeadas com prefixo: "parse." para a leitura do relatório, "gravacao." para o banco na ingestão,
+"consulta." para os métodos de consulta de Transacao e Operador e "pagina." para as seções do dashboard.
+O dashboard exibe o registro do seu processo, o worker e o importador gravam o deles em JSON
+"""
+import json
+import os
+import threading
+import time
+import functools
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+import pandas as pd
+
+# durações guardadas por etapa para os percentis, as mais antigas saem primeiro
+AMOSTRAS_POR_ETAPA = 1000
+
+
+class RegistroMetricas():
+    """Acumula chamadas, linhas e durações por etapa, seguro para várias threads
+    """
+    def __init__(self) -> None:
+        self._trava = threading.Lock()
+        self.limpar()
+
+    def limpar(self):
+        with self._trava:
+            self._etapas = {}
+            self.iniciado_em = datetime.now()
+
+    def _etapa(self, etapa:str) -> dict:
+        """Acumuladores da etapa, criados na primeira medição. Chamar com a trava adquirida
+        """
+        return self._etapas.setdefault(etapa, {
+            "chamadas": 0, "linhas": 0, "total": 0.0, "maximo": 0.0,
+            "amostras": deque(maxlen=AMOSTRAS_POR_ETAPA)
+            })
+
+    def registrar(self, etapa:str, duracao:float, linhas:int=None):
+        """
+        Args:
+            etapa (str): nome da etapa, ex. "gravacao.insert"
+            duracao (float): segundos
+            linhas (int, optional): linhas processadas na chamada
+        """
+        with self._trava:
+            dados = self._etapa(etapa)
+            dados["chamadas"] += 1
+            dados["linhas"] += linhas or 0
+            dados["total"] += duracao
+            dados["maximo"] = max(dados["maximo"], duracao)
+            dados["amostras"].append(duracao)
+
+    def exportar(self) -> dict:
+        """Dados brutos por etapa, com as amostras, para incorporar no registro de outro processo
+        """
+        with self._trava:
+            return {etapa: dict(dados, amostras=list(dados["amostras"])) for etapa, dados in self._etapas.items()}
+
+    def incorporar(self, etapas:dict):
+        """Soma ao registro os dados exportados por outro processo, como os do pool do importador
+
+        Args:
+            etapas (dict): retorno de exportar()
+        """
+        with self._trava:
+            for etapa, outros in etapas.items():
+                dados = self._etapa(etapa)
+                dados["chamadas"] += outros["chamadas"]
+                dados["linhas"] += outros["linhas"]
+                dados["total"] += outros["total"]
+                dados["maximo"] = max(dados["maximo"], outros["maximo"])
+                dados["amostras"].extend(outros["amostras"])
+
+    @contextmanager
+    def medir(self, etapa:str, linhas:int=None):
+        """Mede o bloco with e registra a duração, mesmo se o bloco levantar exceção
+
+        Args:
+            etapa (str): nome da etapa
+            linhas (int, optional): linhas processadas, pode ser definido dentro do bloco em medicao["linhas"]
+
+        Yields:
+            dict: medicao, com a chave "linhas" editável
+        """
+        medicao = {"linhas": linhas}
+        inicio = time.perf_counter()
+        try:
+            yield medicao
+        finally:
+            self.registrar(etapa, time.perf_counter() - inicio, medicao["linhas"])
+
+    def resumo(self) -> dict:
+        """Estatísticas por etapa, tempos em milissegundos
+
+        Returns:
+            dict: por etapa, chamadas, linhas, total_ms, medio_ms, p50_ms, p95_ms, maximo_ms e linhas_por_segundo
+        """
+        etapas = self.exportar()
+        resumo = {}
+        for etapa, dados in sorted(etapas.items()):
+            amostras = pd.Series(dados["amostras"])
+            resumo[etapa] = {
+                "chamadas": dados["chamadas"],
+                "linhas": dados["linhas"],
+                "total_ms": round(dados["total"] * 1000, 3),
+                "medio_ms": round(dados["total"] / dados["chamadas"] * 1000, 3),
+                "p50_ms": round(amostras.quantile(0.5) * 1000, 3),
+                "p95_ms": round(amostras.quantile(0.95) * 1000, 3),
+                "maximo_ms": round(dados["maximo"] * 1000, 3),
+                "linhas_por_segundo": round(dados["linhas"] / dados["total"]) if dados["linhas"] and dados["total"] else None,
+            }
+        return resumo
+
+    def para_df(self) -> pd.DataFrame:
+        """Resumo como DataFrame, uma linha por etapa
+        """
+        return pd.DataFrame.from_dict(self.resumo(), orient="index").rename_axis("etapa").reset_index()
+
+    def para_json(self) -> str:
+        return json.dumps({
+            "iniciado_em": self.iniciado_em.isoformat(timespec="seconds"),
+            "gerado_em": datetime.now().isoformat(timespec="seconds"),
+            "etapas": self.resumo(),
+            }, ensure_ascii=False, indent=2)
+
+    def gravar_json(self, caminho:str):
+        """Grava o resumo num arquivo JSON, substituindo o anterior de uma vez
+        """
+        temporario = f"{caminho}.tmp"
+        with open(temporario, "w", encoding="utf-8") as arquivo:
+            arquivo.write(self.para_json())
+        # os.replace é atômico, quem lê o arquivo nunca vê o JSON pela metade
+        os.replace(temporario, caminho)
+
+
+# registro do processo, usado por parsers, models, ingestao e dashboard
+registro = RegistroMetricas()
+medir = registro.medir
+
+
+def cronometrar_consulta(funcao):
+    """Decorador dos métodos de consulta, registra a duração como "consulta.<Classe>.<método>"
+    Deve ficar abaixo do @staticmethod
+    """
+    etapa = f"consulta.{funcao.__qualname__}"
+
+    @functools.wraps(funcao)
+    def cronometrada(*args, **kwargs):
+        with medir(etapa):
+            return funcao(*args, **kwargs)
+    return cronometrada
@@ -0,0 +1,147 @@
+"""Migrações de esquema de bancos já populados
+"""
+import calendar
+import logging
+from datetime import datetime
+import sqlalchemy
+import pandas as pd
+from sqlalchemy import select, func, text, inspect, Table, MetaData
+from sqlalchemy.orm import Session
+from models import Transacao, ResumoDiario, ResumoHorario, MesArquivado, MarcaIngestao, VersaoDados
+
+logger = logging.getLogger(__name__)
+
+TABELA_LEGADO = "transacao_legado"
+
+
+def tamanho_tabela(conexao:sqlalchemy.engine.Connection, tabela:str) -> dict:
+    """Espaço ocupado pelos dados e pelos índices de uma tabela, em bytes
+
+    Args:
+        conexao (sqlalchemy.engine.Connection): conexão com o banco
+        tabela (str): nome da tabela
+
+    Returns:
+        dict: chaves "dados" e "indices", None quando o banco não informa
+    """
+    dialeto = conexao.dialect.name
+    if dialeto in ("mysql", "mariadb"):
+        conexao.exec_driver_sql(f"ANALYZE TABLE {tabela}")
+        r = conexao.execute(text(
+            "SELECT data_length, index_length FROM information_schema.TABLES "
+            "WHERE table_schema = DATABASE() AND table_name = :tabela"
+            ), {"tabela": tabela}).first()
+        return {"dados": int(r[0]), "indices": int(r[1])} if r else {"dados": None, "indices": None}
+    if dialeto == "sqlite":
+        try:
+            dados = conexao.execute(text("SELECT SUM(pgsize) FROM dbstat WHERE name = :tabela"), {"tabela": tabela}).scalar()
+            indices = conexao.execute(text(
+                "SELECT SUM(pgsize) FROM dbstat WHERE name IN "
+                "(SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :tabela)"
+                ), {"tabela": tabela}).scalar()
+        except sqlalchemy.exc.OperationalError:
+            # SQLite compilado sem a tabela virtual dbstat
+            return {"dados": None, "indices": None}
+        return {"dados": dados, "indices": indices or 0}
+    return {"dados": None, "indices": None}
+
+
+def _nsu_legado(data_transacao:datetime, pdv:int) -> int:
+    """NSU negativo para transações gravadas antes do NSU do SITEF ser guardado,
+    derivado da chave antiga (data e PDV), assim não colide com NSUs reais.
+    A data é tratada como UTC, o mesmo NSU sai em qualquer fuso do servidor
+    """
+    return -(calendar.timegm(data_transacao.timetuple()) * 10000 + pdv)
+
+
+def _renomear_tabela_antiga(conexao:sqlalchemy.engine.Connection):
+    """Renomeia transacao para transacao_legado e remove os índices que impediriam recriar a tabela
+    No SQLite os nomes de índice valem para o banco todo, no MySQL/MariaDB valem por tabela
+    """
+    conexao.exec_driver_sql(f"ALTER TABLE transacao RENAME TO {TABELA_LEGADO}")
+    if conexao.dialect.name == "sqlite":
+        for indice in inspect(conexao).get_indexes(TABELA_LEGADO):
+            conexao.exec_driver_sql(f"DROP INDEX {indice['name']}")
+
+
+def migrar_transacao_compacta(engine:sqlalchemy.engine.Engine, tamanho_lote:int=50_000, manter_legado:bool=False) -> dict:
+    """Converte a tabela transacao para o esquema compacto: NSU numérico, PDV inteiro, tipo e estado codificados
+    As linhas são copiadas em lotes pela ordem do id, cada lote na sua própria transação do banco,
+    e ao final o resumo diário é reconstruído, as marcas de ingestão recebem a última transação
+    de cada PDV e a versão dos dados avança. Suporta MySQL/MariaDB e SQLite
+
+    Args:
+        engine (sqlalchemy.engine.Engine): engine do banco a migrar
+        tamanho_lote (int, optional): linhas copiadas por lote. Padrão 50_000.
+        manter_legado (bool, optional): mantém a tabela antiga como transacao_legado. Padrão False.
+
+    Returns:
+        dict: linhas copiadas e tamanho de dados e índices antes ("antes") e depois ("depois")
+    """
+    if engine.dialect.name not in ("mysql", "mariadb", "sqlite"):
+        raise NotImplementedError(f"Migração não suportada no banco {engine.dialect.name}")
+    colunas = {coluna["name"]: coluna for coluna in inspect(engine).get_columns("transacao")}
+    if isinstance(colunas["pdv"]["type"], sqlalchemy.Integer):
+        raise ValueError("Tabela transacao já está no esquema compacto")
+
+    with engine.begin() as conexao:
+        antes = tamanho_tabela(conexao, "transacao")
+        _renomear_tabela_antiga(conexao)
+        Transacao.__table__.create(conexao)
+
+    legado = Table(TABELA_LEGADO, MetaData(), autoload_with=engine)
+    copiadas = 0
+    ultimo_id = 0
+    with Session(engine) as session:
+        comando = Transacao._insert_ignorando_duplicadas(session)
+        while True:
+            linhas = session.execute(
+                select(
+                    legado.c.id, legado.c.data_transacao, legado.c.pdv, legado.c.tipo_transacao,
+                    legado.c.estado_transacao, legado.c.codigo_operador
+                    ).where(legado.c.id > ultimo_id).order_by(legado.c.id).limit(tamanho_lote)
+                ).all()
+            if not linhas:
+                break
+            pdvs = Transacao.pdv_numerico(pd.Series([linha.pdv for linha in linhas], dtype=str))
+            registros = []
+            for (id_transacao, data_transacao, _, tipo_transacao, estado_transacao, codigo_operador), pdv_numerico in zip(linhas, pdvs):
+                pdv_numerico = int(pdv_numerico)
+                registros.append({
+                    "id": id_transacao,
+                    "nsu": _nsu_legado(data_transacao, pdv_numerico),
+                    "data_transacao": data_transacao,
+                    "pdv": pdv_numerico,
+                    "tipo_transacao": tipo_transacao,
+                    "estado_transacao": estado_transacao,
+                    "codigo_operador": codigo_operador
+                })
+            session.execute(comando, registros)
+            session.commit()
+            copiadas += len(registros)
+            ultimo_id = linhas[-1][0]
+            logger.info("Migração: %s transações copiadas", copiadas)
+
+    with engine.begin() as conexao:
+        for tabela in (ResumoDiario, ResumoHorario):
+            tabela.__table__.drop(conexao, checkfirst=True)
+            tabela.__table__.create(conexao)
+        # tabelas criadas depois do esquema antigo, usadas pela reconstrução do resumo e abaixo
+        for tabela in (MesArquivado, MarcaIngestao, VersaoDados):
+            tabela.__table__.create(conexao, checkfirst=True)
+        if not manter_legado:
+            conexao.exec_driver_sql(f"DROP TABLE {TABELA_LEGADO}")
+    with Session(engine) as session:
+        ResumoDiario.reconstruir(session)
+        # sem marca, o primeiro relatório após a migração seria comparado NSU a NSU com todo o histórico,
+        # e os NSUs legados nunca coincidem com os do SITEF
+        tabela_transacao = Transacao.__table__
+        MarcaIngestao.avancar(session, dict(session.execute(
+            select(tabela_transacao.c.pdv, func.max(tabela_transacao.c.data_transacao)).group_by(tabela_transacao.c.pdv)
+            ).all()))
+        session.commit()
+        # os caches do dashboard guardam resultados da tabela antiga
+        VersaoDados.incrementar(session)
+    with engine.connect() as conexao:
+        depois = tamanho_tabela(conexao, "transacao")
+    return {"linhas": copiadas, "antes": antes, "depois": depois}
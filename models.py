@@ -1,16 +1,224 @@
-from typing import List
-from datetime import datetime
+from typing import List, Optional
+from datetime import datetime, date, time, timedelta
 import logging
+import hashlib
+import os
+import weakref
+from time import monotonic as time_monotonic
 import sqlalchemy
-from sqlalchemy import Integer, String, ForeignKey, DateTime
-from sqlalchemy.orm import DeclarativeBase, Mapped, relationship, mapped_column
+from sqlalchemy import Integer, BigInteger, SmallInteger, String, Boolean, ForeignKey, DateTime, Date, Index, UniqueConstraint
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.orm import DeclarativeBase, Mapped, relationship, mapped_column, selectinload
 from sqlalchemy import select, between
 from sqlalchemy.sql.expression import func
+from sqlalchemy.dialects import mysql, sqlite, postgresql
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from metricas import medir, cronometrar_consulta
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Quantidade de linhas por INSERT de múltiplas linhas
+TAMANHO_LOTE = 1000
+
+
+class _FormatoData(FunctionElement):
+    """Formata uma data como texto usando a função própria de cada banco
+    DATE_FORMAT no MySQL/MariaDB, strftime no SQLite e to_char no PostgreSQL.
+    As subclasses definem o formato equivalente em cada dialeto
+    """
+    type = String()
+    inherit_cache = True
+    formatos = {}
+
+
+class dia_formatado(_FormatoData):
+    """Data no formato DD/MM/AAAA
+    """
+    inherit_cache = True
+    formatos = {"mysql": "%d/%m/%Y", "sqlite": "%d/%m/%Y", "postgresql": "DD/MM/YYYY"}
+
+
+class hora_minuto(_FormatoData):
+    """Horário no formato HH:MM
+    """
+    inherit_cache = True
+    formatos = {"mysql": "%H:%i", "sqlite": "%H:%M", "postgresql": "HH24:MI"}
+
+
+def _formato_literal(elemento, compiler, dialeto:str) -> str:
+    # o formato vai literal no SQL para que SELECT e GROUP BY tenham a mesma expressão
+    return compiler.render_literal_value(elemento.formatos[dialeto], String())
+
+
+@compiles(_FormatoData)
+def _formatar_data_padrao(elemento, compiler, **kw):
+    raise sqlalchemy.exc.CompileError(f"Formatação de data não suportada no banco {compiler.dialect.name}")
+
+
+@compiles(_FormatoData, "mysql")
+@compiles(_FormatoData, "mariadb")
+def _formatar_data_mysql(elemento, compiler, **kw):
+    return f"DATE_FORMAT({compiler.process(elemento.clauses, **kw)}, {_formato_literal(elemento, compiler, 'mysql')})"
+
+
+@compiles(_FormatoData, "sqlite")
+def _formatar_data_sqlite(elemento, compiler, **kw):
+    return f"strftime({_formato_literal(elemento, compiler, 'sqlite')}, {compiler.process(elemento.clauses, **kw)})"
+
+
+@compiles(_FormatoData, "postgresql")
+def _formatar_data_postgresql(elemento, compiler, **kw):
+    return f"to_char({compiler.process(elemento.clauses, **kw)}, {_formato_literal(elemento, compiler, 'postgresql')})"
+
+
+class data_do_dia(FunctionElement):
+    """Parte de data (sem horário) de uma coluna DateTime
+    DATE() no MySQL/MariaDB e no SQLite, CAST AS DATE no PostgreSQL
+    """
+    type = Date()
+    inherit_cache = True
+
+
+@compiles(data_do_dia)
+def _data_do_dia_padrao(elemento, compiler, **kw):
+    return f"CAST({compiler.process(elemento.clauses, **kw)} AS DATE)"
+
+
+@compiles(data_do_dia, "mysql")
+@compiles(data_do_dia, "mariadb")
+@compiles(data_do_dia, "sqlite")
+def _data_do_dia_funcao(elemento, compiler, **kw):
+    return f"DATE({compiler.process(elemento.clauses, **kw)})"
+
+
+class CodigoEnumerado(TypeDecorator):
+    """Grava textos repetitivos como SMALLINT a partir de uma relação fixa de códigos
+    Para o código Python a coluna continua recebendo e devolvendo o texto
+    """
+    impl = SmallInteger
+    cache_ok = True
+
+    def __init__(self, codigos:tuple) -> None:
+        """
+        Args:
+            codigos (tuple): pares (texto, código), códigos existentes nunca devem mudar
+        """
+        super().__init__()
+        self.codigos = codigos
+        self._por_texto = dict(codigos)
+        self._por_codigo = {codigo: texto for texto, codigo in codigos}
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        try:
+            return self._por_texto[value]
+        except KeyError:
+            raise ValueError(f"Valor sem código cadastrado: {value}") from None
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return self._por_codigo[value]
+
+
+# Códigos de tipo e estado de transação gravados no banco, acrescente novos valores ao final
+TIPOS_TRANSACAO = (("Compra Pix", 1),)
+ESTADOS_TRANSACAO = (("Efetuada PDV", 1),)
+
+
+class hora_do_dia(FunctionElement):
+    """Hora (0 a 23) de uma coluna DateTime
+    """
+    type = Integer()
+    inherit_cache = True
+
+
+class dia_da_semana(FunctionElement):
+    """Dia da semana de uma coluna DateTime, 0 para domingo até 6 para sábado
+    """
+    type = Integer()
+    inherit_cache = True
+
+
+@compiles(hora_do_dia)
+@compiles(dia_da_semana)
+def _parte_data_padrao(elemento, compiler, **kw):
+    raise sqlalchemy.exc.CompileError(f"Extração de hora e dia da semana não suportada no banco {compiler.dialect.name}")
+
+
+@compiles(hora_do_dia, "mysql")
+@compiles(hora_do_dia, "mariadb")
+def _hora_do_dia_mysql(elemento, compiler, **kw):
+    return f"HOUR({compiler.process(elemento.clauses, **kw)})"
+
+
+@compiles(dia_da_semana, "mysql")
+@compiles(dia_da_semana, "mariadb")
+def _dia_da_semana_mysql(elemento, compiler, **kw):
+    # DAYOFWEEK vai de 1 (domingo) a 7 (sábado)
+    return f"(DAYOFWEEK({compiler.process(elemento.clauses, **kw)}) - 1)"
+
+
+@compiles(hora_do_dia, "sqlite")
+def _hora_do_dia_sqlite(elemento, compiler, **kw):
+    return f"CAST(strftime('%H', {compiler.process(elemento.clauses, **kw)}) AS INTEGER)"
+
+
+@compiles(dia_da_semana, "sqlite")
+def _dia_da_semana_sqlite(elemento, compiler, **kw):
+    return f"CAST(strftime('%w', {compiler.process(elemento.clauses, **kw)}) AS INTEGER)"
+
+
+@compiles(hora_do_dia, "postgresql")
+def _hora_do_dia_postgresql(elemento, compiler, **kw):
+    return f"CAST(EXTRACT(HOUR FROM {compiler.process(elemento.clauses, **kw)}) AS INTEGER)"
+
+
+@compiles(dia_da_semana, "postgresql")
+def _dia_da_semana_postgresql(elemento, compiler, **kw):
+    return f"CAST(EXTRACT(DOW FROM {compiler.process(elemento.clauses, **kw)}) AS INTEGER)"
+
+
+def consulta_para_arrow(session:sqlalchemy.orm.session.Session, consulta:sqlalchemy.sql.Select, esquema:pa.Schema, tamanho_lote:int=10_000) -> pa.Table:
+    """Executa a consulta e monta as colunas tipadas direto das tuplas do cursor do driver, lote a lote,
+    sem objetos Row ou do ORM, dicionários por linha ou conversões de tipo depois no pandas.
+    Os processadores de resultado do SQLAlchemy não são aplicados, use para colunas que o driver
+    já devolve no tipo do esquema (inteiros e textos)
+
+    Args:
+        session (sqlalchemy.orm.session.Session): Sessão para acesso ao banco
+        consulta (sqlalchemy.sql.Select): consulta com as colunas na ordem do esquema
+        esquema (pa.Schema): nomes e tipos das colunas do resultado
+        tamanho_lote (int, optional): linhas buscadas por vez no cursor. Padrão 10_000.
+
+    Returns:
+        pa.Table: resultado da consulta
+    """
+    # executa pela conexão, assim o resultado é sempre o cursor do Core, mesmo com colunas do ORM
+    resultado = session.connection().execute(consulta)
+    cursor = resultado.cursor
+    lotes = []
+    try:
+        while True:
+            linhas = cursor.fetchmany(tamanho_lote)
+            if not linhas:
+                break
+            colunas = zip(*linhas)
+            lotes.append(pa.RecordBatch.from_arrays(
+                [pa.array(valores, type=campo.type) for valores, campo in zip(colunas, esquema)], schema=esquema
+                ))
+    finally:
+        resultado.close()
+    return pa.Table.from_batches(lotes, schema=esquema)
+
 
 class Base(DeclarativeBase):
     pass
@@ -40,6 +248,7 @@ class Operador(Base):
         }
 
     @staticmethod
+    @cronometrar_consulta
     def todos(session:sqlalchemy.orm.session.Session) -> list:
         """Retorna todos os operadores cadastrados
 
@@ -52,25 +261,31 @@ class Operador(Base):
         r = session.execute(select(Operador)).scalars().all()
         return r
     
+    ESQUEMA_ARROW = pa.schema([
+        ("id", pa.int64()), ("codigo_operador", pa.int64()), ("nome", pa.string()), ("login", pa.string())
+        ])
+
     @staticmethod
-    def todos_para_df(session:sqlalchemy.orm.session.Session) -> list:
+    @cronometrar_consulta
+    def todos_para_df(session:sqlalchemy.orm.session.Session, arrow:bool=False):
         """Retorna todos os operadores cadastrados na forma de um dataframe
-        Usa o método to_dict() e a lista de colunas para gerar o dataframe
+        As colunas são montadas direto do cursor, sem carregar objetos Operador
 
         Args:
             session (sqlalchemy.orm.session.Session): Sessão do SQLALchemy
+            arrow (bool, optional): retorna a tabela do pyarrow em vez do DataFrame. Padrão False.
 
         Returns:
             pd.DataFrame: DF com todos os operadores 
         """
-        lista_dicts = []
-        r = session.execute(select(Operador)).scalars().all()
-        for x in r:
-            operador_dict = x.to_dict()
-            lista_dicts.append(operador_dict)
-        return pd.DataFrame(lista_dicts, columns=Operador.__table__.columns.keys())
-        
+        tabela_operador = Operador.__table__
+        tabela = consulta_para_arrow(session, select(
+            tabela_operador.c.id, tabela_operador.c.codigo_operador, tabela_operador.c.nome, tabela_operador.c.login
+            ), Operador.ESQUEMA_ARROW)
+        return tabela if arrow else tabela.to_pandas()
+
     @staticmethod
+    @cronometrar_consulta
     def operador_por_codigo(session:sqlalchemy.orm.session.Session, cod_operador:int):
         """Consulta no banco um operador a partir do código de operador
 
@@ -83,6 +298,7 @@ class Operador(Base):
             return result[0]
 
     @staticmethod
+    @cronometrar_consulta
     def existe(session:sqlalchemy.orm.session.Session, cod_operador:int) -> bool:
         """Verifica se operador existe no banco baseado no código identificador
 
@@ -93,36 +309,179 @@ class Operador(Base):
         Returns:
             bool: True se operador existe, False se não
         """
-        result = session.execute(select(Operador).where(Operador.codigo_operador == cod_operador)).first()
-        if result:
+        if cod_operador in Operador.diretorio(session):
             return True
-        else:
-            return False
+        # operador cadastrado por outro processo depois da carga do diretório
+        return cod_operador in Operador.diretorio(session, recarregar=True)
 
     @staticmethod
-    def gravar_banco(df:pd.DataFrame, session:sqlalchemy.orm.session.Session):
-        """Grava os dados de transações do dataframe no banco identificado pelo Session
+    def diretorio(session:sqlalchemy.orm.session.Session, recarregar:bool=False) -> "DiretorioOperadores":
+        """Diretório de operadores em memória do engine da sessão, carregado na primeira chamada
+        e recarregado quando invalidado por Operador.gravar_banco ou após VALIDADE_DIRETORIO segundos,
+        que limita o tempo em que alterações gravadas por outro processo ficam sem aparecer
 
         Args:
-            df (pandas.DataFrame): DataFrame com dados de transações
             session (sqlalchemy.orm.session.Session): Session do SQLAlchemy
+            recarregar (bool, optional): consulta o banco mesmo com o diretório carregado. Padrão False.
+
+        Returns:
+            DiretorioOperadores: diretório do banco da sessão
         """
-        for ind in df.index:
-            codigo = int(df['Código'][ind])
-            nome = df['Nome'][ind]
-            login = df['Logname'][ind]
-            if Operador.existe(session, codigo):
-                logger.info("Operador %s já existe no banco", nome)
-            else:
-                model_operador = Operador(
-                codigo_operador=codigo,
-                nome=nome,
-                login=login
-            )
-                session.add(model_operador)
-                logger.info("Gravando operador %s no banco", nome)
-                del model_operador
+        chave = session.get_bind().engine
+        diretorio = _diretorios.get(chave)
+        if recarregar or diretorio is None or time_monotonic() - diretorio.carregado_em > VALIDADE_DIRETORIO:
+            diretorio = DiretorioOperadores.carregar(session)
+            _diretorios[chave] = diretorio
+        return diretorio
+
+    @staticmethod
+    def invalidar_diretorio(session:sqlalchemy.orm.session.Session):
+        """Descarta o diretório em memória do engine da sessão, a próxima consulta recarrega
+        """
+        _diretorios.pop(session.get_bind().engine, None)
+
+    @staticmethod
+    def gravar_banco(df:pd.DataFrame, session:sqlalchemy.orm.session.Session) -> dict:
+        """Grava os operadores do dataframe no banco identificado pelo Session
+        Operadores novos são inseridos e os que mudaram de nome ou login são atualizados,
+        tudo em lotes a partir de uma única consulta dos operadores existentes
+
+        Args:
+            df (pandas.DataFrame): DataFrame com dados de operadores
+            session (sqlalchemy.orm.session.Session): Session do SQLAlchemy
+
+        Returns:
+            dict: contagem de operadores "inseridos", "atualizados" e "inalterados"
+        """
+        tabela_operador = Operador.__table__
+        planilha = {}
+        for codigo, nome, login in zip(df['Código'], df['Nome'], df['Logname']):
+            planilha[int(codigo)] = (nome, login)
+
+        existentes = {
+            codigo: (nome, login)
+            for codigo, nome, login in session.execute(
+                select(tabela_operador.c.codigo_operador, tabela_operador.c.nome, tabela_operador.c.login)
+                )
+            }
+
+        novos = []
+        alterados = []
+        for codigo, (nome, login) in planilha.items():
+            if codigo not in existentes:
+                novos.append({"codigo_operador": codigo, "nome": nome, "login": login})
+            elif existentes[codigo] != (nome, login):
+                alterados.append({"b_codigo": codigo, "b_nome": nome, "b_login": login})
+
+        for inicio in range(0, len(novos), TAMANHO_LOTE):
+            session.execute(sqlalchemy.insert(tabela_operador), novos[inicio:inicio + TAMANHO_LOTE])
+        if alterados:
+            comando = sqlalchemy.update(tabela_operador).where(
+                tabela_operador.c.codigo_operador == sqlalchemy.bindparam("b_codigo")
+                ).values(nome=sqlalchemy.bindparam("b_nome"), login=sqlalchemy.bindparam("b_login"))
+            for inicio in range(0, len(alterados), TAMANHO_LOTE):
+                session.execute(comando, alterados[inicio:inicio + TAMANHO_LOTE])
         session.commit()
+        if novos or alterados:
+            Operador.invalidar_diretorio(session)
+
+        resumo = {
+            "inseridos": len(novos),
+            "atualizados": len(alterados),
+            "inalterados": len(planilha) - len(novos) - len(alterados)
+        }
+        logger.info("Operadores gravados no banco: %s", resumo)
+        return resumo
+
+# Diretórios de operadores carregados, por engine; somem junto com o engine descartado
+_diretorios = weakref.WeakKeyDictionary()
+# Segundos até o diretório ser recarregado do banco
+VALIDADE_DIRETORIO = 300
+
+
+class DiretorioOperadores():
+    """Código, nome e login de todos os operadores em memória, carregados numa única consulta
+    Os códigos ficam ordenados num array do numpy e a busca de muitos códigos de uma vez é vetorizada,
+    sem uma consulta ao banco por operador
+
+    Attrs:
+        codigos (np.ndarray): códigos de operador em ordem crescente
+        nomes (np.ndarray): nome de cada código
+        logins (np.ndarray): login de cada código
+        carregado_em (float): time.monotonic() da carga
+    """
+    def __init__(self, codigos, nomes, logins) -> None:
+        codigos = np.asarray(codigos, dtype=np.int64)
+        ordem = np.argsort(codigos, kind="stable")
+        self.codigos = codigos[ordem]
+        self.nomes = np.asarray(nomes, dtype=object)[ordem]
+        self.logins = np.asarray(logins, dtype=object)[ordem]
+        self.carregado_em = time_monotonic()
+
+    @staticmethod
+    @cronometrar_consulta
+    def carregar(session:sqlalchemy.orm.session.Session) -> "DiretorioOperadores":
+        """Lê todos os operadores do banco
+
+        Args:
+            session (sqlalchemy.orm.session.Session): Session do SQLAlchemy
+
+        Returns:
+            DiretorioOperadores: diretório com os operadores cadastrados
+        """
+        tabela_operador = Operador.__table__
+        linhas = session.execute(
+            select(tabela_operador.c.codigo_operador, tabela_operador.c.nome, tabela_operador.c.login)
+            ).all()
+        return DiretorioOperadores(*zip(*linhas)) if linhas else DiretorioOperadores([], [], [])
+
+    def __len__(self) -> int:
+        return len(self.codigos)
+
+    def __contains__(self, codigo) -> bool:
+        return bool(self.cadastrados([codigo])[0])
+
+    def _posicoes(self, codigos) -> tuple:
+        codigos = np.asarray(codigos, dtype=np.int64)
+        posicoes = np.searchsorted(self.codigos, codigos)
+        encontrados = posicoes < len(self.codigos)
+        encontrados[encontrados] = self.codigos[posicoes[encontrados]] == codigos[encontrados]
+        return posicoes, encontrados
+
+    def cadastrados(self, codigos) -> np.ndarray:
+        """True para cada código cadastrado
+
+        Args:
+            codigos: sequência de códigos de operador
+
+        Returns:
+            np.ndarray: array booleano na ordem dos códigos
+        """
+        return self._posicoes(codigos)[1]
+
+    def nomes_por_codigo(self, codigos, ausente:Optional[str]=None) -> np.ndarray:
+        """Nome de cada código, ausente para códigos não cadastrados
+
+        Args:
+            codigos: sequência de códigos de operador
+            ausente (Optional[str], optional): valor dos códigos não cadastrados. Padrão None.
+
+        Returns:
+            np.ndarray: nomes na ordem dos códigos
+        """
+        posicoes, encontrados = self._posicoes(codigos)
+        nomes = np.full(len(posicoes), ausente, dtype=object)
+        nomes[encontrados] = self.nomes[posicoes[encontrados]]
+        return nomes
+
+    def obter(self, codigo:int) -> Optional[tuple]:
+        """Nome e login do operador, None se não cadastrado
+        """
+        posicoes, encontrados = self._posicoes([codigo])
+        if encontrados[0]:
+            return self.nomes[posicoes[0]], self.logins[posicoes[0]]
+        return None
+
 
 class Transacao(Base):
     """Classe compatível com SQLAlchemy que representa uma transação
@@ -135,12 +494,20 @@ class Transacao(Base):
         data_transacao
     """
     __tablename__ = 'transacao'
+    __table_args__ = (
+        Index("ix_transacao_data_transacao", "data_transacao"),
+        # cobre o filtro por período e o agrupamento por operador do ranking
+        Index("ix_transacao_data_transacao_operador", "data_transacao", "codigo_operador"),
+        # cobre a vazão por PDV sem ler as linhas da tabela
+        Index("ix_transacao_data_transacao_pdv", "data_transacao", "pdv"),
+    )
     id:Mapped[int] = mapped_column(primary_key = True)
-    nsu:Mapped[str] = mapped_column(String(30), unique=True)
+    # NSU informado pelo SITEF. Transações migradas do esquema antigo, sem NSU real, usam valores negativos
+    nsu:Mapped[int] = mapped_column(BigInteger, unique=True)
     data_transacao = mapped_column(DateTime, nullable=False)
-    pdv:Mapped[int] = mapped_column(String(10))
-    tipo_transacao:Mapped[str] = mapped_column(String(15))
-    estado_transacao:Mapped[str] = mapped_column(String(30))
+    pdv:Mapped[int] = mapped_column(Integer)
+    tipo_transacao:Mapped[str] = mapped_column(CodigoEnumerado(TIPOS_TRANSACAO))
+    estado_transacao:Mapped[str] = mapped_column(CodigoEnumerado(ESTADOS_TRANSACAO))
     codigo_operador:Mapped[int] = mapped_column(ForeignKey("operador.codigo_operador"))
     operador:Mapped["Operador"] = relationship(back_populates="transacao")
     
@@ -158,100 +525,520 @@ class Transacao(Base):
     def __repr__(self):
         return f"NSU: {self.nsu}, Data da transação: {self.data_transacao}, PDV: {self.pdv}"
 
-    def to_dict(self):
+    def to_dict(self, diretorio:Optional[DiretorioOperadores]=None):
         """Transforma em um dicionário
+        O nome do operador vem do relacionamento quando já carregado (Transacao.listar com carregar_operador=True),
+        senão do diretório de operadores, sem uma consulta por transação
+
+        Args:
+            diretorio (Optional[DiretorioOperadores], optional): diretório a usar, padrão o do banco da sessão do objeto
 
         Returns:
             dict: dicionário com os atributos do objeto
         """
-        if self.operador is not None:
-            return {
-                "id": self.id,
-                "nsu": self.nsu,
-                "data_transacao": self.data_transacao,
-                "codigo_operador": self.codigo_operador,
-                "nome_operador": self.operador.nome
-            }
+        if diretorio is None and "operador" in sqlalchemy.inspect(self).dict:
+            nome = self.operador.nome if self.operador is not None else None
         else:
-             return {
-                "id": self.id,
-                "nsu": self.nsu,
-                "data_transacao": self.data_transacao,
-                "codigo_operador": self.codigo_operador,
-                "nome_operador": "OPERADOR NÃO CADASTRADO"
-            }
+            if diretorio is None:
+                diretorio = Operador.diretorio(sqlalchemy.orm.object_session(self))
+            nome = diretorio.nomes_por_codigo([self.codigo_operador])[0]
+        return {
+            "id": self.id,
+            "nsu": self.nsu,
+            "data_transacao": self.data_transacao,
+            "codigo_operador": self.codigo_operador,
+            "nome_operador": nome if nome is not None else "OPERADOR NÃO CADASTRADO"
+        }
+
+    @staticmethod
+    @cronometrar_consulta
+    def listar(session:sqlalchemy.orm.session.Session, data_inicial:datetime, data_final:datetime,
+               carregar_operador:bool=False) -> List["Transacao"]:
+        """Transações do período em ordem de data
+
+        Args:
+            session (sqlalchemy.orm.session.Session): Sessão para acesso ao banco
+            data_inicial (datetime): Data de início
+            data_final (datetime): Data de fim
+            carregar_operador (bool, optional): carrega o operador de todas as transações numa consulta extra
+                (selectinload), o acesso a transacao.operador não consulta o banco por linha. Padrão False.
+
+        Returns:
+            List[Transacao]: transações do período
+        """
+        consulta = select(Transacao).where(
+            between(Transacao.data_transacao, data_inicial, data_final)
+            ).order_by(Transacao.data_transacao, Transacao.nsu)
+        if carregar_operador:
+            consulta = consulta.options(selectinload(Transacao.operador))
+        return session.execute(consulta).scalars().all()
+
+    @staticmethod
+    @cronometrar_consulta
+    def listar_df(session:sqlalchemy.orm.session.Session, data_inicial:datetime, data_final:datetime) -> pd.DataFrame:
+        """Transações do período em DataFrame, com as colunas de to_dict; os nomes dos operadores
+        vêm do diretório em memória, sem junção com a tabela operador
+
+        Args:
+            session (sqlalchemy.orm.session.Session): Sessão para acesso ao banco
+            data_inicial (datetime): Data de início
+            data_final (datetime): Data de fim
+
+        Returns:
+            pd.DataFrame: id, nsu, data_transacao, codigo_operador e nome_operador
+        """
+        tabela_transacao = Transacao.__table__
+        df = pd.DataFrame(session.execute(
+            select(
+                tabela_transacao.c.id, tabela_transacao.c.nsu, tabela_transacao.c.data_transacao, tabela_transacao.c.codigo_operador
+                ).where(
+                    between(tabela_transacao.c.data_transacao, data_inicial, data_final)
+                    ).order_by(tabela_transacao.c.data_transacao, tabela_transacao.c.nsu)
+            ).all(), columns=["id", "nsu", "data_transacao", "codigo_operador"])
+        df["nome_operador"] = Operador.diretorio(session).nomes_por_codigo(
+            df["codigo_operador"].to_numpy(), ausente="OPERADOR NÃO CADASTRADO"
+            )
+        return df
 
     @staticmethod
-    def ranking_range_data(session:sqlalchemy.orm.session.Session, data_inicial:datetime, data_final:datetime) -> pd.DataFrame:
+    def verificar_operadores(session:sqlalchemy.orm.session.Session, codigos):
+        """Confere no diretório de operadores se todos os códigos estão cadastrados.
+        Antes de acusar ausência o diretório é recarregado uma vez, para os operadores gravados por outro processo
+
+        Args:
+            session (sqlalchemy.orm.session.Session): Session do SQLAlchemy
+            codigos: códigos de operador das transações
+
+        Raises:
+            Transacao.exc.OperadorAusente: o segundo argumento é a lista com todos os códigos ausentes
+        """
+        codigos = np.unique(np.asarray(codigos, dtype=np.int64))
+        ausentes = codigos[~Operador.diretorio(session).cadastrados(codigos)]
+        if len(ausentes):
+            ausentes = ausentes[~Operador.diretorio(session, recarregar=True).cadastrados(ausentes)]
+        if len(ausentes):
+            raise Transacao.exc.OperadorAusente(
+                "Operador ausente, atualize a tabela de operadores e tente novamente ", [int(codigo) for codigo in ausentes]
+                )
+
+    ESQUEMA_RANKING = pa.schema([
+        ("codigo_operador", pa.int64()), ("nome_operador", pa.string()), ("contagem_pix", pa.int64())
+        ])
+    ESQUEMA_MENSAL = pa.schema([
+        ("data_movimento", pa.string()), ("contagem_transacoes", pa.int64()),
+        ("primeira_transacao", pa.string()), ("ultima_transacao", pa.string())
+        ])
+
+    @staticmethod
+    @cronometrar_consulta
+    def ranking_range_data(session:sqlalchemy.orm.session.Session, data_inicial:datetime, data_final:datetime, arrow:bool=False):
         """Consulta todas as transações em determinado período de tempo
+        Fora do resumo diário, as transações dos meses arquivados e removidos são lidas do Parquet e somadas
 
         Args:
             session (sqlalchemy.orm.session.Session): Sessão para acesso ao banco
             data_inicial (datetime): Data de início
             data_final (datetime): Data de fim
+            arrow (bool, optional): retorna a tabela do pyarrow em vez do DataFrame. Padrão False.
 
         Raises:
             Transacao.exc.ConsultaInvalida: Período informado na consulta é inválido
 
         Returns:
-            pd.DataFrame: DataFrame com os dados da consulta
+            pd.DataFrame: DataFrame com os dados da consulta, do operador com mais transações para o com menos
+        """
+        for pelo_resumo in Transacao._fontes_ranking(data_inicial, data_final):
+            consulta = Transacao._consulta_ranking(data_inicial, data_final, pelo_resumo)
+            # ordenado uma única vez, no banco; o código desempata como na paginação
+            r = consulta_para_arrow(
+                session, consulta.order_by(sqlalchemy.desc("contagem"), "codigo_operador"), Transacao.ESQUEMA_RANKING
+                )
+            if not pelo_resumo:
+                r = Transacao._somar_ranking_arquivado(session, r, data_inicial, data_final)
+            if r.num_rows:
+                return r if arrow else r.to_pandas()
+        raise Transacao.exc.ConsultaInvalida("Ranking inválido, não há pix registrados")
+
+    @staticmethod
+    def _somar_ranking_arquivado(session:sqlalchemy.orm.session.Session, ranking:pa.Table,
+                                 data_inicial:datetime, data_final:datetime) -> pa.Table:
+        """Soma ao ranking da tabela transacao as transações do período guardadas nos meses arquivados
+        e removidos, mantendo a ordenação do ranking. Os nomes vêm do diretório de operadores
+        """
+        arquivo = MesArquivado.ler_transacoes(session, data_inicial, data_final, ["codigo_operador"])
+        if arquivo is None or arquivo.num_rows == 0:
+            return ranking
+        contagens = arquivo.column("codigo_operador").to_pandas().value_counts()
+        df = pd.concat([
+            ranking.select(["codigo_operador", "contagem_pix"]).to_pandas(),
+            pd.DataFrame({"codigo_operador": contagens.index.astype("int64"), "contagem_pix": contagens.to_numpy()}),
+            ]).groupby("codigo_operador", as_index=False)["contagem_pix"].sum()
+        df = df.sort_values(["contagem_pix", "codigo_operador"], ascending=[False, True])
+        nomes = Operador.diretorio(session).nomes_por_codigo(df["codigo_operador"].to_numpy())
+        return pa.table({
+            "codigo_operador": df["codigo_operador"].to_numpy(),
+            "nome_operador": pa.array(nomes, type=pa.string()),
+            "contagem_pix": df["contagem_pix"].to_numpy(),
+            }, schema=Transacao.ESQUEMA_RANKING)
+
+    @staticmethod
+    @cronometrar_consulta
+    def ranking_paginado(session:sqlalchemy.orm.session.Session, data_inicial:datetime, data_final:datetime,
+                         limite:int=50, apos:Optional[tuple]=None, busca:Optional[str]=None, arrow:bool=False) -> tuple:
+        """Uma página do ranking do período, ordenada e cortada no banco, e o total de operadores do ranking.
+        A página seguinte começa depois da última linha da atual (paginação por chave), sem o OFFSET,
+        que obrigaria o banco a contar as linhas de todas as páginas anteriores.
+        Períodos de dias inteiros incluem os meses arquivados pelo resumo diário; períodos parciais
+        leem só a tabela transacao
+
+        Args:
+            session (sqlalchemy.orm.session.Session): Sessão para acesso ao banco
+            data_inicial (datetime): Data de início
+            data_final (datetime): Data de fim
+            limite (int, optional): operadores por página. Padrão 50.
+            apos (Optional[tuple], optional): contagem_pix e codigo_operador da última linha da página anterior,
+                None para a primeira página
+            busca (Optional[str], optional): parte do nome do operador, sem diferenciar maiúsculas, ou o código
+            arrow (bool, optional): retorna a tabela do pyarrow em vez do DataFrame. Padrão False.
+
+        Returns:
+            tuple: página (pd.DataFrame ou pa.Table, vazia quando não há transações) e total de operadores
+        """
+        for pelo_resumo in Transacao._fontes_ranking(data_inicial, data_final):
+            ranking = Transacao._consulta_ranking(data_inicial, data_final, pelo_resumo, busca).subquery()
+            total = session.execute(select(func.count()).select_from(ranking)).scalar()
+            if total:
+                break
+        consulta = select(ranking.c.codigo_operador, ranking.c.nome, ranking.c.contagem)
+        if apos is not None:
+            # valores tirados do DataFrame chegam como numpy.int64, que o sqlite3 grava como BLOB
+            contagem, codigo_operador = (int(valor) for valor in apos)
+            consulta = consulta.where(sqlalchemy.or_(
+                ranking.c.contagem < contagem,
+                sqlalchemy.and_(ranking.c.contagem == contagem, ranking.c.codigo_operador > codigo_operador)
+                ))
+        consulta = consulta.order_by(ranking.c.contagem.desc(), ranking.c.codigo_operador).limit(limite)
+        r = consulta_para_arrow(session, consulta, Transacao.ESQUEMA_RANKING) if total else Transacao.ESQUEMA_RANKING.empty_table()
+        return (r if arrow else r.to_pandas()), total
+
+    @staticmethod
+    def _fontes_ranking(data_inicial:datetime, data_final:datetime) -> tuple:
+        """Fontes do ranking na ordem de consulta: o resumo diário quando o período cobre dias inteiros,
+        e a tabela transacao, para períodos parciais ou dias ainda sem resumo
+        """
+        if Transacao._dias_inteiros(data_inicial, data_final) is not None:
+            return (True, False)
+        return (False,)
+
+    @staticmethod
+    def _consulta_ranking(data_inicial:datetime, data_final:datetime, pelo_resumo:bool, busca:Optional[str]=None) -> sqlalchemy.sql.Select:
+        """Quantidade de transações por operador no período, sem ordenação, com as colunas
+        codigo_operador, nome e contagem. A busca filtra os operadores antes do agrupamento
         """
         tabela_transacao = Transacao.__table__
         tabela_operador = Operador.__table__
-        consulta = select(
-            tabela_transacao.c.codigo_operador,tabela_operador.c.nome, func.count().label("contagem")
-            ).join(
-                tabela_operador
-                ).where(
-                    between(Transacao.data_transacao, data_inicial, data_final)
-                    ).group_by(
-                tabela_transacao.c.codigo_operador
-                ).order_by("contagem")
-        r = session.execute(consulta).all()
-        if r:
-            df = pd.DataFrame(r, columns=["codigo_operador", "nome_operador", "contagem_pix"])
-            df["codigo_operador"] = df["codigo_operador"].astype(int)
-            return df.sort_values("contagem_pix",ascending=False)
+        if pelo_resumo:
+            consulta = ResumoDiario._consulta_ranking(*Transacao._dias_inteiros(data_inicial, data_final))
         else:
-            raise Transacao.exc.ConsultaInvalida("Ranking inválido, não há pix registrados")
-    
+            consulta = select(
+                tabela_transacao.c.codigo_operador,tabela_operador.c.nome, func.count().label("contagem")
+                ).join(
+                    tabela_operador
+                    ).where(
+                        between(Transacao.data_transacao, data_inicial, data_final)
+                        ).group_by(
+                    tabela_transacao.c.codigo_operador, tabela_operador.c.nome
+                    )
+        busca = (busca or "").strip()
+        if busca:
+            filtro = func.lower(tabela_operador.c.nome).contains(busca.lower(), autoescape=True)
+            if busca.isdigit():
+                filtro = sqlalchemy.or_(filtro, tabela_operador.c.codigo_operador == int(busca))
+            consulta = consulta.where(filtro)
+        return consulta
+
+    @staticmethod
+    @cronometrar_consulta
+    def comparar_periodos(session:sqlalchemy.orm.session.Session, periodos:list, por:str="operador") -> pd.DataFrame:
+        """Contagem de transações de dois ou mais períodos lado a lado, numa única consulta agrupada:
+        cada período é uma soma condicional sobre as linhas que caem em algum dos períodos.
+        O primeiro período é a referência das diferenças
+
+        Args:
+            session (sqlalchemy.orm.session.Session): Sessão para acesso ao banco
+            periodos (list): pares (data_inicial, data_final), inclusos
+            por (str, optional): "operador" para uma linha por operador, ou "dia" para uma linha
+                por dia dos períodos, alinhados pela posição do dia em cada período. Padrão "operador".
+
+        Raises:
+            Transacao.exc.ConsultaInvalida: menos de dois períodos, período com início depois do fim,
+                agrupamento desconhecido ou nenhuma transação nos períodos
+
+        Returns:
+            pd.DataFrame: codigo_operador e nome_operador, ou dia (1 para o primeiro dia de cada período) e
+                data_N; contagem_N de cada período N a partir de 1, e diferenca_N e variacao_N (em %, nula quando
+                o primeiro período não tem transações) de cada período a partir do segundo
+        """
+        if len(periodos) < 2 or any(inicio > fim for inicio, fim in periodos):
+            raise Transacao.exc.ConsultaInvalida("Informe dois ou mais períodos, cada um com início antes do fim")
+        if por not in ("operador", "dia"):
+            raise Transacao.exc.ConsultaInvalida(f"Agrupamento desconhecido: {por}")
+        # o resumo diário só responde quando todos os períodos cobrem dias inteiros
+        if all(Transacao._dias_inteiros(inicio, fim) is not None for inicio, fim in periodos):
+            fontes = (True, False)
+        else:
+            fontes = (False,)
+        for pelo_resumo in fontes:
+            linhas = session.execute(Transacao._consulta_comparacao(periodos, por, pelo_resumo)).all()
+            if linhas:
+                break
+        else:
+            raise Transacao.exc.ConsultaInvalida("Períodos sem transações")
+
+        contagens = [f"contagem_{n}" for n in range(1, len(periodos) + 1)]
+        if por == "operador":
+            df = pd.DataFrame(linhas, columns=["codigo_operador", "nome_operador", *contagens])
+            df = df.sort_values(["contagem_1", "codigo_operador"], ascending=[False, True], ignore_index=True)
+        else:
+            por_data = pd.DataFrame(linhas, columns=["data", *contagens])
+            por_data.index = pd.to_datetime(por_data.pop("data"), format="%d/%m/%Y")
+            colunas = {}
+            for n, (inicio, fim) in enumerate(periodos, start=1):
+                datas = pd.date_range(inicio.date(), fim.date(), freq="D")
+                colunas[f"data_{n}"] = pd.Series(datas.date)
+                colunas[f"contagem_{n}"] = pd.Series(por_data[f"contagem_{n}"].reindex(datas, fill_value=0).values)
+            df = pd.DataFrame(colunas)
+            df.insert(0, "dia", range(1, len(df) + 1))
+            # períodos mais curtos que o maior não têm os últimos dias
+            df[contagens] = df[contagens].astype("Int64")
+        for n in range(2, len(periodos) + 1):
+            df[f"diferenca_{n}"] = df[f"contagem_{n}"] - df["contagem_1"]
+            base = df["contagem_1"].where(df["contagem_1"] != 0)
+            df[f"variacao_{n}"] = (df[f"diferenca_{n}"] / base * 100).astype("Float64").round(1)
+        return df
+
     @staticmethod
-    def tabela_mensal_quantidade_transacoes(session:sqlalchemy.orm.session.Session, mes: int, ano: int) -> pd.DataFrame:
+    def _consulta_comparacao(periodos:list, por:str, pelo_resumo:bool) -> sqlalchemy.sql.Select:
+        """Consulta de comparar_periodos: uma soma condicional por período, agrupada por operador ou por dia,
+        só com as linhas de algum dos períodos
         """
+        tabela_operador = Operador.__table__
+        if pelo_resumo:
+            tabela = ResumoDiario.__table__
+            coluna_data, valor = tabela.c.data, tabela.c.quantidade
+            limites = [Transacao._dias_inteiros(inicio, fim) for inicio, fim in periodos]
+        else:
+            tabela = Transacao.__table__
+            coluna_data, valor = tabela.c.data_transacao, 1
+            limites = periodos
+        condicoes = [between(coluna_data, inicio, fim) for inicio, fim in limites]
+        contagens = [
+            # SUM devolve DECIMAL no MySQL/MariaDB, o cast mantém a coluna inteira
+            sqlalchemy.cast(func.sum(sqlalchemy.case((condicao, valor), else_=0)), Integer)
+            for condicao in condicoes
+            ]
+        if por == "operador":
+            chave = (tabela.c.codigo_operador, tabela_operador.c.nome)
+        else:
+            chave = (dia_formatado(coluna_data),)
+        consulta = select(*chave, *contagens).select_from(tabela)
+        if por == "operador":
+            consulta = consulta.join(tabela_operador)
+        return consulta.where(sqlalchemy.or_(*condicoes)).group_by(*chave)
+
+    @staticmethod
+    def _dias_inteiros(data_inicial:datetime, data_final:datetime) -> Optional[tuple]:
+        """Verifica se o período começa à meia-noite e termina às 23:59:59,
+        condição para a consulta ser respondida pelo resumo diário
+
         Args:
-        session (sqlalchemy.orm.session.Session)
-        mes (int): formato MM
-        ano (int): formato YYYY
+            data_inicial (datetime): Data de início
+            data_final (datetime): Data de fim, inclusa
+
+        Returns:
+            Optional[tuple]: primeiro e último dia do período, None se não cobre dias inteiros
         """
-        
-        
+        if data_inicial.time() == time(0, 0) and data_final.time() >= time(23, 59, 59) and data_inicial <= data_final:
+            return data_inicial.date(), data_final.date()
+        return None
+
+    @staticmethod
+    def _limites_mes(mes:int, ano:int) -> tuple:
+        """Calcula o intervalo semiaberto [início do mês, início do mês seguinte)
+
+        Args:
+            mes (int): formato MM
+            ano (int): formato YYYY
+
+        Returns:
+            tuple: datetime inicial (incluso) e datetime final (excluso)
         """
-        Dataframe com a seguinte query:
-        SELECT strftime('%d/%m/%Y', datetime(transacao.data_transacao)) AS "Data", COUNT(*) AS "Contagem de Transações",
-        strftime('%H:%M', min(datetime(transacao.data_transacao))) as "Primeira transação", strftime('%H:%M',max(datetime(transacao.data_transacao))) as "Última transação"
-        FROM transacao
-        WHERE strftime('%Y-%m', transacao.data_transacao) = '2023-10'
-        GROUP BY strftime('%d/%m/%Y', datetime(transacao.data_transacao))
-        ORDER BY datetime(transacao.data_transacao);
+        inicio = datetime(int(ano), int(mes), 1)
+        if inicio.month == 12:
+            fim = datetime(inicio.year + 1, 1, 1)
+        else:
+            fim = datetime(inicio.year, inicio.month + 1, 1)
+        return inicio, fim
 
+    @staticmethod
+    def _consulta_mensal(mes:int, ano:int) -> sqlalchemy.sql.Select:
+        """Monta a consulta da quantidade diária de transações do mês
+        O filtro compara a coluna data_transacao diretamente com o intervalo do mês,
+        assim o banco usa o índice em vez de formatar a data de todas as linhas.
+        A agregação é feita no banco, com a formatação de data do dialeto em uso
+
+        Args:
+            mes (int): formato MM
+            ano (int): formato YYYY
+
+        Returns:
+            sqlalchemy.sql.Select: consulta com data, contagem, primeira e última transação
         """
         tabela_transacao = Transacao.__table__
-        
-        consulta = select(
-            sqlalchemy.func.date_format(tabela_transacao.c.data_transacao,'%d/%m/%Y'), func.count().label("Contagem"), 
-            sqlalchemy.func.min(sqlalchemy.func.date_format(tabela_transacao.c.data_transacao, '%H:%i')),
-            sqlalchemy.func.max(sqlalchemy.func.date_format(tabela_transacao.c.data_transacao, '%H:%i')),
-            ).where(sqlalchemy.func.date_format(tabela_transacao.c.data_transacao, '%Y-%m') == f"{int(ano)}-{int(mes)}"
-                ).group_by(sqlalchemy.func.date_format(tabela_transacao.c.data_transacao,'%d/%m/%Y'))
-        r = session.execute(consulta).all()
-        
-        if r:
-            df = pd.DataFrame(r, columns=["data_movimento", "contagem_transacoes", "primeira_transacao", "ultima_transacao"])
-            return df
+        inicio, fim = Transacao._limites_mes(mes, ano)
+        dia = dia_formatado(tabela_transacao.c.data_transacao)
+        return select(
+            dia, func.count().label("Contagem"),
+            hora_minuto(sqlalchemy.func.min(tabela_transacao.c.data_transacao)),
+            hora_minuto(sqlalchemy.func.max(tabela_transacao.c.data_transacao)),
+            ).where(
+                tabela_transacao.c.data_transacao >= inicio,
+                tabela_transacao.c.data_transacao < fim
+                ).group_by(dia).order_by(sqlalchemy.func.min(tabela_transacao.c.data_transacao))
+
+    @staticmethod
+    @cronometrar_consulta
+    def tabela_mensal_quantidade_transacoes(session:sqlalchemy.orm.session.Session, mes: int, ano: int, arrow:bool=False):
+        """Quantidade de transações por dia do mês, com o horário da primeira e da última
+
+        Args:
+            session (sqlalchemy.orm.session.Session): Sessão para acesso ao banco
+            mes (int): formato MM
+            ano (int): formato YYYY
+            arrow (bool, optional): retorna a tabela do pyarrow em vez do DataFrame. Padrão False.
+
+        Lê o resumo diário e recorre à tabela de transações, somada ao Parquet do mês se ele
+        foi arquivado e removido, se o resumo do mês estiver vazio
+
+        Raises:
+            Transacao.exc.ConsultaInvalida: não há transações no mês informado
+
+        Returns:
+            pd.DataFrame: DataFrame com data_movimento, contagem_transacoes, primeira_transacao e ultima_transacao
+        """
+        inicio, fim = Transacao._limites_mes(mes, ano)
+        r = consulta_para_arrow(
+            session, ResumoDiario._consulta_mensal(inicio.date(), (fim - timedelta(days=1)).date()), Transacao.ESQUEMA_MENSAL
+            )
+        if r.num_rows == 0:
+            r = consulta_para_arrow(session, Transacao._consulta_mensal(mes, ano), Transacao.ESQUEMA_MENSAL)
+            r = Transacao._somar_mensal_arquivado(session, r, inicio, fim - timedelta(microseconds=1))
+
+        if r.num_rows:
+            return r if arrow else r.to_pandas()
         else:
             raise Transacao.exc.ConsultaInvalida("Período inválido")
-    
+
+    @staticmethod
+    def _somar_mensal_arquivado(session:sqlalchemy.orm.session.Session, tabela_mensal:pa.Table,
+                                data_inicial:datetime, data_final:datetime) -> pa.Table:
+        """Junta à tabela mensal da tabela transacao os dias guardados nos meses arquivados e removidos
+        """
+        arquivo = MesArquivado.ler_transacoes(session, data_inicial, data_final, ["data_transacao"])
+        if arquivo is None or arquivo.num_rows == 0:
+            return tabela_mensal
+        datas = arquivo.column("data_transacao").to_pandas()
+        por_dia = datas.groupby(datas.dt.normalize()).agg(["count", "min", "max"])
+        arquivados = pd.DataFrame({
+            "data_movimento": por_dia.index.strftime("%d/%m/%Y"),
+            "contagem_transacoes": por_dia["count"].to_numpy(),
+            "primeira_transacao": por_dia["min"].dt.strftime("%H:%M").to_numpy(),
+            "ultima_transacao": por_dia["max"].dt.strftime("%H:%M").to_numpy(),
+            })
+        df = pd.concat([tabela_mensal.to_pandas(), arquivados]).groupby("data_movimento", as_index=False).agg({
+            "contagem_transacoes": "sum", "primeira_transacao": "min", "ultima_transacao": "max"
+            })
+        df = df.iloc[pd.to_datetime(df["data_movimento"], format="%d/%m/%Y").argsort()]
+        return pa.Table.from_pandas(df, schema=Transacao.ESQUEMA_MENSAL, preserve_index=False)
+
+    ESQUEMA_MAPA_CALOR = pa.schema([("dia_semana", pa.int64()), ("hora", pa.int64()), ("contagem", pa.int64())])
+    ESQUEMA_VAZAO_PDV = pa.schema([("pdv", pa.int64()), ("hora", pa.int64()), ("contagem", pa.int64())])
+
+    @staticmethod
+    @cronometrar_consulta
+    def mapa_calor_semana_hora(session:sqlalchemy.orm.session.Session, data_inicial:datetime, data_final:datetime, arrow:bool=False):
+        """Quantidade de transações por dia da semana e hora do dia, agregada no banco
+
+        Args:
+            session (sqlalchemy.orm.session.Session): Sessão para acesso ao banco
+            data_inicial (datetime): Data de início
+            data_final (datetime): Data de fim
+            arrow (bool, optional): retorna a tabela do pyarrow em vez do DataFrame. Padrão False.
+
+        Lê o resumo horário quando o período cobre dias inteiros e recorre à tabela de transações
+        para períodos parciais ou dias ainda sem resumo
+
+        Raises:
+            Transacao.exc.ConsultaInvalida: não há transações no período
+
+        Returns:
+            pd.DataFrame: DataFrame com dia_semana (0 para domingo), hora e contagem
+        """
+        dias = Transacao._dias_inteiros(data_inicial, data_final)
+        r = Transacao.ESQUEMA_MAPA_CALOR.empty_table()
+        if dias is not None:
+            r = consulta_para_arrow(session, ResumoHorario._consulta_mapa_calor(*dias), Transacao.ESQUEMA_MAPA_CALOR)
+        if r.num_rows == 0:
+            tabela_transacao = Transacao.__table__
+            dia_semana = dia_da_semana(tabela_transacao.c.data_transacao)
+            hora = hora_do_dia(tabela_transacao.c.data_transacao)
+            consulta = select(dia_semana, hora, func.count()).where(
+                between(tabela_transacao.c.data_transacao, data_inicial, data_final)
+                ).group_by(dia_semana, hora).order_by(dia_semana, hora)
+            r = consulta_para_arrow(session, consulta, Transacao.ESQUEMA_MAPA_CALOR)
+        if r.num_rows:
+            return r if arrow else r.to_pandas()
+        else:
+            raise Transacao.exc.ConsultaInvalida("Período sem transações")
+
+    @staticmethod
+    @cronometrar_consulta
+    def vazao_por_pdv(session:sqlalchemy.orm.session.Session, data_inicial:datetime, data_final:datetime, arrow:bool=False):
+        """Quantidade de transações por PDV e hora do dia, agregada no banco
+
+        Args:
+            session (sqlalchemy.orm.session.Session): Sessão para acesso ao banco
+            data_inicial (datetime): Data de início
+            data_final (datetime): Data de fim
+            arrow (bool, optional): retorna a tabela do pyarrow em vez do DataFrame. Padrão False.
+
+        Lê o resumo horário quando o período cobre dias inteiros e recorre à tabela de transações
+        para períodos parciais ou dias ainda sem resumo
+
+        Raises:
+            Transacao.exc.ConsultaInvalida: não há transações no período
+
+        Returns:
+            pd.DataFrame: DataFrame com pdv, hora e contagem
+        """
+        dias = Transacao._dias_inteiros(data_inicial, data_final)
+        r = Transacao.ESQUEMA_VAZAO_PDV.empty_table()
+        if dias is not None:
+            r = consulta_para_arrow(session, ResumoHorario._consulta_vazao_pdv(*dias), Transacao.ESQUEMA_VAZAO_PDV)
+        if r.num_rows == 0:
+            tabela_transacao = Transacao.__table__
+            hora = hora_do_dia(tabela_transacao.c.data_transacao)
+            consulta = select(tabela_transacao.c.pdv, hora, func.count()).where(
+                between(tabela_transacao.c.data_transacao, data_inicial, data_final)
+                ).group_by(tabela_transacao.c.pdv, hora).order_by(tabela_transacao.c.pdv, hora)
+            r = consulta_para_arrow(session, consulta, Transacao.ESQUEMA_VAZAO_PDV)
+        if r.num_rows:
+            return r if arrow else r.to_pandas()
+        else:
+            raise Transacao.exc.ConsultaInvalida("Período sem transações")
+
     @staticmethod
+    @cronometrar_consulta
     def existe(session:sqlalchemy.orm.session.Session, nsu:int) -> bool:
         """Verifica se transação existe no banco baseado no código identificador
 
@@ -269,41 +1056,843 @@ class Transacao(Base):
             return False
     
     @staticmethod
-    def gravar_banco(df:pd.DataFrame, session:sqlalchemy.orm.session.Session):
-        """Grava os dados de operadores do dataframe no banco identificado pelo Session
+    def pdv_numerico(pdv:pd.Series) -> pd.Series:
+        """Converte a identificação do PDV para inteiro, "P012" e "012" viram 12
+
+        Args:
+            pdv (pd.Series): coluna Pdv do relatório
+
+        Returns:
+            pd.Series: PDVs como inteiros
+        """
+        if pd.api.types.is_integer_dtype(pdv):
+            return pdv.astype("int64")
+        return pdv.astype(str).str.extract(r"(\d+)", expand=False).fillna("0").astype("int64")
+
+    @staticmethod
+    def _insert_ignorando_duplicadas(session:sqlalchemy.orm.session.Session):
+        """Monta o INSERT adequado ao dialeto do banco para descartar NSUs já gravados
+        MySQL/MariaDB usam ON DUPLICATE KEY, SQLite e PostgreSQL usam ON CONFLICT DO NOTHING
+
+        Args:
+            session (sqlalchemy.orm.session.Session): Session do SQLAlchemy
+
+        Returns:
+            sqlalchemy.sql.Insert: comando de inserção na tabela transacao
+        """
+        tabela_transacao = Transacao.__table__
+        dialeto = session.get_bind().dialect.name
+        if dialeto in ("mysql", "mariadb"):
+            comando = mysql.insert(tabela_transacao)
+            return comando.on_duplicate_key_update(nsu=comando.inserted.nsu)
+        if dialeto == "sqlite":
+            return sqlite.insert(tabela_transacao).on_conflict_do_nothing(index_elements=["nsu"])
+        if dialeto == "postgresql":
+            return postgresql.insert(tabela_transacao).on_conflict_do_nothing(index_elements=["nsu"])
+        return sqlalchemy.insert(tabela_transacao)
+
+    @staticmethod
+    def gravar_banco(df:pd.DataFrame, session:sqlalchemy.orm.session.Session, marcas:dict=None, confirmar:bool=True) -> dict:
+        """Grava os dados de transações do dataframe no banco identificado pelo Session
+        Os NSUs já gravados são consultados em lotes pelo índice único e os operadores no diretório,
+        as transações novas são inseridas em lotes e só as inseridas são somadas ao resumo diário
+
+        Args:
+            df (pandas.DataFrame): DataFrame com dados de transações
+            session (sqlalchemy.orm.session.Session): Session do SQLAlchemy
+            marcas (dict, optional): última data_transacao já ingerida por PDV, como em MarcaIngestao.carregar.
+                Transações anteriores à marca do seu PDV são descartadas sem consultar o banco. Padrão None, sem marca.
+            confirmar (bool, optional): confirma a transação do banco ao final.
+                False permite gravar vários blocos de um arquivo numa única transação. Padrão True.
+
+        Raises:
+            Transacao.exc.OperadorAusente: há transações de operadores não cadastrados,
+                o segundo argumento é a lista com todos os códigos ausentes
+
+        Returns:
+            dict: transações gravadas ("inseridas"), descartadas pela marca ou por cair num mês arquivado e removido ("ignoradas_marca")
+                e descartadas por NSU já gravado ou repetido no próprio relatório ("ignoradas_conflito")
+        """
+        resumo = {"inseridas": 0, "ignoradas_marca": 0, "ignoradas_conflito": 0}
+        if df.empty:
+            return resumo
+        with medir("gravacao.diff", linhas=len(df)):
+            novas = pd.DataFrame({
+                "nsu": df['Nsu'].astype("int64"),
+                "codigo_operador": df['Operador'].astype(int),
+                "pdv": Transacao.pdv_numerico(df['Pdv']),
+                "tipo_transacao": df['Transacao'],
+                "estado_transacao": df['Estado Transacao'],
+                "data_transacao": pd.to_datetime(df['Datetime']),
+                })
+            if marcas:
+                # NaT para PDVs sem marca, a comparação dá False e a linha segue para a verificação do NSU
+                cobertas = novas["data_transacao"] < pd.to_datetime(novas["pdv"].map(marcas))
+                resumo["ignoradas_marca"] = int(cobertas.sum())
+                novas = novas[~cobertas]
+            removidos = MesArquivado.meses_removidos(session)
+            if removidos:
+                # meses arquivados e apagados da tabela transacao não recebem transações
+                datas = novas["data_transacao"]
+                arquivadas = (datas.dt.year * 100 + datas.dt.month).isin(removidos)
+                resumo["ignoradas_marca"] += int(arquivadas.sum())
+                novas = novas[~arquivadas]
+            total = len(novas)
+            novas = novas.drop_duplicates("nsu")
+            if not novas.empty:
+                # pelo índice único do NSU, em lotes; NSUs gravados com outra data também são encontrados
+                tabela_transacao = Transacao.__table__
+                nsus = novas["nsu"].tolist()
+                nsus_gravados = set()
+                for inicio in range(0, len(nsus), TAMANHO_LOTE):
+                    nsus_gravados.update(session.execute(
+                        select(tabela_transacao.c.nsu).where(tabela_transacao.c.nsu.in_(nsus[inicio:inicio + TAMANHO_LOTE]))
+                        ).scalars())
+                novas = novas[~novas["nsu"].isin(nsus_gravados)]
+            resumo["ignoradas_conflito"] = total - len(novas)
+            if not novas.empty:
+                Transacao.verificar_operadores(session, novas["codigo_operador"].unique())
+        if novas.empty:
+            logger.info("Nenhuma transação nova: %s", resumo)
+            return resumo
+
+        with medir("gravacao.insert", linhas=len(novas)):
+            registros = [
+                {
+                    "nsu": int(nsu),
+                    "codigo_operador": int(codigo_operador),
+                    "pdv": int(pdv),
+                    "tipo_transacao": tipo_transacao,
+                    "estado_transacao": estado_transacao,
+                    "data_transacao": data_transacao.to_pydatetime()
+                }
+                for nsu, codigo_operador, pdv, tipo_transacao, estado_transacao, data_transacao in novas.itertuples(index=False)
+                ]
+            comando = Transacao._insert_ignorando_duplicadas(session)
+            # com RETURNING (SQLite e PostgreSQL) só voltam os NSUs realmente inseridos, e os gravados
+            # por outro processo depois da consulta acima ficam fora do resumo e da contagem
+            retorna_nsu = session.get_bind().dialect.insert_executemany_returning
+            if retorna_nsu:
+                comando = comando.returning(Transacao.__table__.c.nsu)
+            inseridos = set()
+            for inicio in range(0, len(registros), TAMANHO_LOTE):
+                resultado = session.execute(comando, registros[inicio:inicio + TAMANHO_LOTE])
+                if retorna_nsu:
+                    inseridos.update(resultado.scalars())
+            if retorna_nsu and len(inseridos) < len(novas):
+                resumo["ignoradas_conflito"] += len(novas) - len(inseridos)
+                novas = novas[novas["nsu"].isin(inseridos)]
+        with medir("gravacao.resumo", linhas=len(novas)):
+            ResumoDiario.acumular(novas, session)
+            ResumoHorario.acumular(novas, session)
+        if confirmar:
+            with medir("gravacao.commit", linhas=len(novas)):
+                session.commit()
+        resumo["inseridas"] = len(novas)
+        logger.info("Transações gravadas em lotes de %s: %s", TAMANHO_LOTE, resumo)
+        return resumo
+
+class ResumoDiario(Base):
+    """Resumo pré-agregado das transações por dia, operador e PDV
+    Mantido a cada gravação de transações, responde ao ranking e à tabela mensal
+    sem percorrer a tabela transacao
+    """
+    __tablename__ = 'resumo_diario'
+    data:Mapped[date] = mapped_column(Date, primary_key=True)
+    codigo_operador:Mapped[int] = mapped_column(ForeignKey("operador.codigo_operador"), primary_key=True)
+    pdv:Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    quantidade:Mapped[int] = mapped_column(Integer, nullable=False)
+    primeira_transacao = mapped_column(DateTime, nullable=False)
+    ultima_transacao = mapped_column(DateTime, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"Data: {self.data}, Operador: {self.codigo_operador}, PDV: {self.pdv}, Quantidade: {self.quantidade}"
+
+    @staticmethod
+    def acumular(novas:pd.DataFrame, session:sqlalchemy.orm.session.Session):
+        """Soma transações recém gravadas ao resumo, sem confirmar a transação do banco
 
         Args:
-            df (pandas.DataFrame): DataFrame com dados de operador
+            novas (pd.DataFrame): transações novas com data_transacao, codigo_operador e pdv
             session (sqlalchemy.orm.session.Session): Session do SQLAlchemy
         """
-        for ind in df.index:
-            pdv = df['Pdv'][ind]
-            data_transacao = df['Datetime'][ind]
-            nsu = f"{data_transacao}-{pdv}"
-            codigo_operador = int(df['Operador'][ind])
-            tipo_transacao = df['Transacao'][ind]
-            estado_transacao = df['Estado Transacao'][ind]
-            
-
-            if Transacao.existe(session, nsu):
-                logger.info("Transacao %s já existe no banco", data_transacao)
+        if novas.empty:
+            return
+        tabela_resumo = ResumoDiario.__table__
+        agregado = novas.assign(data=novas["data_transacao"].dt.date).groupby(
+            ["data", "codigo_operador", "pdv"]
+            )["data_transacao"].agg(["count", "min", "max"])
+
+        existentes = {
+            (data_resumo, codigo_operador, pdv): (quantidade, primeira, ultima)
+            for data_resumo, codigo_operador, pdv, quantidade, primeira, ultima in session.execute(
+                select(
+                    tabela_resumo.c.data, tabela_resumo.c.codigo_operador, tabela_resumo.c.pdv,
+                    tabela_resumo.c.quantidade, tabela_resumo.c.primeira_transacao, tabela_resumo.c.ultima_transacao
+                    ).where(between(tabela_resumo.c.data, min(agregado.index.get_level_values("data")),
+                                    max(agregado.index.get_level_values("data"))))
+                )
+            }
+
+        inserir = []
+        atualizar = []
+        for (data_resumo, codigo_operador, pdv), (quantidade, primeira, ultima) in agregado.iterrows():
+            pdv = int(pdv)
+            chave = (data_resumo, int(codigo_operador), pdv)
+            primeira = primeira.to_pydatetime()
+            ultima = ultima.to_pydatetime()
+            if chave in existentes:
+                quantidade_atual, primeira_atual, ultima_atual = existentes[chave]
+                atualizar.append({
+                    "b_data": data_resumo, "b_codigo": chave[1], "b_pdv": pdv,
+                    "b_quantidade": quantidade_atual + int(quantidade),
+                    "b_primeira": min(primeira_atual, primeira),
+                    "b_ultima": max(ultima_atual, ultima)
+                })
             else:
-                if Operador.existe(session, int(codigo_operador)):
-                    model_transacao = Transacao(
-                    nsu=nsu,
-                    codigo_operador=int(codigo_operador),
-                    pdv=pdv,
-                    tipo_transacao=tipo_transacao,
-                    estado_transacao=estado_transacao,
-                    data_transacao=data_transacao
-                    )   
-                
-                    session.add(model_transacao)
-                    logger.info("gravando transacao da data %s no banco", data_transacao)
-                    del model_transacao
-                else:
-                    raise Transacao.exc.OperadorAusente("Operador ausente, atualize a tabela de operadores e tente novamente ", codigo_operador)   
+                inserir.append({
+                    "data": data_resumo, "codigo_operador": chave[1], "pdv": pdv,
+                    "quantidade": int(quantidade), "primeira_transacao": primeira, "ultima_transacao": ultima
+                })
+
+        for inicio in range(0, len(inserir), TAMANHO_LOTE):
+            session.execute(sqlalchemy.insert(tabela_resumo), inserir[inicio:inicio + TAMANHO_LOTE])
+        if atualizar:
+            comando = sqlalchemy.update(tabela_resumo).where(
+                tabela_resumo.c.data == sqlalchemy.bindparam("b_data"),
+                tabela_resumo.c.codigo_operador == sqlalchemy.bindparam("b_codigo"),
+                tabela_resumo.c.pdv == sqlalchemy.bindparam("b_pdv")
+                ).values(
+                    quantidade=sqlalchemy.bindparam("b_quantidade"),
+                    primeira_transacao=sqlalchemy.bindparam("b_primeira"),
+                    ultima_transacao=sqlalchemy.bindparam("b_ultima")
+                    )
+            for inicio in range(0, len(atualizar), TAMANHO_LOTE):
+                session.execute(comando, atualizar[inicio:inicio + TAMANHO_LOTE])
+        logger.info("Resumo diário: %s linhas inseridas, %s atualizadas", len(inserir), len(atualizar))
+
+    @staticmethod
+    def reconstruir(session:sqlalchemy.orm.session.Session, data_inicial:Optional[date]=None, data_final:Optional[date]=None) -> int:
+        """Recalcula o resumo diário e o horário a partir da tabela transacao, usado para carga retroativa
+
+        Args:
+            session (sqlalchemy.orm.session.Session): Session do SQLAlchemy
+            data_inicial (Optional[date], optional): primeiro dia, None para desde o início
+            data_final (Optional[date], optional): último dia, None para até o fim
+
+        Returns:
+            int: quantidade de linhas do resumo no período após a reconstrução
+        """
+        tabela_resumo = ResumoDiario.__table__
+        tabela_transacao = Transacao.__table__
+        filtro_resumo, preservar, filtro_transacao = ResumoDiario._filtros_reconstrucao(
+            session, tabela_resumo.c.data, data_inicial, data_final
+            )
+        session.execute(sqlalchemy.delete(tabela_resumo).where(*filtro_resumo, *preservar))
+        dia = data_do_dia(tabela_transacao.c.data_transacao)
+        agregacao = select(
+            dia, tabela_transacao.c.codigo_operador, tabela_transacao.c.pdv, func.count(),
+            func.min(tabela_transacao.c.data_transacao), func.max(tabela_transacao.c.data_transacao)
+            ).where(*filtro_transacao).group_by(dia, tabela_transacao.c.codigo_operador, tabela_transacao.c.pdv)
+        session.execute(sqlalchemy.insert(tabela_resumo).from_select(
+            ["data", "codigo_operador", "pdv", "quantidade", "primeira_transacao", "ultima_transacao"], agregacao
+            ))
+        ResumoHorario.reconstruir(session, data_inicial, data_final, confirmar=False)
         session.commit()
+        total = session.execute(select(func.count()).select_from(tabela_resumo).where(*filtro_resumo)).scalar_one()
+        logger.info("Resumo diário reconstruído com %s linhas", total)
+        return total
+
+    @staticmethod
+    def _filtros_reconstrucao(session:sqlalchemy.orm.session.Session, coluna_data:sqlalchemy.Column,
+                              data_inicial:Optional[date], data_final:Optional[date]) -> tuple:
+        """Filtros da reconstrução de um resumo entre dois dias, inclusos
+
+        Returns:
+            tuple: filtros do período na coluna de data do resumo, filtros que preservam as linhas
+                dos meses removidos da tabela transacao e filtros do período na tabela transacao
+        """
+        tabela_transacao = Transacao.__table__
+        filtro_resumo = []
+        filtro_transacao = []
+        if data_inicial is not None:
+            filtro_resumo.append(coluna_data >= data_inicial)
+            filtro_transacao.append(tabela_transacao.c.data_transacao >= datetime.combine(data_inicial, time(0, 0)))
+        if data_final is not None:
+            filtro_resumo.append(coluna_data <= data_final)
+            filtro_transacao.append(
+                tabela_transacao.c.data_transacao < datetime.combine(data_final + timedelta(days=1), time(0, 0))
+                )
+        # os meses removidos da tabela transacao só existem no arquivo Parquet, o resumo deles é mantido
+        preservar = []
+        for chave in MesArquivado.meses_removidos(session):
+            inicio, fim = Transacao._limites_mes(chave % 100, chave // 100)
+            preservar.append(sqlalchemy.not_(between(coluna_data, inicio.date(), (fim - timedelta(days=1)).date())))
+        return filtro_resumo, preservar, filtro_transacao
+
+    @staticmethod
+    def _consulta_ranking(dia_inicial:date, dia_final:date) -> sqlalchemy.sql.Select:
+        """Quantidade de transações por operador entre dois dias, inclusos
+        """
+        tabela_resumo = ResumoDiario.__table__
+        tabela_operador = Operador.__table__
+        return select(
+            tabela_resumo.c.codigo_operador, tabela_operador.c.nome,
+            # SUM devolve DECIMAL no MySQL/MariaDB, o cast mantém a coluna inteira
+            sqlalchemy.cast(func.sum(tabela_resumo.c.quantidade), Integer).label("contagem")
+            ).join(
+                tabela_operador
+                ).where(
+                    between(tabela_resumo.c.data, dia_inicial, dia_final)
+                    ).group_by(tabela_resumo.c.codigo_operador, tabela_operador.c.nome)
+
+    @staticmethod
+    def _consulta_mensal(dia_inicial:date, dia_final:date) -> sqlalchemy.sql.Select:
+        """Quantidade de transações, primeira e última transação de cada dia entre dois dias, inclusos
+        """
+        tabela_resumo = ResumoDiario.__table__
+        return select(
+            dia_formatado(tabela_resumo.c.data), sqlalchemy.cast(func.sum(tabela_resumo.c.quantidade), Integer),
+            hora_minuto(func.min(tabela_resumo.c.primeira_transacao)),
+            hora_minuto(func.max(tabela_resumo.c.ultima_transacao)),
+            ).where(
+                between(tabela_resumo.c.data, dia_inicial, dia_final)
+                ).group_by(tabela_resumo.c.data).order_by(tabela_resumo.c.data)
+
+class ResumoHorario(Base):
+    """Resumo pré-agregado das transações por dia, hora e PDV
+    Mantido a cada gravação de transações, responde ao mapa de calor e à vazão por PDV
+    sem percorrer a tabela transacao
+    """
+    __tablename__ = 'resumo_horario'
+    data:Mapped[date] = mapped_column(Date, primary_key=True)
+    hora:Mapped[int] = mapped_column(SmallInteger, primary_key=True, autoincrement=False)
+    pdv:Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    quantidade:Mapped[int] = mapped_column(Integer, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"Data: {self.data}, Hora: {self.hora}, PDV: {self.pdv}, Quantidade: {self.quantidade}"
+
+    @staticmethod
+    def acumular(novas:pd.DataFrame, session:sqlalchemy.orm.session.Session):
+        """Soma transações recém gravadas ao resumo, sem confirmar a transação do banco
+
+        Args:
+            novas (pd.DataFrame): transações novas com data_transacao e pdv
+            session (sqlalchemy.orm.session.Session): Session do SQLAlchemy
+        """
+        if novas.empty:
+            return
+        tabela_resumo = ResumoHorario.__table__
+        agregado = novas.assign(
+            data=novas["data_transacao"].dt.date, hora=novas["data_transacao"].dt.hour
+            ).groupby(["data", "hora", "pdv"]).size()
+
+        existentes = {
+            (data_resumo, hora, pdv): quantidade
+            for data_resumo, hora, pdv, quantidade in session.execute(
+                select(
+                    tabela_resumo.c.data, tabela_resumo.c.hora, tabela_resumo.c.pdv, tabela_resumo.c.quantidade
+                    ).where(between(tabela_resumo.c.data, min(agregado.index.get_level_values("data")),
+                                    max(agregado.index.get_level_values("data"))))
+                )
+            }
+
+        inserir = []
+        atualizar = []
+        for (data_resumo, hora, pdv), quantidade in agregado.items():
+            chave = (data_resumo, int(hora), int(pdv))
+            if chave in existentes:
+                atualizar.append({
+                    "b_data": data_resumo, "b_hora": chave[1], "b_pdv": chave[2],
+                    "b_quantidade": existentes[chave] + int(quantidade)
+                })
+            else:
+                inserir.append({"data": data_resumo, "hora": chave[1], "pdv": chave[2], "quantidade": int(quantidade)})
+
+        for inicio in range(0, len(inserir), TAMANHO_LOTE):
+            session.execute(sqlalchemy.insert(tabela_resumo), inserir[inicio:inicio + TAMANHO_LOTE])
+        if atualizar:
+            comando = sqlalchemy.update(tabela_resumo).where(
+                tabela_resumo.c.data == sqlalchemy.bindparam("b_data"),
+                tabela_resumo.c.hora == sqlalchemy.bindparam("b_hora"),
+                tabela_resumo.c.pdv == sqlalchemy.bindparam("b_pdv")
+                ).values(quantidade=sqlalchemy.bindparam("b_quantidade"))
+            for inicio in range(0, len(atualizar), TAMANHO_LOTE):
+                session.execute(comando, atualizar[inicio:inicio + TAMANHO_LOTE])
+        logger.info("Resumo horário: %s linhas inseridas, %s atualizadas", len(inserir), len(atualizar))
+
+    @staticmethod
+    def reconstruir(session:sqlalchemy.orm.session.Session, data_inicial:Optional[date]=None, data_final:Optional[date]=None,
+                    confirmar:bool=True) -> int:
+        """Recalcula o resumo a partir da tabela transacao, chamado também por ResumoDiario.reconstruir
+
+        Args:
+            session (sqlalchemy.orm.session.Session): Session do SQLAlchemy
+            data_inicial (Optional[date], optional): primeiro dia, None para desde o início
+            data_final (Optional[date], optional): último dia, None para até o fim
+            confirmar (bool, optional): confirma a transação do banco ao final. Padrão True.
+
+        Returns:
+            int: quantidade de linhas do resumo no período após a reconstrução
+        """
+        tabela_resumo = ResumoHorario.__table__
+        tabela_transacao = Transacao.__table__
+        filtro_resumo, preservar, filtro_transacao = ResumoDiario._filtros_reconstrucao(
+            session, tabela_resumo.c.data, data_inicial, data_final
+            )
+        session.execute(sqlalchemy.delete(tabela_resumo).where(*filtro_resumo, *preservar))
+        dia = data_do_dia(tabela_transacao.c.data_transacao)
+        hora = hora_do_dia(tabela_transacao.c.data_transacao)
+        agregacao = select(dia, hora, tabela_transacao.c.pdv, func.count()).where(
+            *filtro_transacao
+            ).group_by(dia, hora, tabela_transacao.c.pdv)
+        session.execute(sqlalchemy.insert(tabela_resumo).from_select(["data", "hora", "pdv", "quantidade"], agregacao))
+        if confirmar:
+            session.commit()
+        total = session.execute(select(func.count()).select_from(tabela_resumo).where(*filtro_resumo)).scalar_one()
+        logger.info("Resumo horário reconstruído com %s linhas", total)
+        return total
+
+    @staticmethod
+    def _consulta_mapa_calor(dia_inicial:date, dia_final:date) -> sqlalchemy.sql.Select:
+        """Quantidade de transações por dia da semana e hora entre dois dias, inclusos
+        """
+        tabela_resumo = ResumoHorario.__table__
+        dia_semana = dia_da_semana(tabela_resumo.c.data)
+        return select(
+            dia_semana, tabela_resumo.c.hora,
+            # SUM devolve DECIMAL no MySQL/MariaDB, o cast mantém a coluna inteira
+            sqlalchemy.cast(func.sum(tabela_resumo.c.quantidade), Integer)
+            ).where(
+                between(tabela_resumo.c.data, dia_inicial, dia_final)
+                ).group_by(dia_semana, tabela_resumo.c.hora).order_by(dia_semana, tabela_resumo.c.hora)
+
+    @staticmethod
+    def _consulta_vazao_pdv(dia_inicial:date, dia_final:date) -> sqlalchemy.sql.Select:
+        """Quantidade de transações por PDV e hora entre dois dias, inclusos
+        """
+        tabela_resumo = ResumoHorario.__table__
+        return select(
+            tabela_resumo.c.pdv, tabela_resumo.c.hora, sqlalchemy.cast(func.sum(tabela_resumo.c.quantidade), Integer)
+            ).where(
+                between(tabela_resumo.c.data, dia_inicial, dia_final)
+                ).group_by(tabela_resumo.c.pdv, tabela_resumo.c.hora).order_by(tabela_resumo.c.pdv, tabela_resumo.c.hora)
+
+class VersaoDados(Base):
+    """Contador incrementado após cada gravação de operadores ou transações
+    Os caches do dashboard usam a versão como parte da chave, assim só expiram quando chegam dados novos
+    """
+    __tablename__ = 'versao_dados'
+    id:Mapped[int] = mapped_column(primary_key = True)
+    versao:Mapped[int] = mapped_column(Integer, nullable=False)
+    atualizado_em = mapped_column(DateTime, nullable=False)
+
+    @staticmethod
+    def atual(session:sqlalchemy.orm.session.Session) -> int:
+        """Versão atual dos dados, 0 se nada foi gravado ainda
+
+        Args:
+            session (sqlalchemy.orm.session.Session): Session do SQLAlchemy
+
+        Returns:
+            int: número da versão
+        """
+        versao = session.execute(select(VersaoDados.versao).where(VersaoDados.id == 1)).scalar()
+        return versao or 0
+
+    @staticmethod
+    def incrementar(session:sqlalchemy.orm.session.Session) -> int:
+        """Avança a versão dos dados e confirma no banco
+
+        Args:
+            session (sqlalchemy.orm.session.Session): Session do SQLAlchemy
+
+        Returns:
+            int: nova versão
+        """
+        tabela_versao = VersaoDados.__table__
+        agora = datetime.now()
+        resultado = session.execute(
+            sqlalchemy.update(tabela_versao).where(tabela_versao.c.id == 1).values(
+                versao=tabela_versao.c.versao + 1, atualizado_em=agora
+                )
+            )
+        if resultado.rowcount == 0:
+            session.execute(sqlalchemy.insert(tabela_versao).values(id=1, versao=1, atualizado_em=agora))
+        session.commit()
+        return VersaoDados.atual(session)
+
+class MarcaIngestao(Base):
+    """Marca d'água da ingestão: maior data_transacao já ingerida de cada PDV
+    Relatórios consecutivos do SITEF se sobrepõem por alguns dias, as transações anteriores
+    à marca do PDV são descartadas antes de qualquer consulta ao banco
+    """
+    __tablename__ = 'marca_ingestao'
+    pdv:Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    data_transacao = mapped_column(DateTime, nullable=False)
+    atualizado_em = mapped_column(DateTime, nullable=False)
+
+    @staticmethod
+    def carregar(session:sqlalchemy.orm.session.Session) -> dict:
+        """Marcas de todos os PDVs numa única consulta
+
+        Args:
+            session (sqlalchemy.orm.session.Session): Session do SQLAlchemy
+
+        Returns:
+            dict: data_transacao da marca por número do PDV
+        """
+        tabela_marca = MarcaIngestao.__table__
+        return dict(session.execute(select(tabela_marca.c.pdv, tabela_marca.c.data_transacao)).all())
+
+    @staticmethod
+    def avancar(session:sqlalchemy.orm.session.Session, maximas:dict) -> int:
+        """Avança as marcas dos PDVs, uma marca nunca recua. Não confirma a transação do banco
+
+        Args:
+            session (sqlalchemy.orm.session.Session): Session do SQLAlchemy
+            maximas (dict): maior data_transacao do relatório por número do PDV
+
+        Returns:
+            int: quantidade de marcas criadas ou avançadas
+        """
+        tabela_marca = MarcaIngestao.__table__
+        atuais = MarcaIngestao.carregar(session)
+        agora = datetime.now()
+        novas = []
+        avancadas = []
+        for pdv, data_transacao in maximas.items():
+            pdv = int(pdv)
+            data_transacao = pd.Timestamp(data_transacao).to_pydatetime()
+            if pdv not in atuais:
+                novas.append({"pdv": pdv, "data_transacao": data_transacao, "atualizado_em": agora})
+            elif data_transacao > atuais[pdv]:
+                avancadas.append({"b_pdv": pdv, "b_data_transacao": data_transacao, "b_atualizado_em": agora})
+        if novas:
+            session.execute(sqlalchemy.insert(tabela_marca), novas)
+        if avancadas:
+            session.execute(
+                sqlalchemy.update(tabela_marca).where(tabela_marca.c.pdv == sqlalchemy.bindparam("b_pdv")).values(
+                    data_transacao=sqlalchemy.bindparam("b_data_transacao"), atualizado_em=sqlalchemy.bindparam("b_atualizado_em")
+                    ),
+                avancadas
+                )
+        return len(novas) + len(avancadas)
+
+class ArquivoIngerido(Base):
+    """Relatórios já ingeridos, identificados pelo hash do conteúdo
+    Um arquivo idêntico enviado de novo é descartado sem ser lido
+    """
+    __tablename__ = 'arquivo_ingerido'
+    hash_arquivo:Mapped[str] = mapped_column(String(64), primary_key=True)
+    nome_arquivo:Mapped[Optional[str]] = mapped_column(String(255))
+    linhas:Mapped[int] = mapped_column(Integer, nullable=False)
+    ingerido_em = mapped_column(DateTime, nullable=False)
+
+    @staticmethod
+    def existe(session:sqlalchemy.orm.session.Session, hash_arquivo:str) -> bool:
+        """
+        Args:
+            session (sqlalchemy.orm.session.Session): Session do SQLAlchemy
+            hash_arquivo (str): sha256 do conteúdo em hexadecimal
+
+        Returns:
+            bool: o arquivo já foi ingerido por completo
+        """
+        return session.get(ArquivoIngerido, hash_arquivo) is not None
+
+    @staticmethod
+    def registrar(session:sqlalchemy.orm.session.Session, hash_arquivo:str, nome_arquivo:str, linhas:int):
+        """Registra o arquivo como ingerido. Não confirma a transação do banco
+
+        Args:
+            session (sqlalchemy.orm.session.Session): Session do SQLAlchemy
+            hash_arquivo (str): sha256 do conteúdo em hexadecimal
+            nome_arquivo (str): nome original do arquivo
+            linhas (int): transações novas gravadas a partir do arquivo; na ingestão conjunta
+                de vários arquivos, as transações pix lidas do arquivo
+        """
+        session.merge(ArquivoIngerido(
+            hash_arquivo=hash_arquivo, nome_arquivo=nome_arquivo, linhas=linhas, ingerido_em=datetime.now()
+            ))
+
+class MesArquivado(Base):
+    """Meses fechados da tabela transacao exportados para Parquet pelo arquivamento
+    Quando removido, as transações do mês só existem no arquivo: a gravação descarta
+    transações do mês e as consultas que leem a tabela transacao somam as do arquivo.
+    O resumo diário do mês é mantido
+    """
+    __tablename__ = 'mes_arquivado'
+    ano:Mapped[int] = mapped_column(SmallInteger, primary_key=True, autoincrement=False)
+    mes:Mapped[int] = mapped_column(SmallInteger, primary_key=True, autoincrement=False)
+    caminho:Mapped[str] = mapped_column(String(1024), nullable=False)
+    linhas:Mapped[int] = mapped_column(Integer, nullable=False)
+    removido:Mapped[bool] = mapped_column(Boolean, nullable=False)
+    arquivado_em = mapped_column(DateTime, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"Mês: {self.mes:02d}/{self.ano}, Linhas: {self.linhas}, Removido: {self.removido}"
+
+    @staticmethod
+    def registrar(session:sqlalchemy.orm.session.Session, ano:int, mes:int, caminho:str, linhas:int, removido:bool):
+        """Registra o arquivo Parquet do mês. Não confirma a transação do banco
+
+        Args:
+            session (sqlalchemy.orm.session.Session): Session do SQLAlchemy
+            ano (int): formato YYYY
+            mes (int): formato MM
+            caminho (str): caminho absoluto do arquivo Parquet
+            linhas (int): transações gravadas no arquivo
+            removido (bool): as transações do mês foram apagadas da tabela transacao
+        """
+        session.merge(MesArquivado(
+            ano=ano, mes=mes, caminho=caminho, linhas=linhas, removido=removido, arquivado_em=datetime.now()
+            ))
+
+    @staticmethod
+    def meses_removidos(session:sqlalchemy.orm.session.Session) -> set:
+        """
+        Args:
+            session (sqlalchemy.orm.session.Session): Session do SQLAlchemy
+
+        Returns:
+            set: chaves ano * 100 + mes dos meses apagados da tabela transacao
+        """
+        tabela = MesArquivado.__table__
+        return {
+            ano * 100 + mes for ano, mes in session.execute(
+                select(tabela.c.ano, tabela.c.mes).where(tabela.c.removido.is_(True))
+                )
+            }
+
+    @staticmethod
+    def ler_transacoes(session:sqlalchemy.orm.session.Session, data_inicial:datetime, data_final:datetime,
+                       colunas:list) -> Optional[pa.Table]:
+        """Lê do Parquet as transações do período que foram apagadas da tabela transacao
+        Só são abertos os arquivos dos meses que cruzam o período, e o filtro por data_transacao
+        descarta os grupos de linhas fora dele pelas estatísticas do arquivo
+
+        Args:
+            session (sqlalchemy.orm.session.Session): Session do SQLAlchemy
+            data_inicial (datetime): Data de início
+            data_final (datetime): Data de fim, inclusa
+            colunas (list): colunas do esquema do arquivo a ler
+
+        Returns:
+            Optional[pa.Table]: transações arquivadas do período, None se nenhum mês removido cruza o período
+        """
+        tabela = MesArquivado.__table__
+        chave = tabela.c.ano * 100 + tabela.c.mes
+        caminhos = session.execute(
+            select(tabela.c.caminho).where(
+                tabela.c.removido.is_(True),
+                between(chave, data_inicial.year * 100 + data_inicial.month, data_final.year * 100 + data_final.month)
+                ).order_by(tabela.c.ano, tabela.c.mes)
+            ).scalars().all()
+        if not caminhos:
+            return None
+        filtro = [("data_transacao", ">=", data_inicial), ("data_transacao", "<=", data_final)]
+        return pa.concat_tables([pq.read_table(caminho, columns=colunas, filters=filtro) for caminho in caminhos])
+
+class JobIngestao(Base):
+    """Arquivo enviado pelo dashboard aguardando ou já processado pelo worker de ingestão
+    O conteúdo fica gravado no diretório de spool, identificado pelo hash SHA-256
+    """
+    __tablename__ = 'job_ingestao'
+    __table_args__ = (
+        UniqueConstraint("tipo", "hash_arquivo"),
+        Index("ix_job_ingestao_estado", "estado"),
+    )
+    TIPOS = ("operadores", "transacoes")
+    PENDENTE = "pendente"
+    PROCESSANDO = "processando"
+    CONCLUIDO = "concluido"
+    ERRO = "erro"
+
+    id:Mapped[int] = mapped_column(primary_key = True)
+    tipo:Mapped[str] = mapped_column(String(15), nullable=False)
+    hash_arquivo:Mapped[str] = mapped_column(String(64), nullable=False)
+    nome_arquivo:Mapped[str] = mapped_column(String(255))
+    caminho:Mapped[str] = mapped_column(String(500), nullable=False)
+    estado:Mapped[str] = mapped_column(String(15), nullable=False)
+    linhas:Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    mensagem:Mapped[Optional[str]] = mapped_column(String(500), nullable=True)
+    criado_em = mapped_column(DateTime, nullable=False)
+    atualizado_em = mapped_column(DateTime, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"Job {self.id}: {self.tipo} {self.nome_arquivo} ({self.estado})"
+
+    @staticmethod
+    def enfileirar(session:sqlalchemy.orm.session.Session, tipo:str, nome_arquivo:str, conteudo:bytes, diretorio:str) -> tuple:
+        """Grava o arquivo no spool e cria o job, reaproveitando o job de um arquivo idêntico já enviado
+
+        Args:
+            session (sqlalchemy.orm.session.Session): Session do SQLAlchemy
+            tipo (str): "operadores" ou "transacoes"
+            nome_arquivo (str): nome original do arquivo enviado
+            conteudo (bytes): conteúdo do arquivo
+            diretorio (str): diretório de spool compartilhado com o worker
+
+        Returns:
+            tuple: o job e True se foi criado agora, False se o arquivo já tinha sido enviado
+        """
+        if tipo not in JobIngestao.TIPOS:
+            raise ValueError(f"Tipo de job inválido: {tipo}")
+        hash_arquivo = hashlib.sha256(conteudo).hexdigest()
+        consulta = select(JobIngestao).where(JobIngestao.tipo == tipo, JobIngestao.hash_arquivo == hash_arquivo)
+        job = session.execute(consulta).scalar()
+        if job is not None and job.estado != JobIngestao.ERRO:
+            logger.info("Arquivo %s já enviado no job %s", nome_arquivo, job.id)
+            return job, False
+
+        os.makedirs(diretorio, exist_ok=True)
+        caminho = os.path.join(diretorio, f"{tipo}-{hash_arquivo}.csv")
+        # o mesmo arquivo enviado por dois usuários ao mesmo tempo vai para o mesmo caminho,
+        # gravado num temporário e renomeado para o worker nunca ler um arquivo pela metade
+        temporario = f"{caminho}.{os.getpid()}.{id(conteudo)}.tmp"
+        with open(temporario, "wb") as arquivo:
+            arquivo.write(conteudo)
+        os.replace(temporario, caminho)
+        agora = datetime.now()
+        if job is None:
+            job = JobIngestao(tipo=tipo, hash_arquivo=hash_arquivo, criado_em=agora)
+            session.add(job)
+        # job que falhou volta para a fila ao reenviar o mesmo arquivo
+        job.nome_arquivo = nome_arquivo[:255]
+        job.caminho = caminho
+        job.estado = JobIngestao.PENDENTE
+        job.linhas = None
+        job.mensagem = None
+        job.atualizado_em = agora
+        try:
+            session.commit()
+        except sqlalchemy.exc.IntegrityError:
+            # outro envio do mesmo arquivo criou o job entre a consulta e a gravação
+            session.rollback()
+            job = session.execute(consulta).scalar_one()
+            logger.info("Arquivo %s enviado ao mesmo tempo no job %s", nome_arquivo, job.id)
+            return job, False
+        return job, True
+
+    @staticmethod
+    def reservar_proximo(session:sqlalchemy.orm.session.Session) -> Optional["JobIngestao"]:
+        """Marca o job pendente mais antigo como em processamento
+        A troca de estado é condicional, dois workers nunca reservam o mesmo job
+
+        Args:
+            session (sqlalchemy.orm.session.Session): Session do SQLAlchemy
+
+        Returns:
+            Optional[JobIngestao]: job reservado, None se a fila está vazia
+        """
+        tabela_job = JobIngestao.__table__
+        while True:
+            id_job = session.execute(
+                select(tabela_job.c.id).where(tabela_job.c.estado == JobIngestao.PENDENTE).order_by(tabela_job.c.id).limit(1)
+                ).scalar()
+            if id_job is None:
+                session.commit()
+                return None
+            reservado = session.execute(
+                sqlalchemy.update(tabela_job).where(
+                    tabela_job.c.id == id_job, tabela_job.c.estado == JobIngestao.PENDENTE
+                    ).values(estado=JobIngestao.PROCESSANDO, atualizado_em=datetime.now())
+                )
+            session.commit()
+            if reservado.rowcount == 1:
+                return session.get(JobIngestao, id_job)
+
+    @staticmethod
+    def reservar_lote(session:sqlalchemy.orm.session.Session, tipo:str, limite:int) -> List["JobIngestao"]:
+        """Reserva até limite jobs pendentes do tipo, dos mais antigos para os mais novos,
+        parando antes do job pendente mais antigo de outro tipo: relatórios enviados depois
+        de uma planilha de operadores esperam a planilha ser gravada.
+        Cada job é reservado com a mesma troca condicional de reservar_proximo
+
+        Args:
+            session (sqlalchemy.orm.session.Session): Session do SQLAlchemy
+            tipo (str): um dos TIPOS
+            limite (int): quantidade máxima de jobs
+
+        Returns:
+            List[JobIngestao]: jobs reservados, vazia se não há pendentes do tipo
+        """
+        tabela_job = JobIngestao.__table__
+        if limite <= 0:
+            return []
+        filtro = [tabela_job.c.estado == JobIngestao.PENDENTE, tabela_job.c.tipo == tipo]
+        barreira = session.execute(
+            select(func.min(tabela_job.c.id)).where(tabela_job.c.estado == JobIngestao.PENDENTE, tabela_job.c.tipo != tipo)
+            ).scalar()
+        if barreira is not None:
+            filtro.append(tabela_job.c.id < barreira)
+        candidatos = session.execute(
+            select(tabela_job.c.id).where(*filtro).order_by(tabela_job.c.id).limit(limite)
+            ).scalars().all()
+        reservados = []
+        for id_job in candidatos:
+            resultado = session.execute(
+                sqlalchemy.update(tabela_job).where(
+                    tabela_job.c.id == id_job, tabela_job.c.estado == JobIngestao.PENDENTE
+                    ).values(estado=JobIngestao.PROCESSANDO, atualizado_em=datetime.now())
+                )
+            if resultado.rowcount == 1:
+                reservados.append(id_job)
+        session.commit()
+        return [session.get(JobIngestao, id_job) for id_job in reservados]
+
+    @staticmethod
+    def retomar_interrompidos(session:sqlalchemy.orm.session.Session) -> int:
+        """Devolve para a fila os jobs que estavam em processamento quando o worker parou
+        Reprocessar é seguro, transações já gravadas são descartadas pelo NSU
+
+        Args:
+            session (sqlalchemy.orm.session.Session): Session do SQLAlchemy
+
+        Returns:
+            int: quantidade de jobs devolvidos para a fila
+        """
+        tabela_job = JobIngestao.__table__
+        r = session.execute(
+            sqlalchemy.update(tabela_job).where(tabela_job.c.estado == JobIngestao.PROCESSANDO).values(
+                estado=JobIngestao.PENDENTE, atualizado_em=datetime.now()
+                )
+            )
+        session.commit()
+        return r.rowcount
+
+    def registrar(self, session:sqlalchemy.orm.session.Session, estado:str, linhas:Optional[int]=None, mensagem:Optional[str]=None):
+        """Atualiza estado, linhas gravadas e mensagem do job e confirma no banco
+        """
+        self.estado = estado
+        if linhas is not None:
+            self.linhas = linhas
+        if mensagem is not None:
+            self.mensagem = mensagem[:500]
+        self.atualizado_em = datetime.now()
+        session.commit()
+
+    @staticmethod
+    def recentes(session:sqlalchemy.orm.session.Session, limite:int=10) -> pd.DataFrame:
+        """Últimos jobs enviados, do mais novo para o mais antigo
+
+        Args:
+            session (sqlalchemy.orm.session.Session): Session do SQLAlchemy
+            limite (int, optional): quantidade de jobs. Padrão 10.
+
+        Returns:
+            pd.DataFrame: DataFrame com arquivo, tipo, estado, linhas, mensagem e horário da última atualização
+        """
+        tabela_job = JobIngestao.__table__
+        r = session.execute(
+            select(
+                tabela_job.c.nome_arquivo, tabela_job.c.tipo, tabela_job.c.estado,
+                tabela_job.c.linhas, tabela_job.c.mensagem, tabela_job.c.atualizado_em
+                ).order_by(tabela_job.c.id.desc()).limit(limite)
+            ).all()
+        return pd.DataFrame(r, columns=["arquivo", "tipo", "estado", "linhas", "mensagem", "atualizado_em"])
 
 if __name__ == "__main__":
     pass
@@ -0,0 +1,273 @@
+"""Página do dashboard, importada por dashboard.py na primeira execução de cada processo
+
+O esquema do banco não é criado aqui, rode python main.py init-banco na instalação
+e a cada atualização (o dashboard_pix.service faz isso antes de iniciar)
+"""
+import os
+import json
+import time
+from datetime import datetime, timedelta
+import pandas as pd
+from sqlalchemy.orm import sessionmaker
+import streamlit as st
+from banco import criar_engine
+from models import Transacao, VersaoDados, JobIngestao
+from metricas import registro, medir
+
+
+# Resultados de consulta guardados entre execuções e sessões de navegador, o mais antigo sem uso sai primeiro
+TAMANHO_CACHE = int(os.getenv("DASHBOARD_CACHE_ENTRADAS", "64"))
+
+@st.cache_resource
+def obter_sessionmaker():
+    """Engine e pool de conexões criados uma vez por processo e compartilhados por todos os usuários
+    """
+    return sessionmaker(criar_engine(), autoflush=False)
+
+# Linhas do ranking transferidas e exibidas por vez
+OPERADORES_POR_PAGINA = int(os.getenv("DASHBOARD_RANKING_POR_PAGINA", "50"))
+
+DIAS_SEMANA = ("Dom", "Seg", "Ter", "Qua", "Qui", "Sex", "Sáb")
+
+# Arquivos enviados ficam no spool até o worker (python main.py worker) gravá-los no banco
+DIRETORIO_SPOOL = os.getenv("DASHBOARD_SPOOL", "spool")
+# Segundos entre as atualizações da página enquanto há importações pendentes, 0 desativa
+INTERVALO_JOBS = float(os.getenv("DASHBOARD_ATUALIZACAO_JOBS", "5"))
+
+def enfileirar_arquivo(tipo, arquivo):
+    # só o cabeçalho é conferido aqui, as linhas são validadas pelo worker antes de gravar;
+    # os parsers só são importados quando alguém envia um arquivo
+    from parsers import ParserPlanilhaOperadores, ParserRelatorioSITEF
+    parser = ParserPlanilhaOperadores if tipo == "operadores" else ParserRelatorioSITEF
+    try:
+        parser.detectar_formato(arquivo)
+    except parser.exc.ArquivoInvalido as e:
+        st.toast(f"{arquivo.name} recusado. {e.args[0]}")
+        return
+    with obter_sessionmaker()() as session:
+        job, novo = JobIngestao.enfileirar(session, tipo, arquivo.name, arquivo.getvalue(), DIRETORIO_SPOOL)
+        if novo:
+            st.toast(f"{arquivo.name} enviado para processamento")
+        else:
+            st.toast(f"{arquivo.name} já foi enviado, situação: {job.estado}")
+
+def enfileirar_arquivos(tipo, arquivos):
+    for arquivo in arquivos:
+        enfileirar_arquivo(tipo, arquivo)
+
+# Nas funções em cache o argumento _session fica fora da chave, versao só serve para
+# invalidar o cache quando o worker grava dados novos
+
+@st.cache_data(max_entries=TAMANHO_CACHE, show_spinner=False)
+def gerar_pagina_ranking(_session, data_inicial, data_final, apos, busca, versao):
+    # tabela do pyarrow já tipada, o st.dataframe exibe sem conversão; páginas vazias também ficam em cache
+    return Transacao.ranking_paginado(
+        _session, data_inicial, data_final, limite=OPERADORES_POR_PAGINA, apos=apos, busca=busca, arrow=True
+        )
+
+@st.cache_data(max_entries=TAMANHO_CACHE, show_spinner=False)
+def gerar_comparacao(_session, periodos, por, versao):
+    try:
+        return Transacao.comparar_periodos(_session, list(periodos), por)
+    except Transacao.exc.ConsultaInvalida:
+        return None
+
+def periodo_comparado(data_inicial, data_final, referencia):
+    """Período de comparação do período selecionado: o anterior de mesma duração ou o mesmo do ano anterior
+    """
+    if referencia == "Mesmo período do ano anterior":
+        # 29/02 vira 28/02
+        return tuple((pd.Timestamp(data) - pd.DateOffset(years=1)).to_pydatetime() for data in (data_inicial, data_final))
+    duracao = data_final - data_inicial + timedelta(seconds=1)
+    return data_inicial - duracao, data_final - duracao
+
+@st.cache_data(max_entries=TAMANHO_CACHE, show_spinner=False)
+def gerar_tabela_mensal(_session, mes, ano, versao):
+    try:
+        return Transacao.tabela_mensal_quantidade_transacoes(_session, mes, ano)
+    except Transacao.exc.ConsultaInvalida:
+        return None
+
+@st.cache_data(max_entries=TAMANHO_CACHE, show_spinner=False)
+def gerar_mapa_calor(_session, data_inicial, data_final, versao):
+    try:
+        df_mapa = Transacao.mapa_calor_semana_hora(_session, data_inicial, data_final)
+    except Transacao.exc.ConsultaInvalida:
+        return None
+    df_mapa["dia_semana"] = df_mapa["dia_semana"].map(dict(enumerate(DIAS_SEMANA)))
+    return df_mapa
+
+@st.cache_data(max_entries=TAMANHO_CACHE, show_spinner=False)
+def gerar_vazao_pdv(_session, data_inicial, data_final, versao):
+    try:
+        return Transacao.vazao_por_pdv(_session, data_inicial, data_final)
+    except Transacao.exc.ConsultaInvalida:
+        return None
+
+def grafico_mapa_calor(df, x, y, titulo_x, titulo_y, ordem_y=None):
+    # o altair só é importado quando há transações para desenhar
+    import altair as alt
+    return alt.Chart(df).mark_rect().encode(
+        x=alt.X(f"{x}:O", title=titulo_x),
+        y=alt.Y(f"{y}:O", title=titulo_y, sort=ordem_y),
+        color=alt.Color("contagem:Q", title="Transações"),
+        tooltip=[x, y, "contagem"]
+        )
+
+# JSON gravado pelo worker (python main.py worker --metricas), exibido junto das métricas do dashboard
+ARQUIVO_METRICAS = os.getenv("METRICAS_ARQUIVO")
+
+def exibir_metricas():
+    """Painel de depuração com os tempos por etapa deste processo e, se houver, os do worker
+    Consultas atendidas pelo cache não aparecem, só as que foram ao banco
+    """
+    st.title("Métricas de desempenho")
+    st.caption(f"Dashboard, desde {registro.iniciado_em:%d/%m/%Y %H:%M:%S}")
+    st.dataframe(registro.para_df(), hide_index=True, use_container_width=True)
+    st.download_button(
+        "Baixar métricas do dashboard (JSON)", registro.para_json(),
+        file_name="metricas_dashboard.json", mime="application/json"
+        )
+    if ARQUIVO_METRICAS and os.path.exists(ARQUIVO_METRICAS):
+        with open(ARQUIVO_METRICAS, encoding="utf-8") as arquivo:
+            metricas_worker = json.load(arquivo)
+        st.caption(f"Worker de ingestão, gerado em {metricas_worker['gerado_em']}")
+        st.dataframe(
+            pd.DataFrame.from_dict(metricas_worker["etapas"], orient="index").rename_axis("etapa").reset_index(),
+            hide_index=True, use_container_width=True
+            )
+
+def exibir_pagina(session):
+    hoje = datetime.now()
+    versao = VersaoDados.atual(session)
+    col1, col2, col3 = st.columns(3)
+
+    #data_inicio_str = "21/10/2023 00:00:00"
+    #data_inicio = datetime.strptime(data_inicio_str, "%d/%m/%Y %H:%M:%S")
+    #data_fim_str = "21/10/2023 23:59:59"
+    #data_fim = datetime.strptime(data_fim_str, "%d/%m/%Y %H:%M:%S")
+
+    with col1:
+       input_data_inicio = st.date_input("Data de início", value=hoje, format="DD/MM/YYYY")
+       data_inicio = datetime.strptime(f"{input_data_inicio} 00:00:00", "%Y-%m-%d %H:%M:%S")
+
+
+    with col2:
+
+        input_data_fim = st.date_input("Data de fim", value=hoje, format="DD/MM/YYYY")
+        data_fim = datetime.strptime(f"{input_data_fim} 23:59:59", "%Y-%m-%d %H:%M:%S")
+
+    lateral_upload_relatorios = st.sidebar
+    with lateral_upload_relatorios:
+        csv_operadores = st.file_uploader("Atualizar relação de operadores", type=["csv", "xlsx"])
+        if csv_operadores is not None:
+            st.button("Atualizar operadores", on_click=enfileirar_arquivo, args=("operadores", csv_operadores))
+
+        # vários relatórios enviados juntos são gravados em lote pelo worker
+        csvs_transacoes = st.file_uploader("Atualizar transações", type=["csv", "xlsx"], accept_multiple_files=True)
+        if csvs_transacoes:
+            st.button("Atualizar transações", on_click=enfileirar_arquivos, args=("transacoes", csvs_transacoes))
+
+        st.subheader("Importações recentes")
+        jobs = JobIngestao.recentes(session)
+        st.dataframe(jobs, hide_index=True, use_container_width=True)
+        em_andamento = INTERVALO_JOBS > 0 and jobs["estado"].isin((JobIngestao.PENDENTE, JobIngestao.PROCESSANDO)).any()
+        if em_andamento:
+            st.caption(f"Situação atualizada a cada {INTERVALO_JOBS:g} segundos até o fim das importações")
+        else:
+            # recarregar a página consulta novamente a situação dos jobs
+            st.button("Atualizar situação")
+        depuracao = st.checkbox("Exibir métricas de desempenho")
+
+
+    st.title('Ranking de transações do Pix por operador')
+
+    busca = st.text_input("Buscar operador por nome ou código").strip()
+    # cursores das páginas já vistas, a primeira página não tem cursor; mudar o filtro volta ao início
+    filtro_ranking = (data_inicio, data_fim, busca, versao)
+    if st.session_state.get("ranking_filtro") != filtro_ranking:
+        st.session_state["ranking_filtro"] = filtro_ranking
+        st.session_state["ranking_cursores"] = [None]
+    cursores = st.session_state["ranking_cursores"]
+    with medir("pagina.ranking"):
+        pagina, total = gerar_pagina_ranking(session, data_inicio, data_fim, cursores[-1], busca, versao)
+    if total:
+        primeira = (len(cursores) - 1) * OPERADORES_POR_PAGINA
+        st.dataframe(pagina, use_container_width=True, hide_index=True)
+        col_anterior, col_posicao, col_proxima = st.columns([1, 4, 1])
+        with col_posicao:
+            st.caption(f"Operadores {primeira + 1} a {primeira + pagina.num_rows} de {total}")
+        # a próxima página começa depois da última linha desta
+        ultima = pagina.slice(pagina.num_rows - 1).to_pylist()[0]
+        col_anterior.button("Anterior", on_click=cursores.pop, disabled=len(cursores) == 1)
+        col_proxima.button(
+            "Próxima", on_click=cursores.append, args=((ultima["contagem_pix"], ultima["codigo_operador"]),),
+            disabled=primeira + pagina.num_rows >= total
+            )
+    elif busca:
+        st.write(f"Nenhum operador encontrado para \"{busca}\" no período")
+    else:
+        st.write("Período sem transações para exibir, verifique a data ou alimente relatório deste período")
+    st.title('Comparação de períodos')
+    col_referencia, col_agrupamento = st.columns(2)
+    with col_referencia:
+        referencia = st.selectbox("Comparar com", ("Período anterior", "Mesmo período do ano anterior"))
+    with col_agrupamento:
+        por = st.radio("Agrupar por", ("operador", "dia"), horizontal=True)
+    periodos = ((data_inicio, data_fim), periodo_comparado(data_inicio, data_fim, referencia))
+    with medir("pagina.comparacao"):
+        df_comparacao = gerar_comparacao(session, periodos, por, versao)
+    st.caption(" × ".join(f"{inicio:%d/%m/%Y} a {fim:%d/%m/%Y}" for inicio, fim in periodos))
+    if df_comparacao is not None:
+        # 1 é o período selecionado, 2 o de comparação
+        st.dataframe(df_comparacao, use_container_width=True, hide_index=True, column_config={
+            "contagem_1": "Selecionado", "contagem_2": "Comparado",
+            "diferenca_2": "Diferença", "variacao_2": st.column_config.NumberColumn("Variação", format="%.1f%%"),
+            "data_1": "Data selecionada", "data_2": "Data comparada",
+            })
+    else:
+        st.write("Períodos sem transações para comparar")
+    st.title('Quantidade de transações por período')
+    mes = input_data_inicio.strftime("%m")
+    ano = input_data_inicio.strftime("%Y")
+    with medir("pagina.mensal"):
+        df_mensal = gerar_tabela_mensal(
+            session,
+            int(mes),
+            int(ano),
+            versao
+            )
+    if df_mensal is not None:
+        st.dataframe(df_mensal, use_container_width=True)
+        st.bar_chart(data=df_mensal, x="data_movimento", y="contagem_transacoes")
+    else:
+        st.write(f"Período do mês {mes}/{ano} sem transações para exibir")
+    st.title('Movimento por hora do dia')
+    with medir("pagina.mapa_calor"):
+        df_mapa = gerar_mapa_calor(session, data_inicio, data_fim, versao)
+    if df_mapa is not None:
+        st.altair_chart(
+            grafico_mapa_calor(df_mapa, "hora", "dia_semana", "Hora", "Dia da semana", list(DIAS_SEMANA)),
+            use_container_width=True
+            )
+        with medir("pagina.vazao_pdv"):
+            df_vazao = gerar_vazao_pdv(session, data_inicio, data_fim, versao)
+        st.altair_chart(grafico_mapa_calor(df_vazao, "hora", "pdv", "Hora", "PDV"), use_container_width=True)
+    else:
+        st.write("Período sem transações para exibir")
+    if depuracao:
+        exibir_metricas()
+    return em_andamento
+
+def executar():
+    """Uma execução da página, chamada por dashboard.py a cada execução do script
+    Com importações pendentes, a página é executada de novo depois de INTERVALO_JOBS segundos
+    """
+    # uma sessão curta por execução, devolvida ao pool ao final mesmo se a execução for interrompida
+    with obter_sessionmaker()() as session, medir("pagina.execucao"):
+        em_andamento = exibir_pagina(session)
+    if em_andamento:
+        # a página já está desenhada e a conexão devolvida; uma interação do usuário durante a espera
+        # é atendida pela próxima execução, que consulta a situação dos jobs e a versão dos dados
+        time.sleep(INTERVALO_JOBS)
+        st.rerun()
@@ -1,38 +1,391 @@
 import pandas as pd
+import numpy as np
 import io
-from datetime import datetime
+import os
+import csv
+import unicodedata
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.compute as pa_compute
+from metricas import medir
+
+# Início do arquivo usado para reconhecer o formato, a codificação e o separador
+TAMANHO_AMOSTRA = 1 << 20
+ASSINATURA_XLSX = b"PK\x03\x04"
+SEPARADORES = ";,\t|"
+# Linhas inválidas citadas na mensagem de erro, a lista completa vai no segundo argumento da exceção
+LINHAS_NA_MENSAGEM = 20
+
+
+def normalizar_coluna(nome) -> str:
+    """Nome de coluna sem acentos, em minúsculas e com espaços simples, para comparar com os apelidos
+    """
+    sem_acento = unicodedata.normalize("NFKD", str(nome)).encode("ascii", "ignore").decode()
+    return " ".join(sem_acento.lower().replace("_", " ").replace(".", " ").split())
+
+
+class FormatoArquivo():
+    """Formato reconhecido no início do arquivo
+
+    Attrs:
+        tipo (str): "csv" ou "xlsx"
+        encoding (str): codificação do CSV, None para texto já decodificado e para xlsx
+        separador (str): separador do CSV
+        colunas (dict): nome da coluna no arquivo para o nome usado pelo parser
+    """
+    def __init__(self, tipo:str, encoding:str=None, separador:str=None, colunas:dict=None) -> None:
+        self.tipo = tipo
+        self.encoding = encoding
+        self.separador = separador
+        self.colunas = colunas or {}
+
+    def __repr__(self) -> str:
+        return f"<FormatoArquivo {self.tipo} encoding={self.encoding} separador={self.separador!r}>"
+
+
+class _LeitorTabela():
+    """Reconhecimento de formato comum aos parsers: xlsx pela assinatura do arquivo,
+    codificação pela amostra (UTF-8 com ou sem BOM, senão cp1252), separador e colunas pelo cabeçalho
+    """
+    COLUNAS = []
+    # nome usado pelo parser: apelidos normalizados aceitos no cabeçalho
+    APELIDOS = {}
+
+    class exc():
+        class ArquivoInvalido(Exception):
+            """Exceção para arquivo fora do formato esperado. O segundo argumento lista as linhas inválidas,
+            contando o cabeçalho como linha 1, e fica vazio quando o problema está no cabeçalho
+            """
+            pass
+
+    @staticmethod
+    def _amostra(fonte):
+        """Início do arquivo sem alterar a posição de leitura, bytes ou str conforme a fonte
+        """
+        if isinstance(fonte, (str, os.PathLike)):
+            with open(fonte, "rb") as arquivo:
+                return arquivo.read(TAMANHO_AMOSTRA)
+        posicao = fonte.tell()
+        amostra = fonte.read(TAMANHO_AMOSTRA)
+        fonte.seek(posicao)
+        return amostra
+
+    @staticmethod
+    def _decodificar(amostra:bytes) -> tuple:
+        """Codificação e texto da amostra. Amostra só com ASCII fica como UTF-8,
+        e a leitura substitui os bytes inválidos que aparecerem depois dela
+        """
+        if len(amostra) == TAMANHO_AMOSTRA:
+            # a amostra pode terminar no meio de um caractere, decodifica até a última linha completa
+            amostra = amostra[:amostra.rfind(b"\n") + 1] or amostra
+        try:
+            return "utf-8-sig", amostra.decode("utf-8-sig")
+        except UnicodeDecodeError:
+            return "cp1252", amostra.decode("cp1252", errors="replace")
+
+    @classmethod
+    def _mapear_colunas(cls, cabecalho:list) -> dict:
+        """Nome no arquivo para nome do parser, vale a primeira coluna que corresponde a cada apelido
+        """
+        colunas = {}
+        for nome in cabecalho:
+            normalizado = normalizar_coluna(nome)
+            for coluna, apelidos in cls.APELIDOS.items():
+                if normalizado in apelidos and coluna not in colunas.values():
+                    colunas[nome] = coluna
+                    break
+        return colunas
+
+    @classmethod
+    def _colunas_ausentes(cls, colunas:dict) -> list:
+        return [coluna for coluna in cls.COLUNAS if coluna not in colunas.values()]
+
+    @classmethod
+    def detectar_formato(cls, fonte) -> FormatoArquivo:
+        """Reconhece formato, codificação, separador e colunas pelo início do arquivo
+
+        Args:
+            fonte: caminho, arquivo binário ou buffer de texto
+
+        Raises:
+            exc.ArquivoInvalido: o cabeçalho não tem todas as colunas esperadas
+
+        Returns:
+            FormatoArquivo: formato reconhecido
+        """
+        amostra = cls._amostra(fonte)
+        if isinstance(amostra, bytes) and amostra.startswith(ASSINATURA_XLSX):
+            cabecalho = [str(nome) for nome in pd.read_excel(fonte, nrows=0, engine="openpyxl").columns]
+            if not isinstance(fonte, (str, os.PathLike)):
+                fonte.seek(0)
+            formato = FormatoArquivo("xlsx", colunas=cls._mapear_colunas(cabecalho))
+        else:
+            if isinstance(amostra, bytes):
+                encoding, texto = cls._decodificar(amostra)
+            else:
+                encoding, texto = None, amostra
+            primeira = next((linha for linha in texto.splitlines() if linha.strip()), "")
+            # vale o primeiro separador que divide o cabeçalho nas colunas esperadas, testados do mais frequente
+            formato = None
+            for separador in sorted(SEPARADORES, key=primeira.count, reverse=True):
+                cabecalho = next(csv.reader([primeira], delimiter=separador))
+                tentativa = FormatoArquivo("csv", encoding, separador, cls._mapear_colunas(cabecalho))
+                if formato is None:
+                    formato = tentativa
+                if not cls._colunas_ausentes(tentativa.colunas):
+                    formato = tentativa
+                    break
+            cabecalho = next(csv.reader([primeira], delimiter=formato.separador))
+        ausentes = cls._colunas_ausentes(formato.colunas)
+        if ausentes:
+            raise cls.exc.ArquivoInvalido(
+                f"Colunas ausentes: {', '.join(ausentes)}. Cabeçalho encontrado: {', '.join(cabecalho)}", []
+                )
+        return formato
+
+    @staticmethod
+    def _opcoes_csv(formato:FormatoArquivo) -> dict:
+        """Argumentos do pd.read_csv para o formato: só as colunas usadas, todas como texto
+        """
+        opcoes = {
+            "sep": formato.separador,
+            "usecols": list(formato.colunas),
+            "dtype": {nome: str for nome in formato.colunas},
+        }
+        if formato.encoding:
+            opcoes["encoding"] = formato.encoding
+            opcoes["encoding_errors"] = "replace"
+        return opcoes
+
+    @staticmethod
+    def _ler_excel(fonte, formato:FormatoArquivo) -> pd.DataFrame:
+        df = pd.read_excel(fonte, engine="openpyxl", usecols=list(formato.colunas), dtype=str)
+        return df.rename(columns=formato.colunas)
+
+    @classmethod
+    def _rejeitar_linhas(cls, df:pd.DataFrame, invalidas:pd.Series, descricao:str):
+        """Levanta ArquivoInvalido citando as linhas do arquivo marcadas em invalidas
+
+        Args:
+            df (pd.DataFrame): registros com o índice na posição original do arquivo
+            invalidas (pd.Series): True nas linhas rejeitadas
+            descricao (str): campos verificados, para a mensagem
+
+        Raises:
+            exc.ArquivoInvalido: alguma linha está marcada
+        """
+        if not invalidas.any():
+            return
+        # o índice é a posição do registro, o cabeçalho é a linha 1
+        linhas = [int(indice) + 2 for indice in df.index[invalidas.to_numpy()]]
+        citadas = ", ".join(str(linha) for linha in linhas[:LINHAS_NA_MENSAGEM])
+        if len(linhas) > LINHAS_NA_MENSAGEM:
+            citadas += f" e mais {len(linhas) - LINHAS_NA_MENSAGEM}"
+        raise cls.exc.ArquivoInvalido(f"{len(linhas)} linhas com {descricao} inválidos, linhas {citadas}", linhas)
+
+
+class ParserRelatorioSITEF(_LeitorTabela):
+    """Lê o relatório de transações exportado pelo SITEF e mantém apenas as compras pix efetuadas.
+    Aceita CSV com os separadores usuais, em UTF-8 ou cp1252, e a planilha salva pelo Excel
+
+    Attrs:
+        df (pd.DataFrame): transações filtradas, com a coluna "Datetime" já convertida
+        formato (FormatoArquivo): formato reconhecido no arquivo
+    """
+    COLUNAS = ["Data", "Hora", "Pdv", "Transacao", "Operador", "Estado Transacao", "Nsu"]
+    # Tudo é lido como texto, a conversão é feita só nas linhas que sobram após o filtro
+    TIPOS_COLUNAS = {coluna: str for coluna in COLUNAS}
+    FORMATO_DATA = "%d/%m/%Y"
+    TAMANHO_BLOCO = 100_000
+    APELIDOS = {
+        "Data": {"data", "data transacao", "data da transacao", "dt transacao"},
+        "Hora": {"hora", "hora transacao", "hora da transacao", "hr transacao"},
+        "Pdv": {"pdv", "terminal", "caixa", "numero pdv", "num pdv"},
+        "Transacao": {"transacao", "tipo transacao", "tipo da transacao", "tipo de transacao"},
+        "Operador": {"operador", "codigo operador", "codigo do operador", "cod operador"},
+        "Estado Transacao": {"estado transacao", "estado da transacao", "estado", "status", "situacao"},
+        "Nsu": {"nsu", "nsu sitef", "nsu host", "numero nsu"},
+    }
 
-class ParserRelatorioSITEF():
     def __init__(self, csv_conteudo:io.StringIO) -> None:
-        self.df = pd.read_csv(csv_conteudo, sep=";")
-        self._filtrar_colunas()
-        self._converter_datetime()
-        self._filtrar_transacoes_efetuadas()
-        self.df["Operador"] = self.df["Operador"].astype(int)
-        
-    def _filtrar_colunas(self):
-        self.df = self.df[["Data", "Hora", "Pdv", "Transacao", "Operador", "Estado Transacao", "Nsu"]]
-        
-    def _converter_datetime(self):
-        """Gera a coluna "Datetime e converte para um objeto datetime mais versátil que string
-        """
-        
-        self.df['Datetime'] = self.df.apply(lambda x: f"{x['Data']} {x['Hora']}", axis=1)
-        self.df['Datetime'] = self.df.apply(lambda x: datetime.strptime(f"{x['Datetime']}", "%d/%m/%Y %H:%M:%S"), axis=1)
-    
-    def _filtrar_transacoes_efetuadas(self):
+        """
+        Args:
+            csv_conteudo (io.StringIO): caminho, arquivo binário ou buffer de texto do relatório
+
+        Raises:
+            ParserRelatorioSITEF.exc.ArquivoInvalido: faltam colunas, ou há compras pix efetuadas
+                com data, hora, PDV, operador ou NSU inválidos
+        """
+        self.formato = self.detectar_formato(csv_conteudo)
+        with medir("parse.leitura") as medicao:
+            df = self._ler(csv_conteudo, self.formato)
+            medicao["linhas"] = len(df)
+        self.df = self._processar(df)
+
+    @classmethod
+    def em_blocos(cls, csv_conteudo:io.StringIO, tamanho_bloco:int=None):
+        """Lê o relatório em blocos de tamanho fixo, só com as colunas usadas,
+        assim o consumo de memória depende do tamanho do bloco e não do arquivo.
+        A planilha xlsx é lida inteira e entregue nos mesmos blocos
+
+        Args:
+            csv_conteudo (io.StringIO): caminho, arquivo binário ou buffer de texto do relatório
+            tamanho_bloco (int, optional): linhas do CSV por bloco, padrão TAMANHO_BLOCO
+
+        Raises:
+            ParserRelatorioSITEF.exc.ArquivoInvalido: faltam colunas, antes do primeiro bloco,
+                ou o bloco tem linhas inválidas
+
+        Yields:
+            pd.DataFrame: transações filtradas e convertidas de cada bloco
+        """
+        tamanho_bloco = tamanho_bloco or cls.TAMANHO_BLOCO
+        formato = cls.detectar_formato(csv_conteudo)
+        if formato.tipo == "xlsx":
+            df = cls._ler_excel(csv_conteudo, formato)
+            for inicio in range(0, len(df), tamanho_bloco):
+                yield cls._processar(df.iloc[inicio:inicio + tamanho_bloco])
+            return
+        with pd.read_csv(csv_conteudo, chunksize=tamanho_bloco, **cls._opcoes_csv(formato)) as leitor:
+            blocos = iter(leitor)
+            while True:
+                # a leitura de cada bloco acontece no next, medida à parte do processamento
+                with medir("parse.leitura") as medicao:
+                    bloco = next(blocos, None)
+                    medicao["linhas"] = 0 if bloco is None else len(bloco)
+                if bloco is None:
+                    return
+                yield cls._processar(bloco.rename(columns=formato.colunas))
+
+    @classmethod
+    def _ler(cls, fonte, formato:FormatoArquivo) -> pd.DataFrame:
+        """Lê o arquivo inteiro com o leitor mais rápido para o formato. CSV em bytes vai para o pyarrow,
+        que descarta o que não é compra pix efetuada antes da conversão para o pandas. Buffer de texto,
+        e CSV que o pyarrow recusa, como linhas com colunas a mais, ficam com o pd.read_csv
+        """
+        if formato.tipo == "xlsx":
+            return cls._ler_excel(fonte, formato)
+        if formato.encoding is not None:
+            posicao = None if isinstance(fonte, (str, os.PathLike)) else fonte.tell()
+            try:
+                return cls._ler_pyarrow(fonte, formato)
+            except (pa.ArrowInvalid, UnicodeDecodeError):
+                if posicao is not None:
+                    fonte.seek(posicao)
+        return pd.read_csv(fonte, **cls._opcoes_csv(formato)).rename(columns=formato.colunas)
+
+    @classmethod
+    def _ler_pyarrow(cls, fonte, formato:FormatoArquivo) -> pd.DataFrame:
+        tabela = pa_csv.read_csv(
+            fonte,
+            read_options=pa_csv.ReadOptions(encoding="utf8" if formato.encoding == "utf-8-sig" else formato.encoding),
+            parse_options=pa_csv.ParseOptions(delimiter=formato.separador),
+            convert_options=pa_csv.ConvertOptions(
+                include_columns=list(formato.colunas),
+                column_types={nome: pa.string() for nome in formato.colunas},
+                ),
+            )
+        tabela = tabela.rename_columns([formato.colunas[nome] for nome in tabela.column_names])
+        efetuadas = pa_compute.fill_null(pa_compute.and_(
+            pa_compute.equal(tabela["Estado Transacao"], "Efetuada PDV"),
+            pa_compute.equal(tabela["Transacao"], "Compra Pix"),
+            ), False)
+        df = tabela.filter(efetuadas).to_pandas()
+        # índice na posição original do registro, como no pd.read_csv, para citar as linhas inválidas
+        df.index = np.flatnonzero(efetuadas.to_numpy(zero_copy_only=False))
+        return df
+
+    @classmethod
+    def _processar(cls, df:pd.DataFrame) -> pd.DataFrame:
+        """Filtra as compras pix efetuadas, valida e converte as colunas das linhas restantes
+        """
+        with medir("parse.filtro", linhas=len(df)):
+            df = cls._filtrar_transacoes_efetuadas(df)
+        with medir("parse.datetime", linhas=len(df)):
+            df = cls._converter_datetime_vetorizado(df)
+        operador = cls._converter_distintos(df["Operador"], lambda valores: pd.to_numeric(valores, errors="coerce"))
+        pdv_valido = cls._converter_distintos(df["Pdv"], lambda valores: valores.str.contains(r"\d"))
+        nsu = pd.to_numeric(df["Nsu"], errors="coerce")
+        invalidas = df["Datetime"].isna() | np.isnan(operador) | nsu.isna() | (pdv_valido != True)
+        cls._rejeitar_linhas(df, invalidas, "data, hora, PDV, operador ou NSU")
+        df["Operador"] = operador.astype(int)
+        df["Nsu"] = nsu.astype("int64")
+        return df
+
+    @staticmethod
+    def _converter_distintos(serie:pd.Series, converter) -> np.ndarray:
+        """Aplica converter só aos valores distintos da coluna e espalha o resultado pelas linhas,
+        o relatório repete poucas datas, horários, PDVs e operadores. Linhas vazias ficam nulas
+        """
+        codigos, distintos = pd.factorize(serie)
+        convertidos = np.asarray(converter(pd.Series(distintos, dtype=object).str.strip()))
+        return pd.api.extensions.take(convertidos, codigos, allow_fill=True)
+
+    @classmethod
+    def _converter_data(cls, datas:pd.Series) -> pd.Series:
+        """Datas no formato do SITEF, e à parte as outras, como as da planilha salva pelo Excel
+        """
+        data = pd.to_datetime(datas, format=cls.FORMATO_DATA, errors="coerce")
+        outras = data.isna() & datas.notna()
+        if outras.any():
+            data[outras] = pd.to_datetime(datas[outras], format="mixed", dayfirst=True, errors="coerce").dt.normalize()
+        return data
+
+    @staticmethod
+    def _converter_hora(horas:pd.Series) -> pd.Series:
+        # "08:30" vira "08:30:00"
+        horas = horas.where(horas.str.count(":") != 1, horas + ":00")
+        return pd.to_timedelta(horas, errors="coerce")
+
+    @classmethod
+    def _converter_datetime_vetorizado(cls, df:pd.DataFrame) -> pd.DataFrame:
+        """Gera a coluna "Datetime" sem percorrer as linhas, convertendo cada data e cada horário uma única vez.
+        O que não for reconhecido fica NaT
+        """
+        data = cls._converter_distintos(df["Data"], cls._converter_data)
+        hora = cls._converter_distintos(df["Hora"], cls._converter_hora)
+        return df.assign(Datetime=data + hora)
+
+    @staticmethod
+    def _filtrar_transacoes_efetuadas(df:pd.DataFrame) -> pd.DataFrame:
         """Descarta todas as transações que falharam ou que foram em outra forma de pagamento senão pix
         """
-        self.df = self.df[self.df["Estado Transacao"] == "Efetuada PDV"]
-        self.df = self.df[self.df["Transacao"] == "Compra Pix"]
+        return df[(df["Estado Transacao"] == "Efetuada PDV") & (df["Transacao"] == "Compra Pix")]
+
 
+class ParserPlanilhaOperadores(_LeitorTabela):
+    """Lê a planilha de operadores, em CSV com os separadores usuais, UTF-8 ou cp1252, ou xlsx
+
+    Attrs:
+        df (pd.DataFrame): colunas "Código" (inteiro), "Nome" e "Logname"
+        formato (FormatoArquivo): formato reconhecido no arquivo
+    """
+    COLUNAS = ["Código", "Nome", "Logname"]
+    APELIDOS = {
+        "Código": {"codigo", "cod", "codigo operador", "cod operador", "operador"},
+        "Nome": {"nome", "nome operador", "nome do operador"},
+        "Logname": {"logname", "log name", "login", "usuario"},
+    }
 
-class ParserPlanilhaOperadores():
     def __init__(self, planilha) -> None:
-        self.df = pd.read_csv(planilha, sep=";", usecols=['Código', 'Nome', 'Logname'], encoding = 'cp1252')
+        """
+        Args:
+            planilha: caminho, arquivo binário ou buffer de texto
+
+        Raises:
+            ParserPlanilhaOperadores.exc.ArquivoInvalido: faltam colunas ou há códigos não numéricos
+        """
+        self.formato = self.detectar_formato(planilha)
+        if self.formato.tipo == "xlsx":
+            df = self._ler_excel(planilha, self.formato)
+        else:
+            df = pd.read_csv(planilha, **self._opcoes_csv(self.formato)).rename(columns=self.formato.colunas)
+        codigo = pd.to_numeric(df["Código"], errors="coerce")
+        self._rejeitar_linhas(df, codigo.isna(), "código de operador")
+        df["Código"] = codigo.astype(int)
+        self.df = df[self.COLUNAS]
+
 
 
-    
 if __name__ == "__main__":
     pass
-    
\ No newline at end of file
@@ -0,0 +1,84 @@
+import unittest
+import logging
+import tempfile
+from datetime import datetime, date, timedelta
+import pandas as pd
+import pyarrow.parquet as pq
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from models import Base, Operador, Transacao, ResumoDiario, ResumoHorario, MesArquivado
+from arquivamento import arquivar, arquivar_mes, meses_fechados, caminho_particao
+
+logging.basicConfig(level=logging.ERROR)
+
+
+class TestArquivamento(unittest.TestCase):
+    """Exporta janeiro e fevereiro de 2023 para Parquet, remove janeiro do banco
+    e confere que ranking e tabela mensal continuam com as transações do mês removido
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.diretorio = tempfile.mkdtemp()
+        cls.engine = create_engine("sqlite://")
+        Base.metadata.create_all(cls.engine)
+        cls.session = sessionmaker(cls.engine, autoflush=False)()
+        Operador.gravar_banco(pd.DataFrame({"Código": [1, 2], "Nome": ["Maria", "Jose"], "Logname": ["maria1", "jose2"]}), cls.session)
+        # 10 transações em 31/01, 5 em 01/02 e 3 em 02/02, alternando operadores
+        datas = [datetime(2023, 1, 31, 8) + timedelta(minutes=i) for i in range(10)] \
+              + [datetime(2023, 2, 1, 9) + timedelta(minutes=i) for i in range(5)] \
+              + [datetime(2023, 2, 2, 10) + timedelta(minutes=i) for i in range(3)]
+        cls.df = pd.DataFrame({
+            "Nsu": range(1, len(datas) + 1), "Operador": [1 + i % 2 for i in range(len(datas))],
+            "Pdv": "P001", "Transacao": "Compra Pix", "Estado Transacao": "Efetuada PDV", "Datetime": datas,
+            })
+        Transacao.gravar_banco(cls.df, cls.session)
+
+    def test_a_exportar_sem_remover(self):
+        """Sem remoção, o arquivo é gravado e a tabela transacao continua com o mês
+        """
+        self.assertListEqual(meses_fechados(self.session, date(2023, 2, 1)), [(2023, 1), (2023, 2)])
+        self.assertDictEqual(arquivar(self.session, self.diretorio, date(2023, 2, 1)), {"01/2023": 10, "02/2023": 8})
+        arquivo = pq.read_table(caminho_particao(self.diretorio, 2023, 1))
+        self.assertEqual(arquivo.num_rows, 10)
+        self.assertListEqual(arquivo.column("tipo_transacao").unique().to_pylist(), ["Compra Pix"])
+        self.assertEqual(self.session.query(Transacao).count(), 18)
+        self.assertSetEqual(MesArquivado.meses_removidos(self.session), set())
+
+    def test_b_remover_e_consultar(self):
+        """Janeiro sai do banco e volta nas consultas pela leitura do Parquet
+        """
+        self.assertDictEqual(arquivar(self.session, self.diretorio, date(2023, 1, 1), remover=True), {"01/2023": 10})
+        self.assertEqual(self.session.query(Transacao).count(), 8)
+        self.assertSetEqual(MesArquivado.meses_removidos(self.session), {202301})
+
+        # período parcial, lido da tabela transacao e do arquivo
+        ranking = Transacao.ranking_range_data(self.session, datetime(2023, 1, 31, 8, 5), datetime(2023, 2, 1, 9, 2))
+        self.assertListEqual(ranking["contagem_pix"].tolist(), [4, 4])
+        self.assertListEqual(ranking["nome_operador"].tolist(), ["Maria", "Jose"])
+        # o resumo horário do mês removido continua respondendo por dias inteiros
+        mapa = Transacao.mapa_calor_semana_hora(self.session, datetime(2023, 1, 31), datetime(2023, 1, 31, 23, 59, 59))
+        self.assertListEqual(mapa.values.tolist(), [[2, 8, 10]])
+
+        # o resumo de janeiro sobrevive à reconstrução; sem ele, a tabela mensal vem só do arquivo
+        ResumoDiario.reconstruir(self.session)
+        self.assertEqual(self.session.query(ResumoHorario).filter(ResumoHorario.data == date(2023, 1, 31)).count(), 1)
+        mensal = Transacao.tabela_mensal_quantidade_transacoes(self.session, 1, 2023)
+        self.assertListEqual(mensal.values.tolist(), [["31/01/2023", 10, "08:00", "08:09"]])
+        self.session.query(ResumoDiario).delete()
+        mensal = Transacao.tabela_mensal_quantidade_transacoes(self.session, 1, 2023)
+        self.assertListEqual(mensal.values.tolist(), [["31/01/2023", 10, "08:00", "08:09"]])
+
+    def test_c_gravacao_ignora_mes_removido(self):
+        """Relatório reenviado com transações de janeiro não recria o mês na tabela transacao
+        """
+        resumo = Transacao.gravar_banco(self.df, self.session)
+        self.assertEqual(resumo["inseridas"], 0)
+        self.assertEqual(resumo["ignoradas_marca"], 10)
+        with self.assertRaises(ValueError):
+            arquivar_mes(self.session, 2023, 1, self.diretorio, remover=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.session.close()
+        Base.metadata.drop_all(bind=cls.engine)
+        cls.engine.dispose()
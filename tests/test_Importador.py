@@ -0,0 +1,74 @@
+import unittest
+import logging
+import os
+import tempfile
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from models import Base, Transacao, Operador
+from importador import Importador, identificar_tipo
+
+logging.basicConfig(level=logging.ERROR)
+
+OPERADORES = "Código;Nome;Logname\n1;Maria;maria1\n2;Jose;jose2\n"
+CABECALHO_SITEF = "Data;Hora;Pdv;Transacao;Operador;Estado Transacao;Nsu;Valor\n"
+SITEF_VALIDO = CABECALHO_SITEF + "02/10/2023;08:00:00;P001;Compra Pix;1;Efetuada PDV;9001;10,00\n" \
+                               + "02/10/2023;08:10:00;P002;Compra Pix;2;Efetuada PDV;9002;12,00\n"
+SITEF_OPERADOR_AUSENTE = CABECALHO_SITEF + "03/10/2023;09:00:00;P001;Compra Pix;77;Efetuada PDV;9003;10,00\n"
+
+
+class TestImportador(unittest.TestCase):
+    """Importação de um diretório com planilha de operadores, relatórios e um arquivo desconhecido
+    """
+    @classmethod
+    def setUpClass(cls):
+        # processos do pool não enxergam um SQLite em memória, o banco fica num arquivo temporário
+        cls.diretorio = tempfile.mkdtemp()
+        cls.url = f"sqlite:///{os.path.join(cls.diretorio, 'importador.db')}"
+        cls.engine = create_engine(cls.url)
+        Base.metadata.create_all(cls.engine)
+        cls.entrada = os.path.join(cls.diretorio, "entrada")
+        os.makedirs(cls.entrada)
+        arquivos = {
+            "operadores.csv": OPERADORES,
+            "sitef_valido.csv": SITEF_VALIDO,
+            "sitef_operador_ausente.csv": SITEF_OPERADOR_AUSENTE,
+            "anotacoes.txt": "nada a importar\n",
+        }
+        for nome, conteudo in arquivos.items():
+            with open(os.path.join(cls.entrada, nome), "w", encoding="cp1252") as arquivo:
+                arquivo.write(conteudo)
+
+    def test_a_identificar_tipo(self):
+        """O tipo vem do cabeçalho, não do nome do arquivo
+        """
+        self.assertEqual(identificar_tipo(os.path.join(self.entrada, "operadores.csv")), "operadores")
+        self.assertEqual(identificar_tipo(os.path.join(self.entrada, "sitef_valido.csv")), "transacoes")
+        self.assertIsNone(identificar_tipo(os.path.join(self.entrada, "anotacoes.txt")))
+
+    def test_b_importar_diretorio(self):
+        """Um relatório com falha não desfaz os demais e vai para erros com a mensagem
+        """
+        with Importador(self.url, self.entrada, processos=2) as importador:
+            importador.observar(uma_vez=True)
+            resultados = importador.importar(importador.pendentes())
+
+        self.assertDictEqual(resultados, {})
+        self.assertListEqual(
+            sorted(os.listdir(importador.arquivados)), ["operadores.csv", "sitef_valido.csv"]
+            )
+        self.assertListEqual(sorted(os.listdir(importador.erros)), [
+            "anotacoes.txt", "anotacoes.txt.erro.txt",
+            "sitef_operador_ausente.csv", "sitef_operador_ausente.csv.erro.txt"
+            ])
+        with sessionmaker(self.engine)() as session:
+            self.assertEqual(len(Operador.todos(session)), 2)
+            self.assertEqual(session.query(Transacao).count(), 2)
+
+    @classmethod
+    def tearDownClass(cls):
+        Base.metadata.drop_all(bind=cls.engine)
+        cls.engine.dispose()
+
+
+if __name__ == '__main__':
+    unittest.main()
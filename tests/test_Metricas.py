@@ -0,0 +1,38 @@
+import unittest
+import json
+from metricas import RegistroMetricas
+
+
+class TestRegistroMetricas(unittest.TestCase):
+    """Acumulação dos tempos por etapa
+    """
+    def test_a_medir(self):
+        """Chamadas e linhas são somadas por etapa, inclusive quando o bloco levanta exceção
+        """
+        registro = RegistroMetricas()
+        with registro.medir("parse.filtro", linhas=10):
+            pass
+        with self.assertRaises(ValueError):
+            with registro.medir("parse.filtro") as medicao:
+                medicao["linhas"] = 5
+                raise ValueError()
+        resumo = registro.resumo()["parse.filtro"]
+        self.assertEqual(resumo["chamadas"], 2)
+        self.assertEqual(resumo["linhas"], 15)
+
+    def test_b_incorporar_e_json(self):
+        """Métricas exportadas por outro processo entram no resumo e no JSON
+        """
+        outro = RegistroMetricas()
+        outro.registrar("gravacao.insert", 0.5, linhas=1000)
+        registro = RegistroMetricas()
+        registro.registrar("gravacao.insert", 1.5, linhas=1000)
+        registro.incorporar(outro.exportar())
+        etapas = json.loads(registro.para_json())["etapas"]
+        self.assertEqual(etapas["gravacao.insert"]["chamadas"], 2)
+        self.assertEqual(etapas["gravacao.insert"]["total_ms"], 2000)
+        self.assertEqual(etapas["gravacao.insert"]["linhas_por_segundo"], 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
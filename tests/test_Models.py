@@ -3,14 +3,21 @@ import logging
 import os
 from datetime import datetime, timedelta
 import random
+import io
+import tempfile
+from unittest import mock
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.dialects import mysql, sqlite, postgresql
 import pandas as pd
-from models import Operador,Transacao, Base
+from models import Operador,Transacao, ResumoDiario, ResumoHorario, VersaoDados, MarcaIngestao, JobIngestao, Base, hora_do_dia, dia_da_semana
+from ingestao import executar_worker, ingerir_transacoes
+from migracoes import migrar_transacao_compacta
+from parsers import ParserRelatorioSITEF
+import sqlalchemy
 
-TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
-if TEST_DATABASE_URL is None:
-    raise ValueError("Variável de ambiente TEST_DATABASE_URL ausente")
+# sem a variável de ambiente os testes rodam num SQLite em memória
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL", "sqlite://")
 logging.basicConfig(level=logging.ERROR)
 logger = logging.getLogger(__name__)
 
@@ -84,7 +91,8 @@ class TestOperador(unittest.TestCase):
         nomeado com "a" para execução na ordem correta
         """
         logger.info("Iniciando gravação no banco")
-        Operador.gravar_banco(self.df_operadores, self.session)
+        resumo = Operador.gravar_banco(self.df_operadores, self.session)
+        self.assertEqual(resumo["inseridos"], 10)
         todos = Operador.todos(self.session)
         logger.info("Tamanho da lista de todos os operadores: %s", len(todos))
         self.assertEqual(len(todos),10)
@@ -104,7 +112,8 @@ class TestOperador(unittest.TestCase):
         """Grava as transações geradas no banco
         """
         logger.info("Grava as transacoes no banco")
-        Transacao.gravar_banco(self.df_transacoes, self.session)
+        gravadas = Transacao.gravar_banco(self.df_transacoes, self.session)
+        self.assertEqual(gravadas["inseridas"], len(self.df_transacoes))
 
     def test_d_ranking(self):
         """Consulta as transações gravadas no banco com consulta válida e uma inválida
@@ -127,6 +136,250 @@ class TestOperador(unittest.TestCase):
         except Transacao.exc.ConsultaInvalida:
             self.assertTrue(True)
 
+    def test_e_regravar_transacoes(self):
+        """Gravar o mesmo relatório novamente não duplica transações
+        """
+        gravadas = Transacao.gravar_banco(self.df_transacoes, self.session)
+        self.assertEqual(gravadas["inseridas"], 0)
+        self.assertEqual(gravadas["ignoradas_conflito"], len(self.df_transacoes))
+        # mesmos NSUs com outra data, fora do período do relatório original, também não são contados nem resumidos
+        df = self.df_transacoes.copy()
+        df["Datetime"] = df["Datetime"] + timedelta(days=400)
+        gravadas = Transacao.gravar_banco(df, self.session)
+        self.assertEqual(gravadas["inseridas"], 0)
+        self.assertEqual(self.session.query(ResumoDiario).filter(ResumoDiario.data > datetime(2023, 12, 31).date()).count(), 0)
+
+    def test_e2_gravacao_concorrente(self):
+        """NSU gravado por outro processo entre a consulta e o INSERT não entra na contagem nem no resumo
+        """
+        df = self.df_transacoes.head(2).copy()
+        df["Nsu"] = [7001, 7002]
+        df["Datetime"] = datetime(2023, 3, 1, 10, 0)
+        insert_original = Transacao._insert_ignorando_duplicadas
+
+        def insert_apos_concorrente(session):
+            session.execute(sqlalchemy.insert(Transacao.__table__).values(
+                nsu=7002, codigo_operador=1, pdv=1, tipo_transacao="Compra Pix",
+                estado_transacao="Efetuada PDV", data_transacao=datetime(2023, 3, 2, 10, 0)
+                ))
+            return insert_original(session)
+
+        self.addCleanup(self.remover_marco)
+        with mock.patch.object(Transacao, "_insert_ignorando_duplicadas", staticmethod(insert_apos_concorrente)):
+            gravadas = Transacao.gravar_banco(df, self.session)
+        if not self.engine.dialect.insert_executemany_returning:
+            self.skipTest("banco sem INSERT ... RETURNING em lote")
+        self.assertEqual(gravadas["inseridas"], 1)
+        self.assertEqual(gravadas["ignoradas_conflito"], 1)
+        resumo_marco = self.session.query(ResumoDiario).filter(ResumoDiario.data == datetime(2023, 3, 1).date()).all()
+        self.assertEqual(sum(r.quantidade for r in resumo_marco), 1)
+
+    def remover_marco(self):
+        """Desfaz as gravações de março do teste de gravação concorrente, fora do período dos demais testes
+        """
+        self.session.query(Transacao).filter(Transacao.nsu.in_([7001, 7002])).delete()
+        self.session.query(ResumoDiario).filter(ResumoDiario.data >= datetime(2023, 3, 1).date()).delete()
+        self.session.commit()
+
+    def test_f_operador_ausente(self):
+        """Transações de operadores não cadastrados geram exceção com todos os códigos ausentes
+        """
+        df = self.df_transacoes.head(2).copy()
+        df["Nsu"] = [5001, 5002]
+        df["Operador"] = [98, 99]
+        with self.assertRaises(Transacao.exc.OperadorAusente) as contexto:
+            Transacao.gravar_banco(df, self.session)
+        self.assertListEqual(contexto.exception.args[1], [98, 99])
+
+    def test_g_atualizar_operadores(self):
+        """Somente operadores com nome ou login diferentes são atualizados
+        """
+        df = self.df_operadores.copy()
+        df.loc[0, "Nome"] = "Maria Clara"
+        resumo = Operador.gravar_banco(df, self.session)
+        self.assertDictEqual(resumo, {"inseridos": 0, "atualizados": 1, "inalterados": 9})
+        self.assertEqual(Operador.operador_por_codigo(self.session, 1).nome, "Maria Clara")
+
+    def test_h_limites_mes(self):
+        """O intervalo mensal é semiaberto e vira o ano em dezembro
+        """
+        self.assertEqual(Transacao._limites_mes(1, 2023), (datetime(2023, 1, 1), datetime(2023, 2, 1)))
+        self.assertEqual(Transacao._limites_mes(12, 2023), (datetime(2023, 12, 1), datetime(2024, 1, 1)))
+
+    def test_i_tabela_mensal(self):
+        """A tabela mensal agrega por dia no próprio banco, inclusive em janeiro
+        """
+        df = Transacao.tabela_mensal_quantidade_transacoes(self.session, 1, 2023)
+        self.assertEqual(len(df), 1)
+        self.assertEqual(df["data_movimento"].iloc[0], "01/01/2023")
+        self.assertEqual(df["contagem_transacoes"].iloc[0], len(self.df_transacoes))
+        self.assertEqual(df["primeira_transacao"].iloc[0], "00:00")
+        self.assertEqual(df["ultima_transacao"].iloc[0], "00:19")
+
+    def test_j_resumo_diario(self):
+        """O ranking de dias inteiros vem do resumo e coincide com a contagem das transações
+        """
+        inicio = datetime.strptime("01/01/2023 00:00:00", "%d/%m/%Y %H:%M:%S")
+        pelo_resumo = Transacao.ranking_range_data(self.session, inicio, inicio.replace(hour=23, minute=59, second=59))
+        pelas_transacoes = Transacao.ranking_range_data(self.session, inicio, inicio + timedelta(days=1))
+        self.assertListEqual(
+            pelo_resumo.sort_values("codigo_operador").values.tolist(),
+            pelas_transacoes.sort_values("codigo_operador").values.tolist()
+            )
+
+        linhas_antes = self.session.query(ResumoDiario).count()
+        self.assertEqual(ResumoDiario.reconstruir(self.session), linhas_antes)
+        total = sum(resumo.quantidade for resumo in self.session.query(ResumoDiario))
+        self.assertEqual(total, len(self.df_transacoes))
+
+    def test_k_versao_dados(self):
+        """A versão dos dados começa em zero e avança a cada incremento
+        """
+        versao = VersaoDados.atual(self.session)
+        self.assertEqual(VersaoDados.incrementar(self.session), versao + 1)
+        self.assertEqual(VersaoDados.incrementar(self.session), versao + 2)
+
+    def test_l_mesmo_segundo_mesmo_pdv(self):
+        """Dois pix no mesmo PDV e no mesmo segundo são gravados, a chave é o NSU do SITEF
+        """
+        momento = datetime(2023, 3, 1, 12, 0, 0)
+        df = pd.DataFrame({
+            "Nsu": [5001, 5002],
+            "Operador": [1, 2],
+            "Pdv": ["P001", "P001"],
+            "Transacao": "Compra Pix",
+            "Estado Transacao": "Efetuada PDV",
+            "Datetime": [momento, momento]
+        })
+        self.assertEqual(Transacao.gravar_banco(df, self.session)["inseridas"], 2)
+
+    def test_m_mapa_calor_e_vazao(self):
+        """Transações de 01/01/2023, um domingo, caem no dia 0 e na hora 0
+        """
+        inicio = datetime(2023, 1, 1)
+        fim = datetime(2023, 1, 1, 23, 59, 59)
+        mapa = Transacao.mapa_calor_semana_hora(self.session, inicio, fim)
+        self.assertListEqual(mapa.values.tolist(), [[0, 0, len(self.df_transacoes)]])
+        vazao = Transacao.vazao_por_pdv(self.session, inicio, fim)
+        self.assertEqual(vazao["contagem"].sum(), len(self.df_transacoes))
+        self.assertTrue((vazao["hora"] == 0).all())
+
+    def test_m2_resumo_horario(self):
+        """Dias inteiros vêm do resumo horário e coincidem com a contagem das transações,
+        também depois da reconstrução
+        """
+        inicio = datetime(2023, 1, 1)
+        fim = datetime(2023, 1, 1, 23, 59, 59)
+        # período parcial, agregado da tabela transacao
+        parcial = (inicio, inicio + timedelta(hours=23))
+        self.assertListEqual(
+            Transacao.vazao_por_pdv(self.session, inicio, fim).values.tolist(),
+            Transacao.vazao_por_pdv(self.session, *parcial).values.tolist()
+            )
+        linhas = self.session.query(ResumoHorario).filter(ResumoHorario.data == inicio.date()).all()
+        self.assertEqual(sum(resumo.quantidade for resumo in linhas), len(self.df_transacoes))
+        self.assertEqual(ResumoHorario.reconstruir(self.session, inicio.date(), inicio.date()), len(linhas))
+        self.assertListEqual(
+            Transacao.mapa_calor_semana_hora(self.session, inicio, fim).values.tolist(),
+            Transacao.mapa_calor_semana_hora(self.session, *parcial).values.tolist()
+            )
+
+    def test_n_marca_ingestao(self):
+        """Relatórios sobrepostos: o trecho anterior à marca do PDV e os arquivos idênticos são descartados
+        """
+        cabecalho = "Data;Hora;Pdv;Transacao;Operador;Estado Transacao;Nsu\n"
+        primeiro = cabecalho + "01/05/2023;10:00:00;P001;Compra Pix;1;Efetuada PDV;7001\n" \
+                             + "01/05/2023;11:00:00;P001;Compra Pix;2;Efetuada PDV;7002\n"
+        segundo = primeiro + "01/05/2023;12:00:00;P001;Compra Pix;3;Efetuada PDV;7003\n"
+        resultado = ingerir_transacoes(io.StringIO(primeiro), self.session)
+        self.assertEqual(resultado["inseridas"], 2)
+        self.assertTrue(ingerir_transacoes(io.StringIO(primeiro), self.session)["arquivo_repetido"])
+        resultado = ingerir_transacoes(io.StringIO(segundo), self.session)
+        self.assertDictEqual(resultado, {
+            "inseridas": 1, "ignoradas_marca": 1, "ignoradas_conflito": 1, "arquivo_repetido": False
+            })
+
+    def test_o_ranking_paginado(self):
+        """As páginas percorridas pela chave reproduzem o ranking completo, e a busca filtra por nome ou código
+        """
+        inicio = datetime(2023, 1, 1)
+        for fim in (inicio.replace(hour=23, minute=59, second=59), inicio + timedelta(hours=12)):
+            completo = Transacao.ranking_range_data(self.session, inicio, fim)
+            self.assertTrue(completo["contagem_pix"].is_monotonic_decreasing)
+            paginas, apos = [], None
+            # limite de páginas: um cursor que não avança falha o teste em vez de travá-lo
+            for _ in range(10):
+                pagina, total = Transacao.ranking_paginado(self.session, inicio, fim, limite=3, apos=apos)
+                if pagina.empty:
+                    break
+                paginas.append(pagina)
+                apos = (pagina["contagem_pix"].iloc[-1], pagina["codigo_operador"].iloc[-1])
+            self.assertEqual(total, len(completo))
+            self.assertListEqual(pd.concat(paginas).values.tolist(), completo.values.tolist())
+
+        # operadores sorteados nas transações geradas, a busca só encontra os que têm transações no período
+        com_transacoes = set(self.df_transacoes["Operador"])
+        pagina, total = Transacao.ranking_paginado(self.session, inicio, inicio + timedelta(days=1), busca="RAIM")
+        self.assertEqual(total, int(3 in com_transacoes))
+        self.assertListEqual(pagina["codigo_operador"].tolist(), [3] if 3 in com_transacoes else [])
+        pagina, total = Transacao.ranking_paginado(self.session, inicio, inicio + timedelta(days=1), busca="10")
+        self.assertListEqual(pagina["codigo_operador"].tolist(), [10] if 10 in com_transacoes else [])
+        _, total = Transacao.ranking_paginado(self.session, datetime(1990, 1, 1), datetime(1990, 1, 2))
+        self.assertEqual(total, 0)
+
+    def test_p_comparar_periodos(self):
+        """Cada período da comparação coincide com o ranking do mesmo período, e as diferenças são contra o primeiro
+        """
+        dia = datetime(2023, 1, 1)
+        periodos = [
+            (dia, dia.replace(minute=9, second=59)),
+            (dia.replace(minute=10), dia.replace(minute=19, second=59)),
+            (dia, dia.replace(hour=23, minute=59, second=59)),
+            ]
+        df = Transacao.comparar_periodos(self.session, periodos)
+        for n, (inicio, fim) in enumerate(periodos, start=1):
+            ranking = Transacao.ranking_range_data(self.session, inicio, fim).set_index("codigo_operador")["contagem_pix"]
+            por_operador = df.set_index("codigo_operador")[f"contagem_{n}"]
+            self.assertDictEqual(por_operador[por_operador > 0].to_dict(), ranking.to_dict())
+        self.assertListEqual(df["diferenca_3"].tolist(), (df["contagem_3"] - df["contagem_1"]).tolist())
+
+        por_dia = Transacao.comparar_periodos(
+            self.session, [(dia, dia.replace(hour=23, minute=59, second=59)), (dia - timedelta(days=1), dia - timedelta(seconds=1))], por="dia"
+            )
+        self.assertListEqual(por_dia[["contagem_1", "contagem_2", "diferenca_2"]].values.tolist()[0], [20, 0, -20])
+        self.assertEqual(por_dia["variacao_2"].iloc[0], -100)
+        with self.assertRaises(Transacao.exc.ConsultaInvalida):
+            Transacao.comparar_periodos(self.session, periodos[:1])
+
+    def test_q_diretorio_operadores(self):
+        """Nomes das transações vêm do diretório ou do relacionamento carregado antes, sem uma consulta por linha
+        """
+        diretorio = Operador.diretorio(self.session)
+        self.assertEqual(len(diretorio), 10)
+        self.assertListEqual(list(diretorio.nomes_por_codigo([10, 99, 3], ausente="?")), ["Andrei", "?", "Raimunda"])
+        self.assertTrue(Operador.existe(self.session, 5))
+        self.assertFalse(Operador.existe(self.session, 99))
+
+        inicio, fim = datetime(2023, 1, 1), datetime(2023, 1, 1, 23, 59, 59)
+        consultas = []
+        contar = lambda *args: consultas.append(args[2])
+        sqlalchemy.event.listen(self.engine, "before_cursor_execute", contar)
+        try:
+            for carregar_operador in (False, True):
+                self.session.expire_all()
+                consultas.clear()
+                dicionarios = [t.to_dict() for t in Transacao.listar(self.session, inicio, fim, carregar_operador)]
+                # a listagem, e com carregar_operador a consulta única dos operadores
+                self.assertEqual(len(consultas), 1 + carregar_operador)
+        finally:
+            sqlalchemy.event.remove(self.engine, "before_cursor_execute", contar)
+        df = Transacao.listar_df(self.session, inicio, fim)
+        self.assertListEqual(df["nome_operador"].tolist(), [d["nome_operador"] for d in dicionarios])
+
+        # operador gravado atualiza o diretório
+        Operador.gravar_banco(pd.DataFrame({"Código": [11], "Nome": ["Nova"], "Logname": ["nova11"]}), self.session)
+        self.assertEqual(Operador.diretorio(self.session).obter(11), ("Nova", "nova11"))
+
     @classmethod
     def tearDownClass(cls):
         """Limpa o banco de dados para evitar resíduos de interferência no teste
@@ -137,5 +390,239 @@ class TestOperador(unittest.TestCase):
         cls.session.close()
 
 
+class TestDialetos(unittest.TestCase):
+    """Verifica a formatação de datas gerada para cada banco suportado
+    """
+    def compilar_mensal(self, dialeto) -> str:
+        return str(Transacao._consulta_mensal(1, 2023).compile(dialect=dialeto))
+
+    def test_mysql(self):
+        sql = self.compilar_mensal(mysql.mysqldb.dialect())
+        self.assertIn("DATE_FORMAT(transacao.data_transacao, '%%d/%%m/%%Y')", sql)
+        self.assertIn("DATE_FORMAT(min(transacao.data_transacao), '%%H:%%i')", sql)
+
+    def test_sqlite(self):
+        sql = self.compilar_mensal(sqlite.dialect())
+        self.assertIn("strftime('%d/%m/%Y', transacao.data_transacao)", sql)
+        self.assertIn("strftime('%H:%M', max(transacao.data_transacao))", sql)
+
+    def test_postgresql(self):
+        sql = self.compilar_mensal(postgresql.dialect())
+        self.assertIn("to_char(transacao.data_transacao, 'DD/MM/YYYY')", sql)
+        self.assertIn("to_char(min(transacao.data_transacao), 'HH24:MI')", sql)
+
+    def test_hora_e_dia_da_semana(self):
+        coluna = Transacao.__table__.c.data_transacao
+        esperado = {
+            mysql.mysqldb.dialect(): ("HOUR(transacao.data_transacao)", "(DAYOFWEEK(transacao.data_transacao) - 1)"),
+            sqlite.dialect(): ("CAST(strftime('%H', transacao.data_transacao) AS INTEGER)",
+                               "CAST(strftime('%w', transacao.data_transacao) AS INTEGER)"),
+            postgresql.dialect(): ("CAST(EXTRACT(HOUR FROM transacao.data_transacao) AS INTEGER)",
+                                   "CAST(EXTRACT(DOW FROM transacao.data_transacao) AS INTEGER)"),
+        }
+        for dialeto, (hora, dia_semana) in esperado.items():
+            self.assertEqual(str(hora_do_dia(coluna).compile(dialect=dialeto)), hora)
+            self.assertEqual(str(dia_da_semana(coluna).compile(dialect=dialeto)), dia_semana)
+
+
+class TestJobIngestao(unittest.TestCase):
+    """Testa a fila de arquivos enviados e o worker de ingestão
+    """
+    CSV_OPERADORES = "Código;Nome;Logname\n1;Maria;maria1\n2;José;jose2\n"
+    CSV_SITEF = (
+        "Data;Hora;Pdv;Transacao;Operador;Estado Transacao;Nsu\n"
+        "02/01/2023;08:00:00;P001;Compra Pix;1;Efetuada PDV;1\n"
+        "02/01/2023;08:01:00;P001;Compra Pix;2;Efetuada PDV;2\n"
+        "02/01/2023;08:02:00;P002;Compra Pix;2;Negada;3\n"
+    )
+
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = create_engine(TEST_DATABASE_URL)
+        Base.metadata.create_all(bind=cls.engine)
+        cls.Session = sessionmaker(cls.engine, autoflush=False)
+        cls.session = cls.Session()
+        cls.spool = tempfile.TemporaryDirectory()
+
+    def test_a_enfileirar_sem_duplicar(self):
+        """O mesmo arquivo enviado duas vezes gera um único job
+        """
+        conteudo = self.CSV_OPERADORES.encode("cp1252")
+        job, novo = JobIngestao.enfileirar(self.session, "operadores", "operadores.csv", conteudo, self.spool.name)
+        self.assertTrue(novo)
+        repetido, novo = JobIngestao.enfileirar(self.session, "operadores", "copia.csv", conteudo, self.spool.name)
+        self.assertFalse(novo)
+        self.assertEqual(repetido.id, job.id)
+
+    def test_b_worker_processa_fila(self):
+        """O worker grava operadores e transações e registra as linhas de cada job
+        """
+        JobIngestao.enfileirar(self.session, "transacoes", "sitef.csv", self.CSV_SITEF.encode(), self.spool.name)
+        executar_worker(self.Session, uma_vez=True)
+        jobs = JobIngestao.recentes(self.session)
+        self.assertListEqual(list(jobs["estado"]), [JobIngestao.CONCLUIDO, JobIngestao.CONCLUIDO])
+        self.assertListEqual(list(jobs["linhas"]), [2, 2])
+        # arquivos de jobs concluídos saem do spool
+        self.assertListEqual(os.listdir(self.spool.name), [])
+
+    def test_c_worker_grava_lote(self):
+        """Relatórios pendentes ao mesmo tempo são gravados juntos, com o NSU repetido entre arquivos uma única vez
+        """
+        loja_1 = "Data;Hora;Pdv;Transacao;Operador;Estado Transacao;Nsu\n" \
+                 "03/01/2023;08:00:00;P003;Compra Pix;1;Efetuada PDV;10\n" \
+                 "03/01/2023;08:05:00;P004;Compra Pix;1;Efetuada PDV;11\n"
+        loja_2 = "Data;Hora;Pdv;Transacao;Operador;Estado Transacao;Nsu\n" \
+                 "03/01/2023;08:05:00;P004;Compra Pix;1;Efetuada PDV;11\n" \
+                 "03/01/2023;09:00:00;P005;Compra Pix;2;Efetuada PDV;12\n"
+        JobIngestao.enfileirar(self.session, "transacoes", "loja_1.csv", loja_1.encode(), self.spool.name)
+        JobIngestao.enfileirar(self.session, "transacoes", "loja_2.csv", loja_2.encode(), self.spool.name)
+        executar_worker(self.Session, uma_vez=True)
+        jobs = JobIngestao.recentes(self.session, limite=2)
+        self.assertListEqual(list(jobs["estado"]), [JobIngestao.CONCLUIDO, JobIngestao.CONCLUIDO])
+        self.assertTrue(jobs["mensagem"].str.startswith("Lote de 2 arquivos: 3 inseridas").all())
+        self.assertEqual(self.session.query(Transacao).filter(Transacao.nsu.in_([10, 11, 12])).count(), 3)
+
+    def test_d_linha_invalida_em_bloco_posterior(self):
+        """Relatório com linha inválida depois do primeiro bloco é recusado sem gravar os blocos anteriores
+        """
+        sitef = "Data;Hora;Pdv;Transacao;Operador;Estado Transacao;Nsu\n" \
+                "04/01/2023;08:00:00;P001;Compra Pix;1;Efetuada PDV;20\n" \
+                "04/01/2023;08:01:00;P001;Compra Pix;1;Efetuada PDV;21\n" \
+                "04/01/2023;08:02:00;P001;Compra Pix;1;Efetuada PDV;22\n" \
+                "31/02/2023;08:03:00;P001;Compra Pix;1;Efetuada PDV;23\n"
+        JobIngestao.enfileirar(self.session, "transacoes", "invalido.csv", sitef.encode(), self.spool.name)
+        with mock.patch.object(ParserRelatorioSITEF, "TAMANHO_BLOCO", 2):
+            executar_worker(self.Session, uma_vez=True)
+        job = JobIngestao.recentes(self.session, limite=1).iloc[0]
+        self.assertEqual(job["estado"], JobIngestao.ERRO)
+        self.assertIn("linhas 5", job["mensagem"])
+        self.assertEqual(len(os.listdir(self.spool.name)), 1)
+        self.assertEqual(self.session.query(Transacao).filter(Transacao.nsu.between(20, 23)).count(), 0)
+
+    def test_e_lote_com_arquivos_recusados(self):
+        """No lote, arquivo inválido ou com operador ausente falha só o próprio job
+        """
+        cabecalho = "Data;Hora;Pdv;Transacao;Operador;Estado Transacao;Nsu\n"
+        arquivos = {
+            "valido.csv": cabecalho + "05/01/2023;08:00:00;P001;Compra Pix;1;Efetuada PDV;30\n",
+            "data_invalida.csv": cabecalho + "32/01/2023;08:00:00;P001;Compra Pix;1;Efetuada PDV;31\n",
+            "operador_ausente.csv": cabecalho + "05/01/2023;09:00:00;P001;Compra Pix;77;Efetuada PDV;32\n",
+        }
+        for nome, conteudo in arquivos.items():
+            JobIngestao.enfileirar(self.session, "transacoes", nome, conteudo.encode(), self.spool.name)
+        executar_worker(self.Session, uma_vez=True)
+        jobs = JobIngestao.recentes(self.session, limite=3).set_index("arquivo")
+        self.assertEqual(jobs.loc["valido.csv", "estado"], JobIngestao.CONCLUIDO)
+        self.assertEqual(jobs.loc["data_invalida.csv", "estado"], JobIngestao.ERRO)
+        self.assertEqual(jobs.loc["operador_ausente.csv", "estado"], JobIngestao.ERRO)
+        self.assertIn("77", jobs.loc["operador_ausente.csv", "mensagem"])
+        self.assertListEqual(
+            [t.nsu for t in self.session.query(Transacao).filter(Transacao.nsu.between(30, 32))], [30]
+            )
+
+    def test_f_lote_respeita_ordem_dos_operadores(self):
+        """Relatórios enviados depois de uma planilha de operadores não entram no lote antes dela
+        """
+        cabecalho = "Data;Hora;Pdv;Transacao;Operador;Estado Transacao;Nsu\n"
+        antes, _ = JobIngestao.enfileirar(self.session, "transacoes", "antes.csv",
+                                          (cabecalho + "06/01/2023;08:00:00;P001;Compra Pix;1;Efetuada PDV;40\n").encode(), self.spool.name)
+        JobIngestao.enfileirar(self.session, "operadores", "operadores.csv",
+                               "Código;Nome;Logname\n3;Ana;ana3\n".encode("cp1252"), self.spool.name)
+        JobIngestao.enfileirar(self.session, "transacoes", "depois.csv",
+                               (cabecalho + "06/01/2023;08:00:00;P001;Compra Pix;3;Efetuada PDV;41\n").encode(), self.spool.name)
+        with self.Session() as session:
+            self.assertEqual(JobIngestao.reservar_proximo(session).id, antes.id)
+            self.assertListEqual(JobIngestao.reservar_lote(session, "transacoes", 15), [])
+            JobIngestao.retomar_interrompidos(session)
+        executar_worker(self.Session, uma_vez=True)
+        jobs = JobIngestao.recentes(self.session, limite=3)
+        self.assertTrue((jobs["estado"] == JobIngestao.CONCLUIDO).all())
+        self.assertEqual(self.session.query(Transacao).filter(Transacao.nsu.in_([40, 41])).count(), 2)
+
+    def test_g_enfileirar_concorrente(self):
+        """Arquivo enviado por outro usuário entre a consulta e a gravação devolve o job já criado
+        """
+        conteudo = "Código;Nome;Logname\n4;Rita;rita4\n".encode("cp1252")
+        substituir = os.replace
+        envios = []
+
+        def enviar_em_outra_sessao(origem, destino):
+            substituir(origem, destino)
+            envios.append(destino)
+            if len(envios) == 1:
+                with self.Session() as outra:
+                    JobIngestao.enfileirar(outra, "operadores", "outro.csv", conteudo, self.spool.name)
+
+        with mock.patch("models.os.replace", side_effect=enviar_em_outra_sessao):
+            job, novo = JobIngestao.enfileirar(self.session, "operadores", "primeiro.csv", conteudo, self.spool.name)
+        self.assertFalse(novo)
+        self.assertEqual(job.nome_arquivo, "outro.csv")
+        self.assertEqual(job.estado, JobIngestao.PENDENTE)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.session.commit()
+        Base.metadata.drop_all(bind=cls.engine)
+        cls.session.close()
+        cls.spool.cleanup()
+
+
+class TestMigracaoCompacta(unittest.TestCase):
+    """Testa a conversão da tabela transacao do esquema antigo para o compacto
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = create_engine(TEST_DATABASE_URL)
+        if cls.engine.dialect.name not in ("mysql", "mariadb", "sqlite"):
+            raise unittest.SkipTest("Migração suportada apenas em MySQL/MariaDB e SQLite")
+        metadata_antigo = sqlalchemy.MetaData()
+        cls.tabela_antiga = sqlalchemy.Table(
+            "transacao", metadata_antigo,
+            sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
+            sqlalchemy.Column("nsu", sqlalchemy.String(30), unique=True),
+            sqlalchemy.Column("data_transacao", sqlalchemy.DateTime, nullable=False),
+            sqlalchemy.Column("pdv", sqlalchemy.String(10)),
+            sqlalchemy.Column("tipo_transacao", sqlalchemy.String(15)),
+            sqlalchemy.Column("estado_transacao", sqlalchemy.String(30)),
+            sqlalchemy.Column("codigo_operador", sqlalchemy.Integer),
+            sqlalchemy.Index("ix_transacao_data_transacao", "data_transacao"),
+        )
+        Base.metadata.create_all(cls.engine, tables=[Operador.__table__])
+        metadata_antigo.create_all(cls.engine)
+        data_transacao = datetime(2023, 1, 1, 10, 0, 0)
+        with cls.engine.begin() as conexao:
+            conexao.execute(sqlalchemy.insert(Operador.__table__).values(codigo_operador=1, nome="Maria", login="maria1"))
+            conexao.execute(sqlalchemy.insert(cls.tabela_antiga), [
+                {"nsu": f"{data_transacao + timedelta(minutes=i)}-P00{i}", "data_transacao": data_transacao + timedelta(minutes=i),
+                 "pdv": f"P00{i}", "tipo_transacao": "Compra Pix", "estado_transacao": "Efetuada PDV", "codigo_operador": 1}
+                for i in range(5)
+            ])
+
+    def test_migrar(self):
+        """Todas as linhas são copiadas em lotes, com PDV inteiro e NSU legado negativo
+        """
+        resultado = migrar_transacao_compacta(self.engine, tamanho_lote=2)
+        self.assertEqual(resultado["linhas"], 5)
+        self.assertSetEqual(set(resultado["depois"]), {"dados", "indices"})
+        Session = sessionmaker(self.engine)
+        with Session() as session:
+            transacoes = session.query(Transacao).order_by(Transacao.id).all()
+            self.assertListEqual([t.pdv for t in transacoes], [0, 1, 2, 3, 4])
+            self.assertTrue(all(t.nsu < 0 for t in transacoes))
+            self.assertEqual(transacoes[0].estado_transacao, "Efetuada PDV")
+            self.assertEqual(session.query(ResumoDiario).count(), 5)
+            self.assertEqual(session.query(ResumoHorario).count(), 5)
+            # NSU legado independente do fuso do servidor
+            self.assertEqual(transacoes[0].nsu, -(1672567200 * 10000))
+            self.assertDictEqual(MarcaIngestao.carregar(session), {
+                i: datetime(2023, 1, 1, 10, i) for i in range(5)
+                })
+            self.assertEqual(VersaoDados.atual(session), 1)
+
+    @classmethod
+    def tearDownClass(cls):
+        Base.metadata.drop_all(bind=cls.engine)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,92 @@
+import unittest
+import io
+from datetime import datetime
+import pandas as pd
+from parsers import ParserRelatorioSITEF, ParserPlanilhaOperadores
+
+CSV_SITEF = """Data;Hora;Pdv;Transacao;Operador;Estado Transacao;Nsu;Valor
+21/10/2023;08:01:02;P001;Compra Pix;1;Efetuada PDV;100;10,00
+21/10/2023;08:05:10;P002;Compra Pix;2;Negada;101;5,00
+21/10/2023;09:15:00;P001;Dinheiro;1;Efetuada PDV;102;7,50
+21/10/2023;18:30:59;P003;Compra Pix;3;Efetuada PDV;103;20,00
+"""
+
+
+class TestParserRelatorioSITEF(unittest.TestCase):
+    """Testa a leitura do relatório de transações do SITEF
+    """
+    def test_a_filtra_pix_efetuados(self):
+        """Somente compras pix efetuadas permanecem no dataframe
+        """
+        parser = ParserRelatorioSITEF(io.StringIO(CSV_SITEF))
+        self.assertEqual(len(parser.df), 2)
+        self.assertListEqual(list(parser.df["Operador"]), [1, 3])
+        self.assertEqual(parser.df["Datetime"].iloc[1], datetime(2023, 10, 21, 18, 30, 59))
+
+    def test_b_colunas_convertidas(self):
+        """Data e hora viram a coluna Datetime, operador e NSU viram inteiros e o PDV fica como no relatório
+        """
+        parser = ParserRelatorioSITEF(io.StringIO(CSV_SITEF))
+        self.assertListEqual(
+            list(parser.df["Datetime"]), [datetime(2023, 10, 21, 8, 1, 2), datetime(2023, 10, 21, 18, 30, 59)]
+            )
+        self.assertListEqual(list(parser.df["Operador"]), [1, 3])
+        self.assertListEqual(list(parser.df["Nsu"]), [100, 103])
+        self.assertListEqual(list(parser.df["Pdv"]), ["P001", "P003"])
+
+    def test_c_em_blocos(self):
+        """A leitura em blocos produz as mesmas transações da leitura completa
+        """
+        completo = ParserRelatorioSITEF(io.StringIO(CSV_SITEF))
+        blocos = list(ParserRelatorioSITEF.em_blocos(io.StringIO(CSV_SITEF), tamanho_bloco=2))
+        self.assertEqual(len(blocos), 2)
+        self.assertListEqual(
+            [nsu for bloco in blocos for nsu in bloco["Nsu"]],
+            list(completo.df["Nsu"])
+            )
+
+
+    def test_d_formatos_e_apelidos(self):
+        """Separador, codificação e nomes alternativos das colunas são reconhecidos, inclusive em xlsx
+        """
+        esperado = ParserRelatorioSITEF(io.StringIO(CSV_SITEF)).df
+        virgula = CSV_SITEF.replace(";", ",").replace("10,00", "10").replace("5,00", "5").replace("7,50", "7").replace("20,00", "20")
+        virgula = virgula.replace("Data,Hora,Pdv,Transacao", "Data da Transação,Hora,PDV,Tipo Transação")
+        for conteudo in (virgula.encode("utf-8-sig"), virgula.encode("cp1252"), CSV_SITEF.replace(";", "\t").encode()):
+            parser = ParserRelatorioSITEF(io.BytesIO(conteudo))
+            self.assertListEqual(list(parser.df["Datetime"]), list(esperado["Datetime"]))
+            self.assertListEqual(list(parser.df["Nsu"]), list(esperado["Nsu"]))
+        planilha = io.BytesIO()
+        pd.read_csv(io.StringIO(CSV_SITEF), sep=";").to_excel(planilha, index=False)
+        planilha.seek(0)
+        parser = ParserRelatorioSITEF(planilha)
+        self.assertEqual(parser.formato.tipo, "xlsx")
+        self.assertListEqual(list(parser.df["Datetime"]), list(esperado["Datetime"]))
+
+    def test_e_linhas_invalidas(self):
+        """Compras pix com campos inválidos recusam o arquivo citando as linhas, as demais transações não são validadas
+        """
+        invalido = CSV_SITEF.replace("18:30:59", "18h30").replace("P002;Compra Pix;2;Negada;101", "P002;Compra Pix;2;Negada;x")
+        with self.assertRaises(ParserRelatorioSITEF.exc.ArquivoInvalido) as contexto:
+            ParserRelatorioSITEF(io.StringIO(invalido))
+        self.assertListEqual(contexto.exception.args[1], [5])
+        with self.assertRaises(ParserRelatorioSITEF.exc.ArquivoInvalido) as contexto:
+            ParserRelatorioSITEF(io.StringIO("Data;Hora;Pdv\n21/10/2023;08:01:02;P001\n"))
+        self.assertIn("Nsu", contexto.exception.args[0])
+
+
+class TestParserPlanilhaOperadores(unittest.TestCase):
+    """Testa a leitura da planilha de operadores
+    """
+    def test_a_formatos(self):
+        """A planilha em cp1252 com ponto e vírgula e em UTF-8 com outros nomes de coluna produz o mesmo resultado
+        """
+        cp1252 = "Código;Nome;Logname\n1;José;jose\n".encode("cp1252")
+        utf8 = "codigo,nome,login\n1,José,jose\n".encode("utf-8")
+        for conteudo in (cp1252, utf8):
+            df = ParserPlanilhaOperadores(io.BytesIO(conteudo)).df
+            self.assertListEqual(df.values.tolist(), [[1, "José", "jose"]])
+
+
+if __name__ == '__main__':
+    unittest.main()